@@ -0,0 +1,133 @@
+"""
+多格式编码的语料基准：对一个目录中的所有图片分别用 "只输出有损 WebP"（原有行为）和 encode_best 的多格式候选编码，
+统计交付的总字节数、各格式被选中的次数、SSIM 分布和编码耗时。不写任何输出文件。
+
+用法:
+    python benchmarks/bench_formats.py                                   # 默认语料为 public/static/image
+    python benchmarks/bench_formats.py --corpus photos/ --formats webp,webp-lossless,avif --ssim-floor 0.98
+    python benchmarks/bench_formats.py --output formats.json             # 保存每张图片的明细
+
+注意 public/static/image 中的图片大多已经是有损 WebP，再次编码的收益会低于使用原始 JPEG/PNG 的语料。
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from image_encoder import (  # noqa: E402
+    FORMAT_AVIF, FORMAT_SUFFIXES, avif_supported, encode_best, encode_to_target,
+)
+import process_images  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(ROOT, 'public', 'static', 'image')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.avif')
+
+
+def corpus_files(corpus, limit=None):
+    paths = []
+    for directory, _, names in os.walk(corpus):
+        paths.extend(os.path.join(directory, name) for name in names if name.lower().endswith(IMAGE_EXTENSIONS))
+    paths.sort()
+    return paths[:limit] if limit else paths
+
+
+def bench_image(path, formats, ssim_floor, executor):
+    """返回单张图片的统计：原有流程（有损 WebP）与多格式选择的字节数和耗时。"""
+    from PIL import Image
+
+    with Image.open(path) as img:
+        img.load()
+        original_mode = img.mode
+        work_img = process_images.working_image(img)
+    max_bytes = process_images.MAX_FILE_SIZE_KB * 1024
+    # 原有流程：先转为 RGB（透明通道被丢弃），只输出有损 WebP
+    rgb_img = work_img if work_img.mode == 'RGB' else work_img.convert('RGB')
+    start = time.perf_counter()
+    before = encode_to_target(rgb_img, max_bytes, process_images.MIN_WEBP_QUALITY,
+                              process_images.INITIAL_WEBP_QUALITY)
+    before_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    best, candidates = encode_best(work_img, max_bytes, process_images.MIN_WEBP_QUALITY,
+                                   process_images.INITIAL_WEBP_QUALITY, formats=formats, ssim_floor=ssim_floor,
+                                   executor=executor)
+    after_seconds = time.perf_counter() - start
+    return {
+        'path': os.path.relpath(path, ROOT),
+        'mode': original_mode,
+        'size': list(work_img.size),
+        'bytes_in': os.path.getsize(path),
+        'bytes_before': len(before),
+        'bytes_after': len(best),
+        'format': best.format,
+        'ssim': best.ssim,
+        'candidates': {c.format: {'bytes': len(c), 'fits': c.fits, 'ssim': c.ssim} for c in candidates},
+        'seconds_before': before_seconds,
+        'seconds_after': after_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多格式编码语料基准：比较只用有损 WebP 与按图片选择最小格式的总字节数')
+    parser.add_argument('--corpus', type=str, default=DEFAULT_CORPUS, help='图片语料目录（递归查找）。')
+    parser.add_argument('--formats', type=str, default=','.join(FORMAT_SUFFIXES),
+                        help='逗号分隔的候选格式，默认全部（Pillow 不支持 AVIF 时自动去掉）。')
+    parser.add_argument('--ssim-floor', type=float, default=process_images.SSIM_FLOOR, help='有损候选的最低 SSIM。')
+    parser.add_argument('--limit', type=int, default=None, help='最多测量的图片数。')
+    parser.add_argument('--output', type=str, help='把每张图片的明细写入该 JSON 文件。')
+    args = parser.parse_args()
+
+    formats = [f.strip() for f in args.formats.split(',') if f.strip()]
+    if FORMAT_AVIF in formats and not avif_supported():
+        print("当前的 Pillow 不支持 AVIF 编码，跳过 avif。")
+        formats.remove(FORMAT_AVIF)
+    paths = corpus_files(args.corpus, args.limit)
+    if not paths:
+        parser.error(f'语料目录 {args.corpus} 中没有图片。')
+
+    rows = []
+    failed = 0
+    executor = process_images.variant_executor()
+    for path in paths:
+        try:
+            rows.append(bench_image(path, formats, args.ssim_floor, executor))
+        except Exception as e:
+            failed += 1
+            print(f"  [失败] {os.path.relpath(path, ROOT)}: {e}")
+
+    before = sum(r['bytes_before'] for r in rows)
+    after = sum(r['bytes_after'] for r in rows)
+    counts = {}
+    for r in rows:
+        counts[r['format']] = counts.get(r['format'], 0) + 1
+    ssims = [r['ssim'] for r in rows if r['ssim'] is not None]
+
+    print(f"--- 多格式编码基准 ({len(rows)} 张图片，候选 {', '.join(formats)}，SSIM 下限 {args.ssim_floor}) ---")
+    print(f"源图片总计:                 {sum(r['bytes_in'] for r in rows) / 1024:10.1f} KB")
+    print(f"只用有损 WebP（原有行为）:  {before / 1024:10.1f} KB")
+    print(f"按图片选择最小格式:         {after / 1024:10.1f} KB  ({(after - before) / before:+.1%})")
+    print(f"选中的格式: {'，'.join(f'{name} {count} 张' for name, count in sorted(counts.items()))}")
+    for name in sorted(counts):
+        chosen = [r for r in rows if r['format'] == name]
+        saved = sum(r['bytes_before'] - r['bytes_after'] for r in chosen)
+        print(f"  {name:<14} 节省 {saved / 1024:8.1f} KB")
+    if ssims:
+        print(f"选中的有损结果 SSIM: 最低 {min(ssims):.4f}，中位数 {statistics.median(ssims):.4f}")
+    print(f"编码耗时: 原有 {sum(r['seconds_before'] for r in rows):.1f}s，"
+          f"多格式 {sum(r['seconds_after'] for r in rows):.1f}s")
+    if failed:
+        print(f"无法解码: {failed} 张")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'formats': formats, 'ssim_floor': args.ssim_floor, 'images': rows,
+                       'bytes_before': before, 'bytes_after': after}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
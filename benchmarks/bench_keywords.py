@@ -0,0 +1,102 @@
+"""
+关键词相关度索引的基准：对 "每个关键词 x 每个菜品" 的完整组合，分别用逐对计算余弦相似度的嵌套循环和
+process_keywords 的稀疏倒排索引打分，比较耗时并确认两者得到的每个菜品的关键词排名完全相同。
+
+用法:
+    python benchmarks/bench_keywords.py                     # 默认使用 raw/ 下的关键词 CSV 和首页菜单
+    python benchmarks/bench_keywords.py --repeat 10         # 把关键词流重复 10 遍，模拟更大的关键词表
+    python benchmarks/bench_keywords.py --menu raw/pages/index-full-menu.json --menu raw/hawai-full-menu.json
+"""
+import argparse
+import heapq
+import itertools
+import math
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import process_keywords  # noqa: E402
+from process_keywords import DishIndex, generic_tokens, iter_keywords, load_dishes, rank_keywords, tokenize  # noqa: E402
+from process_menu import normalize_name  # noqa: E402
+
+
+def repeated_keywords(path, repeat):
+    """把关键词流重复 repeat 遍，仍然逐行读取。"""
+    return itertools.chain.from_iterable(iter_keywords(path) for _ in range(repeat))
+
+
+def naive_rank(index, rows, top_k, min_relevance, generic):
+    """原始做法：每个关键词与每个菜品逐对计算余弦相似度，结果格式与 rank_keywords 相同。"""
+    norms = [math.sqrt(sum(index.idf[token] ** 2 for token in dish['tokens'])) for dish in index.dishes]
+    heaps = [[] for _ in range(len(index))]
+    for sequence, row in enumerate(rows):
+        tokens = tokenize(normalize_name(row['keyword'])) - generic
+        known = [token for token in tokens if token in index.idf]
+        norm = math.sqrt(sum(index.idf[token] ** 2 for token in known) +
+                         (len(tokens) - len(known)) * process_keywords.UNKNOWN_TOKEN_WEIGHT ** 2)
+        weight = math.log1p(max(row['volume'], 0))
+        for dish_id, dish in enumerate(index.dishes):
+            dot = sum(index.idf[token] ** 2 for token in known if token in dish['tokens'])
+            if not dot:
+                continue
+            relevance = dot / (norm * norms[dish_id])
+            if relevance < min_relevance:
+                continue
+            entry = (relevance * weight, -sequence, relevance, row)
+            heap = heaps[dish_id]
+            if len(heap) < top_k:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+    return heaps
+
+
+def rankings(heaps):
+    return [[(row['keyword'], round(relevance, 9)) for _, _, relevance, row in sorted(heap, reverse=True)]
+            for heap in heaps]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='关键词相关度基准：比较逐对嵌套循环与稀疏倒排索引的完整组合打分耗时')
+    parser.add_argument('--keywords', default=os.path.join(ROOT, process_keywords.DEFAULT_KEYWORDS),
+                        help='关键词 CSV。')
+    parser.add_argument('--menu', action='append', default=None, help='菜单 JSON，可重复指定。')
+    parser.add_argument('--repeat', type=int, default=1, help='把关键词流重复的次数。')
+    parser.add_argument('--top', type=int, default=process_keywords.TOP_K, help='每个菜品保留的关键词数量。')
+    parser.add_argument('--min-relevance', type=float, default=process_keywords.MIN_RELEVANCE, help='最低相关度。')
+    parser.add_argument('--skip-naive', action='store_true', help='只测量倒排索引（关键词表很大时使用）。')
+    args = parser.parse_args()
+
+    menus = args.menu or [os.path.join(ROOT, path) for path in process_keywords.DEFAULT_MENUS]
+    start = time.perf_counter()
+    index = DishIndex(load_dishes(menus))
+    generic = generic_tokens(index, iter_keywords(args.keywords))
+    prepare_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    heaps, stats = rank_keywords(index, repeated_keywords(args.keywords, args.repeat), args.top,
+                                 args.min_relevance, generic)
+    indexed_seconds = time.perf_counter() - start
+
+    print(f"--- 关键词相关度基准 ({stats['keywords']} 个关键词 x {len(index)} 个菜品 = "
+          f"{stats['keywords'] * len(index)} 个组合) ---")
+    print(f"建立菜品索引并统计通用词: {prepare_seconds:8.3f}s  (通用词: {', '.join(sorted(generic))})")
+    print(f"倒排索引（含读取 CSV）:    {indexed_seconds:8.3f}s  (实际计算 {stats['pairs']} 个共享单词的组合)")
+    if args.skip_naive:
+        return
+
+    start = time.perf_counter()
+    naive = naive_rank(index, repeated_keywords(args.keywords, args.repeat), args.top, args.min_relevance, generic)
+    naive_seconds = time.perf_counter() - start
+    print(f"逐对嵌套循环（含读取 CSV）:{naive_seconds:8.3f}s  ({naive_seconds / indexed_seconds:.1f}x)")
+    same = rankings(naive) == rankings(heaps)
+    print(f"两种方法的排名{'完全相同' if same else '不一致！'}")
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+"""
+离线的图片流水线基准测试：生成合成菜单（JPEG/PNG/WebP 混合、多种尺寸，部分图片超出大小限制以触发压缩循环），
+由本地 CDN 提供图片（可配置延迟、带宽和错误注入），在不同引擎和并发数下运行 process_images.py，
+记录吞吐量 (项/秒)、CPU 时间、峰值内存和每张图片的编码次数；另外单独测量 finalize_and_compress_image。
+
+用法:
+    python benchmarks/bench_pipeline.py --items 60 --engines threads,staged --workers 2,4,8
+    python benchmarks/bench_pipeline.py --output bench.json                    # 保存结果
+    python benchmarks/bench_pipeline.py --baseline bench.json --max-regression 0.25  # CI：吞吐量下降超过25%或编码次数增加时退出码为1
+
+只支持 Linux / macOS（通过 os.wait4 读取子进程的资源占用）。
+"""
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from local_cdn import LocalCDN  # noqa: E402
+
+SCRIPT = os.path.join(ROOT, 'process_images.py')
+URL_PREFIX = '/static/bench/'
+FORMATS = (('JPEG', 'jpg', 'image/jpeg', 0.6), ('PNG', 'png', 'image/png', 0.25), ('WEBP', 'webp', 'image/webp', 0.15))
+SIZES = ((400, 300), (800, 600), (1200, 900), (1600, 1200))
+# 超出大小限制的图片：尺寸大且带噪点，WebP 在初始质量下远超 300KB
+OVERSIZE = (1800, 1350)
+
+
+def make_image(rng, size, noisy):
+    """生成一张类似照片的图片：渐变背景 + 若干色块，noisy 时叠加噪点使其难以压缩。"""
+    from PIL import Image, ImageDraw
+
+    width, height = size
+    img = Image.linear_gradient('L').resize(size).convert('RGB')
+    draw = ImageDraw.Draw(img)
+    for _ in range(8):
+        x, y = rng.randrange(width), rng.randrange(height)
+        draw.ellipse([x, y, x + width // 4, y + height // 4],
+                     fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    if noisy:
+        noise = Image.frombytes('RGB', size, rng.randbytes(width * height * 3))
+        img = Image.blend(img, noise, 0.35)
+    return img
+
+
+def build_menu(work_dir, count, oversize_ratio, distinct, seed):
+    """
+    生成 count 个菜品项和对应的图片字节。图片池中有 distinct 张不同的图片，按顺序分配给各个菜品（URL 互不相同）。
+    返回 (files, 菜单JSON所用的路径列表, 各格式数量)。
+    """
+    rng = random.Random(seed)
+    pool = []
+    for i in range(distinct):
+        fmt, ext, content_type, _ = rng.choices(FORMATS, weights=[f[3] for f in FORMATS])[0]
+        oversize = i < round(distinct * oversize_ratio)
+        size = OVERSIZE if oversize else rng.choice(SIZES)
+        buffer = io.BytesIO()
+        image = make_image(rng, size, noisy=oversize)
+        image.save(buffer, fmt, **({'quality': 92} if fmt in ('JPEG', 'WEBP') else {}))
+        pool.append((buffer.getvalue(), ext, content_type, oversize))
+
+    files = {}
+    paths = []
+    formats = {}
+    for i in range(count):
+        data, ext, content_type, oversize = pool[i % len(pool)]
+        path = f"/img/dish{i}{'-large' if oversize else ''}.{ext}"
+        files[path] = (data, content_type)
+        paths.append(path)
+        formats[ext] = formats.get(ext, 0) + 1
+    return files, paths, formats
+
+
+def write_menu(path, cdn, paths):
+    items = [{'title': f'Dish {i}', 'imageUrl': cdn.url(p)} for i, p in enumerate(paths)]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'Menu': {'Categories': [{'items': items}]}}, f)
+
+
+def engine_args(engine, workers):
+    """把统一的并发数映射到各引擎的参数：threads 为线程数，asyncio 为编码线程数，staged 为编码进程数（下载线程为其两倍）。"""
+    if engine == 'threads':
+        return ['--workers', str(workers)]
+    if engine == 'asyncio':
+        return ['--encode-workers', str(workers)]
+    return ['--encode-workers', str(workers), '--download-workers', str(workers * 2)]
+
+
+def run_pipeline(work_dir, cdn, paths, engine, workers):
+    """在全新的输出目录中运行一次 process_images.py，返回该次运行的指标。"""
+    run_dir = tempfile.mkdtemp(dir=work_dir)
+    menu_path = os.path.join(run_dir, 'menu.json')
+    report_path = os.path.join(run_dir, 'report.json')
+    write_menu(menu_path, cdn, paths)
+    command = [sys.executable, SCRIPT, menu_path, '--output-dir', os.path.join(run_dir, 'out'),
+               '--url-prefix', URL_PREFIX, '--proxy', 'none', '--no-cache', '--no-journal',
+               '--report', report_path, '--report-items', '--log-level', 'WARNING',
+               '--engine', engine, *engine_args(engine, workers)]
+
+    cdn.reset_counters()
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=stderr)
+        # wait4 返回该子进程（含其已回收的编码子进程）的资源占用
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError(f"{engine}/{workers} 运行失败:\n{stderr.read().decode(errors='replace')[-2000:]}")
+
+    with open(report_path, encoding='utf-8') as f:
+        report = json.load(f)
+    shutil.rmtree(run_dir, ignore_errors=True)
+
+    summary = report['summary']
+    encoded = [item for item in report['items'] if item['encodes']]
+    # ru_maxrss 在 Linux 上以 KB 为单位，macOS 上以字节为单位
+    peak_rss_kb = usage.ru_maxrss / 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+    return {
+        'engine': engine,
+        'workers': workers,
+        'wall_seconds': wall,
+        'items_per_second': len(paths) / wall,
+        'cpu_seconds': usage.ru_utime + usage.ru_stime,
+        'peak_rss_mb': peak_rss_kb / 1024,
+        'encodes_per_image': summary['encodes'] / len(encoded) if encoded else 0.0,
+        'succeeded': report['results']['success'],
+        'failed': report['results']['failed'],
+        'requests': cdn.requests,
+        'injected_errors': cdn.errors,
+        'encode_p95_ms': (summary['stages'].get('encode') or {}).get('p95', 0) * 1000,
+    }
+
+
+def bench_finalize(files, sample):
+    """
+    直接调用 finalize_and_compress_image 两轮：第一轮源图片（JPEG/PNG/WebP）完整解码并压缩为 WebP，
+    第二轮这些已合格的 WebP 只改写标记。返回两轮各自的平均耗时（毫秒）和平均编码次数。
+    """
+    import process_images
+
+    def measure(paths):
+        encodes = 0
+        start = time.perf_counter()
+        for path in paths:
+            stats = process_images.finalize_and_compress_image(path)
+            if stats:
+                encodes += stats['encodes']
+        elapsed = time.perf_counter() - start
+        return {'files': len(paths), 'mean_ms': elapsed / len(paths) * 1000, 'encodes_per_file': encodes / len(paths)}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        paths = []
+        for path, (data, _) in list(files.items())[:sample]:
+            local = os.path.join(temp_dir, os.path.basename(path))
+            with open(local, 'wb') as f:
+                f.write(data)
+            paths.append(local)
+        return {'recompress': measure(paths), 'restamp': measure(paths)}
+
+
+def compare(results, baseline, max_regression):
+    """与基线逐项比较，返回回归描述列表（为空表示没有回归）。"""
+    previous = {(r['engine'], r['workers']): r for r in baseline.get('runs', [])}
+    regressions = []
+    for run in results['runs']:
+        before = previous.get((run['engine'], run['workers']))
+        if before is None:
+            continue
+        label = f"{run['engine']}/{run['workers']}"
+        if run['items_per_second'] < before['items_per_second'] * (1 - max_regression):
+            regressions.append(f"{label}: 吞吐量 {before['items_per_second']:.1f} -> {run['items_per_second']:.1f} 项/秒")
+        if run['encodes_per_image'] > before['encodes_per_image'] + 0.05:
+            regressions.append(f"{label}: 每张编码次数 {before['encodes_per_image']:.2f} -> {run['encodes_per_image']:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=60, help='菜品数量。')
+    parser.add_argument('--distinct', type=int, default=12, help='不同图片的数量（菜品按顺序循环使用）。')
+    parser.add_argument('--oversize-ratio', type=float, default=0.15, help='超出大小限制的图片比例。')
+    parser.add_argument('--engines', type=str, default='threads,asyncio,staged', help='逗号分隔的引擎列表。')
+    parser.add_argument('--workers', type=str, default='2,4,8', help='逗号分隔的并发数列表。')
+    parser.add_argument('--latency', type=float, default=0.01, help='每个新连接模拟的握手延迟（秒）。')
+    parser.add_argument('--request-latency', type=float, default=0.005, help='每个请求的响应延迟（秒）。')
+    parser.add_argument('--bandwidth-kb', type=int, default=0, help='每个响应的带宽上限（KB/秒），0 表示不限。')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='随机返回 503 的请求比例。')
+    parser.add_argument('--rate-limit', type=int, default=0, help='本地 CDN 每秒允许的请求数，超出时返回 429，0 表示不限。')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子（图片内容和错误序列）。')
+    parser.add_argument('--finalize-sample', type=int, default=12, help='finalize_and_compress_image 测量的文件数，0 表示跳过。')
+    parser.add_argument('--output', type=str, help='把结果写入该 JSON 文件。')
+    parser.add_argument('--baseline', type=str, help='与该 JSON 结果比较，出现回归时退出码为 1。')
+    parser.add_argument('--max-regression', type=float, default=0.25, help='允许的吞吐量下降比例。')
+    args = parser.parse_args()
+
+    engines = [e.strip() for e in args.engines.split(',') if e.strip()]
+    worker_counts = [int(w) for w in args.workers.split(',') if w.strip()]
+
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as work_dir:
+        files, paths, formats = build_menu(work_dir, args.items, args.oversize_ratio, args.distinct, args.seed)
+        total_mb = sum(len(files[p][0]) for p in paths) / 1024 / 1024
+        print(f"合成菜单: {args.items} 个菜品，{args.distinct} 张不同图片，格式 {formats}，"
+              f"源图片共 {total_mb:.1f}MB（生成耗时 {time.perf_counter() - start:.1f}s）")
+
+        runs = []
+        with LocalCDN(files, latency=args.latency, request_latency=args.request_latency,
+                      bandwidth=args.bandwidth_kb * 1024, error_rate=args.error_rate, seed=args.seed,
+                      rate_limit=args.rate_limit) as cdn:
+            print(f"\n{'引擎/并发':<14}{'耗时(s)':>9}{'项/秒':>9}{'CPU(s)':>9}{'峰值内存(MB)':>14}{'编码/张':>9}"
+                  f"{'编码p95(ms)':>13}{'失败':>6}")
+            for engine in engines:
+                for workers in worker_counts:
+                    run = run_pipeline(work_dir, cdn, paths, engine, workers)
+                    runs.append(run)
+                    print(f"{engine + '/' + str(workers):<14}{run['wall_seconds']:>9.2f}{run['items_per_second']:>9.1f}"
+                          f"{run['cpu_seconds']:>9.1f}{run['peak_rss_mb']:>14.1f}{run['encodes_per_image']:>9.2f}"
+                          f"{run['encode_p95_ms']:>13.1f}{run['failed']:>6}")
+
+        finalize = bench_finalize(files, args.finalize_sample) if args.finalize_sample else {}
+        for label, stats in finalize.items():
+            print(f"finalize_and_compress_image ({label}): {stats['files']} 个文件，"
+                  f"平均 {stats['mean_ms']:.1f}ms，平均编码 {stats['encodes_per_file']:.2f} 次")
+
+    results = {
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+        'runs': runs,
+        'finalize': finalize,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已写入 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        if regressions:
+            print("\n[回归] ✗ 与基线相比:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\n[通过] ✓ 与基线相比没有回归。")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+测量所有WebP都已存在时（热运行）process_images.py 的完整启动+处理耗时，以及单次尺寸读取的开销。
+
+用法: python benchmarks/bench_warm_start.py --items 500 --repeat 5
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webp_container import probe_dimensions  # noqa: E402
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'process_images.py')
+
+
+def build_catalog(work_dir, count):
+    """生成 count 个已处理过的菜品项，以及对应的WebP文件（不需要联网）。"""
+    from PIL import Image
+
+    output_dir = os.path.join(work_dir, 'upload')
+    os.makedirs(output_dir)
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), (180, 90, 40)).save(buffer, 'webp', quality=80)
+    webp = buffer.getvalue()
+
+    items = []
+    for i in range(count):
+        with open(os.path.join(output_dir, f'dish{i}.webp'), 'wb') as f:
+            f.write(webp)
+        items.append({
+            'title': f'Dish {i}',
+            'raw_image_url': f'https://cdn.example.invalid/img/dish{i}.jpg',
+            'image_url': f'/static/upload/dish{i}.webp',
+        })
+    menu_path = os.path.join(work_dir, 'menu.json')
+    with open(menu_path, 'w', encoding='utf-8') as f:
+        json.dump({'Menu': {'items': items}}, f)
+    return menu_path, output_dir
+
+
+def time_run(args, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, SCRIPT, *args], check=True, stdout=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def time_dimensions(paths):
+    from PIL import Image
+
+    start = time.perf_counter()
+    for path in paths:
+        with Image.open(path) as img:
+            img.size
+    pillow = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for path in paths:
+        probe_dimensions(path)
+    header = time.perf_counter() - start
+    return pillow, header
+
+
+def main():
+    parser = argparse.ArgumentParser(description='热运行（全部已缓存）启动耗时基准测试')
+    parser.add_argument('--items', type=int, default=500, help='菜品数量')
+    parser.add_argument('--repeat', type=int, default=5, help='每种模式运行的次数（取中位数）')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        menu_path, output_dir = build_catalog(work_dir, args.items)
+        common = [menu_path, '--output-dir', output_dir, '--url-prefix', '/static/upload/', '--proxy', 'none']
+        cache_dir = os.path.join(work_dir, 'cache')
+
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        interpreter = time.perf_counter() - start
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import PIL.Image, requests'], check=True)
+        heavy_imports = time.perf_counter() - start - interpreter
+
+        no_cache = time_run([*common, '--no-cache'], args.repeat)
+        # 第一次运行建立尺寸缓存，之后的运行只比较大小和修改时间
+        time_run([*common, '--cache-dir', cache_dir], 1)
+        with_cache = time_run([*common, '--cache-dir', cache_dir], args.repeat)
+
+        paths = [os.path.join(output_dir, name) for name in os.listdir(output_dir)]
+        pillow, header = time_dimensions(paths)
+
+    print(f"--- 热运行基准 ({args.items} 个菜品，全部WebP已存在) ---")
+    print(f"Python 解释器空启动:              {interpreter * 1000:7.1f} ms")
+    print(f"PIL + requests 导入开销（参考）:   {heavy_imports * 1000:7.1f} ms")
+    print(f"process_images.py --no-cache:     {no_cache * 1000:7.1f} ms")
+    print(f"process_images.py（清单+尺寸缓存）: {with_cache * 1000:7.1f} ms")
+    print(f"读取尺寸: Pillow {pillow / args.items * 1e6:.1f} µs/张，文件头 {header / args.items * 1e6:.1f} µs/张")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+基准测试用的本地 "CDN"：一个支持 HTTP/1.1 keep-alive 的多线程 HTTP 服务器，
+按路径返回预先准备好的图片字节，并统计客户端实际建立的TCP连接数。
+响应带有 ETag / Last-Modified，并支持 If-None-Match 条件请求 (304)。
+可模拟每个请求的响应延迟、带宽限制、随机错误 (503) 和速率限制 (429 + Retry-After)，用于离线基准测试。
+"""
+import collections
+import hashlib
+import random
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class LocalCDN:
+    """
+    用法:
+        with LocalCDN({'/a.jpg': (b'...', 'image/jpeg')}, latency=0.01) as cdn:
+            url = cdn.url('/a.jpg')
+    latency 为每个新连接额外模拟的握手延迟（秒）；request_latency 为每个请求在返回响应头之前的延迟（秒）；
+    bandwidth 为每个响应的传输速率上限（字节/秒，0 表示不限）；error_rate 为随机返回 503 的请求比例，
+    seed 固定时错误序列可复现；rate_limit 为每秒允许的请求数（0 表示不限），超出时返回 429 和 Retry-After。
+    """
+
+    CHUNK_SIZE = 16 * 1024
+
+    def __init__(self, files, latency=0.0, host='127.0.0.1', port=0, request_latency=0.0, bandwidth=0,
+                 error_rate=0.0, seed=None, rate_limit=0, retry_after=1):
+        self.files = files
+        self.latency = latency
+        self.request_latency = request_latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self._recent = collections.deque()
+        self._random = random.Random(seed)
+        self.connections = 0
+        self.requests = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.throttled = 0
+        self.last_modified = formatdate(usegmt=True)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    def _make_handler(self):
+        cdn = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with cdn._lock:
+                    cdn.connections += 1
+                if cdn.latency:
+                    time.sleep(cdn.latency)
+
+            def do_GET(self):
+                with cdn._lock:
+                    cdn.requests += 1
+                    limited = cdn._over_rate_limit()
+                    fail = not limited and cdn.error_rate and cdn._random.random() < cdn.error_rate
+                    if fail:
+                        cdn.errors += 1
+                if limited:
+                    self.send_response(429)
+                    self.send_header('Retry-After', str(cdn.retry_after))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if cdn.request_latency:
+                    time.sleep(cdn.request_latency)
+                if fail:
+                    self.send_error(503)
+                    return
+                entry = cdn.files.get(self.path.split('?', 1)[0])
+                if entry is None:
+                    self.send_error(404)
+                    return
+                body, content_type = entry
+                etag = '"%s"' % hashlib.md5(body).hexdigest()
+                if self.headers.get('If-None-Match') == etag:
+                    with cdn._lock:
+                        cdn.not_modified += 1
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.send_header('Last-Modified', cdn.last_modified)
+                self.end_headers()
+                if not cdn.bandwidth:
+                    self.wfile.write(body)
+                    return
+                for offset in range(0, len(body), cdn.CHUNK_SIZE):
+                    chunk = body[offset:offset + cdn.CHUNK_SIZE]
+                    self.wfile.write(chunk)
+                    time.sleep(len(chunk) / cdn.bandwidth)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _over_rate_limit(self):
+        """滑动一秒窗口内的请求数超过 rate_limit 时返回 True（调用方持有 _lock）。"""
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] >= 1.0:
+            self._recent.popleft()
+        if len(self._recent) >= self.rate_limit:
+            self.throttled += 1
+            return True
+        self._recent.append(now)
+        return False
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    def reset_counters(self):
+        with self._lock:
+            self.connections = 0
+            self.requests = 0
+            self.not_modified = 0
+            self.errors = 0
+            self.throttled = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
@@ -0,0 +1,323 @@
+"""
+为 Worker 的服务端渲染预编译数据：把 raw/pages 下的页面和合并后的菜单JSON压缩为最小化的分片，
+去掉页面从不使用的字段，并提前算好 src/index.ts 每次请求都要重新计算的值。
+
+- 菜单中的每个菜品只保留渲染时直接读取的字段（名称、描述、图片等），价格、卡路里和尺寸变体等原始字段
+  由 ssr 字段中预先生成的价格/卡路里文本、srcset、结构化数据的价格和卡路里取代，另附搜索用的词元。
+- 每个菜单分类单独一个分片，同时生成与源菜单结构相同的精简版整份菜单，由 src/index.ts 导入。
+- 页面中引用菜单的 dataTable 区块预先解析 categoriesFilter，写入分类锚点、分片路径和营养信息表的行。
+- manifest.json 记录每个产物的 SHA-256、字节数和源文件哈希；内容未变化的产物不重新写入，
+  不再属于任何页面或菜单的旧分片会被删除。
+
+输出目录结构（默认 build/data）:
+    manifest.json
+    pages/<页面>.json
+    menus/<菜单>.json
+    menus/<菜单>/<分类>.json
+
+用法: python compile_data.py [--pages "raw/pages/*.json"] [--menu raw/index-full-menu.json=raw/pages/index-full-menu.json]
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+
+from menu_matcher import canonical_name
+from pipeline_io import get_image_dimensions, write_json_atomic
+
+DEFAULT_PAGES_GLOB = os.path.join('raw', 'pages', '*.json')
+DEFAULT_OUTPUT_DIR = os.path.join('build', 'data')
+# 静态资源的根目录：图片URL "/static/..." 对应 public/static/...
+PUBLIC_DIR = 'public'
+MANIFEST_FILENAME = 'manifest.json'
+# 编译逻辑或产物格式变化时递增
+COMPILE_VERSION = 2
+# src/index.ts 中 menuDataSources 的键（页面 categoriesDataUrl 的取值）到实际导入文件的映射
+MENU_SOURCES = {
+    'raw/hawai-full-menu.json': os.path.join('raw', 'hawai-full-menu.json'),
+    'raw/index-full-menu.json': os.path.join('raw', 'pages', 'index-full-menu.json'),
+}
+# 输出的菜品字段：渲染菜单卡片和结构化数据时直接读取的字段，以及图片尺寸（缺失时从本地文件读取）。
+# title/price/displayPrice/calories/nutritionalFDAMessage/variants 只用于计算 ssr 中的文本和 srcset，不再输出；
+# 其他字段（id、slug、各种标志位等）也不会输出
+ITEM_FIELDS = ('name', 'description', 'review', 'image_url', 'width', 'height', 'imgAltText')
+CATEGORY_FIELDS = ('description', 'recommended')
+# ssr 中取默认值的字段不输出，由 src/index.ts 按同样的默认值补全；caloriesBadge 缺省时与 calories 相同
+SSR_DEFAULTS = {'price': '', 'calories': '', 'info': 'N/A', 'srcset': '', 'schemaPrice': None, 'schemaCalories': None}
+NUTRITION_TABLE_TITLE = 'Full Menu Nutrition & Allergen Details'
+
+_KEBAB = re.compile(r'[^a-z0-9]+')
+_SCHEMA_PRICE = re.compile(r'\$?(\d+\.?\d*)')
+_SCHEMA_CALORIES = re.compile(r'(\d{1,3}(,\d{3})*|\d+)')
+
+
+def minify(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def to_kebab_case(text):
+    """与 src/index.ts 的 toKebabCase 相同，用于分类锚点和分片文件名。"""
+    return _KEBAB.sub('-', (text or '').lower()).strip('-')
+
+
+def js_number(value):
+    """按 JavaScript 的 String(number) 格式化数字：整数值不带小数部分。"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+# --- 与 src/index.ts 中同名函数一致的文本计算 ---
+
+def parse_price(price):
+    if not price:
+        return None
+    if isinstance(price, (int, float)):
+        return f"${js_number(price)}"
+    if isinstance(price, str) and price.isdigit():
+        return f"${price}"
+    return price
+
+
+def parse_calories(calories):
+    if not calories:
+        return None
+    if isinstance(calories, (int, float)):
+        return f"{js_number(calories)} cal"
+    if 'cal' in str(calories).lower():
+        return str(calories).lower()
+    return f"{calories} cal"
+
+
+def parse_price_for_schema(price):
+    if isinstance(price, (int, float)) and not isinstance(price, bool):
+        return js_number(price)
+    if not isinstance(price, str):
+        return None
+    match = _SCHEMA_PRICE.search(price)
+    return match.group(1) if match else None
+
+
+def parse_calories_for_schema(calories):
+    if not calories:
+        return None
+    match = _SCHEMA_CALORIES.search(js_number(calories) if isinstance(calories, (int, float)) else str(calories))
+    return f"{match.group(0).replace(',', '')} Cal" if match else None
+
+
+def build_image_srcset(item):
+    variants = item.get('variants')
+    if not isinstance(variants, list) or not variants:
+        return ''
+    candidates = [f"{variant['url']} {variant['width']}w" for variant in variants]
+    if item.get('width'):
+        candidates.append(f"{item['image_url']} {item['width']}w")
+    return f' srcset="{", ".join(candidates)}" sizes="(max-width: 640px) 100vw, 400px"'
+
+
+def local_image_size(image_url, public_dir=PUBLIC_DIR):
+    """读取本地图片（"/static/..."）的尺寸，文件不存在或不是本地图片时返回 None。"""
+    if not isinstance(image_url, str) or not image_url.startswith('/'):
+        return None
+    path = os.path.join(public_dir, image_url.lstrip('/'))
+    if not os.path.exists(path):
+        return None
+    width, height = get_image_dimensions(path)
+    return (width, height) if width and height else None
+
+
+def compile_item(item, public_dir=PUBLIC_DIR):
+    """只保留渲染时直接读取的字段，并在 ssr 中写入由其他字段预先计算好的文本。"""
+    compiled = {key: item[key] for key in ITEM_FIELDS if key in item and item[key] not in (None, '')}
+    if compiled.get('image_url') and not (compiled.get('width') and compiled.get('height')):
+        size = local_image_size(compiled['image_url'], public_dir)
+        if size:
+            compiled['width'], compiled['height'] = size
+    bottom = (item.get('indicators') or {}).get('bottomIndicators') or []
+    if bottom:
+        compiled['indicators'] = {'bottomIndicators': [{'tooltipText': bottom[0].get('tooltipText')}]}
+
+    name = item.get('title') or item.get('name') or ''
+    fda_parts = (item.get('nutritionalFDAMessage') or '').split('|')
+    calories = parse_calories(item.get('calories'))
+    ssr = {
+        'name': name,
+        'price': item.get('displayPrice') or parse_price(item.get('price')) or '',
+        'calories': fda_parts[0].strip() or calories or '',
+        'caloriesBadge': ('<br>'.join(part.strip() for part in fda_parts)
+                          if item.get('nutritionalFDAMessage') else calories or ''),
+        'info': ', '.join(fda_parts[1:]) or 'N/A',
+        'srcset': build_image_srcset(item) if item.get('image_url') else '',
+        'schemaPrice': parse_price_for_schema(item.get('displayPrice') or item.get('price')),
+        'schemaCalories': parse_calories_for_schema(item.get('nutritionalFDAMessage') or item.get('calories')),
+        'tokens': sorted(set(canonical_name(name).split())),
+    }
+    if ssr['caloriesBadge'] == ssr['calories']:
+        del ssr['caloriesBadge']
+    compiled['ssr'] = {key: value for key, value in ssr.items()
+                       if key not in SSR_DEFAULTS or value != SSR_DEFAULTS[key]}
+    return compiled
+
+
+def ssr_value(item, key):
+    return item['ssr'].get(key, SSR_DEFAULTS[key])
+
+
+def compile_category(name, category, public_dir=PUBLIC_DIR):
+    """编译一个分类：保留描述和推荐菜品，items 保持原有顺序，sorted 为按规范化名称排序的菜品下标。"""
+    items = [compile_item(item, public_dir) for item in category.get('items', [])]
+    compiled = {key: category[key] for key in CATEGORY_FIELDS if category.get(key)}
+    compiled.update(
+        anchor=to_kebab_case(name),
+        items=items,
+        sorted=sorted(range(len(items)), key=lambda i: (canonical_name(items[i]['ssr']['name']), i)),
+    )
+    return compiled
+
+
+def nutrition_rows(categories):
+    """营养信息表的行：[名称, 价格, 卡路里, 附加信息]，顺序与页面中的菜品顺序相同。"""
+    return [[item['ssr']['name'], ssr_value(item, 'price'), ssr_value(item, 'calories'), ssr_value(item, 'info')]
+            for category in categories.values() for item in category.get('items', [])]
+
+
+class ArtifactWriter:
+    """把产物写入输出目录并记录哈希；内容与磁盘上相同时不重新写入。"""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.files = {}
+        self.written = 0
+
+    def write(self, relpath, data):
+        text = minify(data)
+        payload = text.encode('utf-8')
+        path = os.path.join(self.output_dir, relpath)
+        unchanged = False
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                unchanged = f.read() == payload
+        if not unchanged:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_json_atomic(path, text)
+            self.written += 1
+        self.files[relpath.replace(os.sep, '/')] = {'sha256': hashlib.sha256(payload).hexdigest(),
+                                                    'bytes': len(payload)}
+        return relpath.replace(os.sep, '/')
+
+    def prune(self, keep):
+        """删除输出目录中不属于本次产物的 JSON 文件，返回删除的相对路径列表。"""
+        removed = []
+        for root, _, names in os.walk(self.output_dir):
+            for name in names:
+                relpath = os.path.relpath(os.path.join(root, name), self.output_dir).replace(os.sep, '/')
+                if name.endswith('.json') and relpath not in keep:
+                    os.remove(os.path.join(root, name))
+                    removed.append(relpath)
+        return sorted(removed)
+
+
+def unique_slug(base, used):
+    slug = base or 'category'
+    counter = 2
+    while slug in used:
+        slug = f"{base}-{counter}"
+        counter += 1
+    used.add(slug)
+    return slug
+
+
+def compile_data(page_paths, menu_sources=None, output_dir=DEFAULT_OUTPUT_DIR, public_dir=PUBLIC_DIR):
+    """编译所有页面和菜单并写入 output_dir，返回 manifest 字典。"""
+    menu_sources = MENU_SOURCES if menu_sources is None else menu_sources
+    writer = ArtifactWriter(output_dir)
+    manifest = {'version': COMPILE_VERSION, 'sources': {}, 'menus': {}, 'pages': {}}
+
+    def record_source(path):
+        with open(path, 'rb') as f:
+            manifest['sources'][path.replace(os.sep, '/')] = hashlib.sha256(f.read()).hexdigest()
+
+    compiled_menus = {}
+    for key, path in sorted(menu_sources.items()):
+        with open(path, 'r', encoding='utf-8') as f:
+            menu = json.load(f)
+        record_source(path)
+        menu_name = to_kebab_case(os.path.splitext(os.path.basename(key))[0])
+        categories, shards, used = {}, {}, set()
+        for category_name, category in menu.items():
+            if not isinstance(category, dict):
+                continue
+            categories[category_name] = compile_category(category_name, category, public_dir)
+            slug = unique_slug(categories[category_name]['anchor'], used)
+            shards[category_name] = writer.write(os.path.join('menus', menu_name, f'{slug}.json'),
+                                                 categories[category_name])
+        compiled_menus[key] = (categories, shards)
+        manifest['menus'][key] = {'file': writer.write(os.path.join('menus', f'{menu_name}.json'), categories),
+                                  'categories': shards}
+
+    for path in sorted(page_paths):
+        with open(path, 'r', encoding='utf-8') as f:
+            page = json.load(f)
+        if not isinstance(page, dict) or 'contentBlocks' not in page:
+            # raw/pages 中也存放着菜单数据（如 index-full-menu.json），它们不是页面
+            continue
+        record_source(path)
+        for block in page.get('contentBlocks', []):
+            data = block.get('data') or {}
+            if block.get('type') != 'dataTable':
+                continue
+            if data.get('categoriesDataUrl'):
+                categories, shards = compiled_menus.get(data['categoriesDataUrl'], ({}, {}))
+                if not categories:
+                    print(f"  [警告] ⚠ {path}: 未找到菜单数据 {data['categoriesDataUrl']}")
+                selected = data.get('categoriesFilter')
+                names = list(categories) if selected == '*' else \
+                    [name for name in (selected if isinstance(selected, list) else []) if name in categories]
+                data['categoryShards'] = [{'name': name, 'anchor': categories[name]['anchor'], 'file': shards[name]}
+                                          for name in names]
+                data['nutritionAnchor'] = to_kebab_case(NUTRITION_TABLE_TITLE)
+                data['nutritionRows'] = nutrition_rows({name: categories[name] for name in names})
+            elif isinstance(data.get('categories'), dict):
+                data['categories'] = {name: compile_category(name, category, public_dir)
+                                      for name, category in data['categories'].items()}
+        page_name = os.path.splitext(os.path.basename(path))[0]
+        manifest['pages'][page_name] = writer.write(os.path.join('pages', f'{page_name}.json'), page)
+
+    manifest['files'] = dict(sorted(writer.files.items()))
+    removed = writer.prune(set(writer.files) | {MANIFEST_FILENAME})
+    os.makedirs(output_dir, exist_ok=True)
+    write_json_atomic(os.path.join(output_dir, MANIFEST_FILENAME), json.dumps(manifest, indent=2, ensure_ascii=False))
+
+    source_bytes = sum(os.path.getsize(path) for path in manifest['sources'])
+    output_bytes = sum(entry['bytes'] for entry in manifest['files'].values())
+    print(f"编译完成: {len(manifest['pages'])} 个页面，{len(manifest['menus'])} 份菜单，"
+          f"{sum(len(menu['categories']) for menu in manifest['menus'].values())} 个分类分片")
+    print(f"写入 {writer.written} 个文件，{len(writer.files) - writer.written} 个内容未变化，删除旧文件 {len(removed)} 个")
+    print(f"源文件 {source_bytes / 1024:.1f}KB -> 产物 {output_bytes / 1024:.1f}KB"
+          f"（含分类分片，整份菜单与分片内容重复）")
+    return manifest
+
+
+def parse_menu_source(value):
+    """解析 --menu 参数：'键=路径'，只给路径时键与路径相同。"""
+    key, _, path = value.partition('=')
+    return key, path or key
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="把页面和菜单JSON编译为最小化的分片，去掉未使用的字段并预先计算渲染所需的值。",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--pages', default=DEFAULT_PAGES_GLOB, help='页面JSON的通配符。')
+    parser.add_argument('--menu', action='append', default=None, metavar='KEY=PATH',
+                        help='菜单数据源：KEY 为页面中 categoriesDataUrl 的取值，PATH 为实际读取的文件，可重复指定。'
+                             '默认与 src/index.ts 的 menuDataSources 相同。')
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR, help='产物的输出目录。')
+    parser.add_argument('--public-dir', default=PUBLIC_DIR, help='静态资源的根目录，用于读取缺少尺寸的本地图片。')
+    args = parser.parse_args()
+
+    menu_sources = dict(parse_menu_source(value) for value in args.menu) if args.menu else None
+    compile_data(glob.glob(args.pages), menu_sources, args.output_dir, args.public_dir)
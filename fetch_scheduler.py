@@ -0,0 +1,295 @@
+"""
+按主机调度下载请求：令牌桶限速、指数退避重试（带随机抖动）、Retry-After 和熔断器。
+
+每个主机 (scheme://host) 有独立的状态：
+- 令牌桶限制请求速率。收到 429/503 时速率减半，之后随成功的请求逐渐恢复 (AIMD)，
+  运行会自动收敛到主机允许的最高吞吐量；响应带 Retry-After 时整个主机暂停到该时间点。
+- 熔断器在连续失败（连接错误、超时、5xx）达到阈值后打开，冷却期内对该主机的请求立即失败，
+  冷却结束后只放行一个探测请求，成功则恢复。
+
+HostScheduler 只计算需要等待的时间，不负责睡眠，同一个实例可供线程下载器 (time.sleep) 和
+协程下载器 (asyncio.sleep) 使用。所有方法都是线程安全的。
+"""
+import collections
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+# --- 默认调度配置 ---
+# 每个主机的请求速率上限（请求/秒），0 表示不限速（直到主机返回 429/503 才开始限速）
+DEFAULT_HOST_RATE = 0.0
+DEFAULT_HOST_BURST = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 30.0
+# Retry-After 超过该值（秒）时不在当前请求中等待，直接失败，由运行末尾的重新排队处理
+DEFAULT_MAX_RETRY_AFTER = 60.0
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_COOLDOWN = 30.0
+# 可以重试的 HTTP 状态码；429/503 同时表示主机要求降低速率
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+THROTTLE_STATUSES = frozenset({429, 503})
+# 自适应限速：被限流时速率乘以该系数，之后每秒恢复 ceiling 的该比例；两次降速的最小间隔（秒）
+RATE_DECREASE = 0.5
+RATE_RECOVERY = 0.05
+MIN_HOST_RATE = 0.2
+DECREASE_COOLDOWN = 1.0
+# 估算当前请求速率的滑动窗口（秒）
+RATE_WINDOW = 1.0
+
+
+class CircuitOpenError(Exception):
+    """主机的熔断器处于打开状态，retry_in 秒后才允许探测请求。"""
+
+    def __init__(self, host, retry_in):
+        super().__init__(f"主机 {host} 连续失败，已熔断，{retry_in:.0f}s 后重试")
+        self.host = host
+        self.retry_in = retry_in
+
+
+def host_key(url):
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def parse_retry_after(value, now=None):
+    """解析 Retry-After 响应头（秒数或 HTTP 日期），返回需要等待的秒数；无法解析时返回 None。"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    now = now or datetime.now(timezone.utc)
+    return max((when - now).total_seconds(), 0.0)
+
+
+class TokenBucket:
+    """
+    令牌桶。reserve() 预订一个令牌并返回需要等待的秒数（令牌不足时预订未来的令牌，
+    并发的请求按预订顺序依次放行）。rate 为 0 时不限速，只受 block_until() 设置的暂停时间约束。
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self, now):
+        start = max(now, self.blocked_until)
+        if self.rate <= 0:
+            return start - now
+        if start > self.updated:
+            self.tokens = min(self.burst, self.tokens + (start - self.updated) * self.rate)
+            self.updated = start
+        self.tokens -= 1
+        return start - now + (max(-self.tokens, 0.0) / self.rate)
+
+    def set_rate(self, rate, now):
+        if self.rate > 0:
+            if now > self.updated:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        elif rate > 0:
+            # 从不限速切换为限速时从空桶开始，避免立刻放出一整个突发
+            self.tokens = 0.0
+        self.updated = max(self.updated, now)
+        self.rate = rate
+
+    def block_until(self, when):
+        self.blocked_until = max(self.blocked_until, when)
+
+
+class CircuitBreaker:
+    """连续失败 threshold 次后打开；cooldown 秒后进入半开状态，只放行一个探测请求。"""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+
+    def retry_in(self, now):
+        """距离允许下一次请求的秒数，0 表示现在就可以发出。"""
+        if self.state == self.CLOSED:
+            return 0.0
+        if self.state == self.OPEN:
+            return max(self.opened_at + self.cooldown - now, 0.0)
+        # 半开：探测请求进行中，其他请求等探测结果
+        return self.cooldown
+
+    def allow(self, now):
+        remaining = self.retry_in(now)
+        if remaining > 0:
+            return remaining
+        if self.state == self.OPEN:
+            self.state = self.HALF_OPEN
+        return 0.0
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self, now):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+            self.state = self.OPEN
+            self.opened_at = now
+            self.opens += 1
+
+
+class _HostState:
+    def __init__(self, rate, burst, breaker_threshold, breaker_cooldown):
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        self.ceiling = rate
+        # 原本不限速的主机被限流时的请求速率，恢复到该速率后重新取消限速
+        self.peak = rate
+        self.last_adjust = 0.0
+        self.last_decrease = 0.0
+        self.recent = collections.deque()
+        self.throttled = 0
+
+    def note_request(self, when):
+        self.recent.append(when)
+        while self.recent and when - self.recent[0] > RATE_WINDOW:
+            self.recent.popleft()
+
+    def observed_rate(self):
+        """最近 RATE_WINDOW 秒内发出的请求数换算成的速率。"""
+        return len(self.recent) / RATE_WINDOW if self.recent else None
+
+
+class HostScheduler:
+    """
+    所有主机的调度状态。下载器在每次请求前调用 acquire(url) 并等待返回的秒数，
+    请求结束后调用 record_success(url) 或 record_failure(url, ...)，
+    失败时由 retry_delay() 决定是否重试以及重试前等待多久。
+    rate 为每个主机的速率上限（0 表示不限速），被限流后自动降速并逐渐恢复到该上限。
+    """
+
+    def __init__(self, rate=DEFAULT_HOST_RATE, burst=DEFAULT_HOST_BURST, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_base=DEFAULT_BACKOFF_BASE, backoff_max=DEFAULT_BACKOFF_MAX,
+                 max_retry_after=DEFAULT_MAX_RETRY_AFTER, breaker_threshold=DEFAULT_BREAKER_THRESHOLD,
+                 breaker_cooldown=DEFAULT_BREAKER_COOLDOWN, seed=None):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self._random = random.Random(seed)
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self._retries = 0
+
+    def _host(self, url):
+        key = host_key(url)
+        state = self._hosts.get(key)
+        if state is None:
+            state = self._hosts[key] = _HostState(self.rate, self.burst, self.breaker_threshold,
+                                                  self.breaker_cooldown)
+        return state
+
+    def acquire(self, url):
+        """
+        为一次请求预订令牌，返回发出请求前需要等待的秒数。
+        熔断器打开时抛出 CircuitOpenError（不消耗令牌）。
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._host(url)
+            remaining = state.breaker.allow(now)
+            if remaining > 0:
+                raise CircuitOpenError(host_key(url), remaining)
+            delay = state.bucket.reserve(now)
+            state.note_request(now + delay)
+            return delay
+
+    def record_success(self, url):
+        """主机正常响应（包括 304 和 404 等非重试类状态）：关闭熔断器，逐步恢复被降低的速率。"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._host(url)
+            state.breaker.record_success()
+            bucket = state.bucket
+            if bucket.rate <= 0 or (state.ceiling > 0 and bucket.rate >= state.ceiling):
+                return
+            ceiling = state.ceiling or state.peak
+            rate = bucket.rate + ceiling * RATE_RECOVERY * max(now - state.last_adjust, 0.0)
+            state.last_adjust = now
+            if rate >= ceiling:
+                # 原本不限速的主机恢复到被限流前的速率后，重新取消限速
+                rate = state.ceiling
+            bucket.set_rate(rate, now)
+
+    def record_failure(self, url, status=None, retry_after=None):
+        """
+        记录一次可重试的失败。429/503 视为限流：降低该主机的速率，有 Retry-After 时暂停整个主机；
+        其他失败（连接错误、超时、5xx）计入熔断器。
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._host(url)
+            if status in THROTTLE_STATUSES:
+                state.throttled += 1
+                if retry_after:
+                    state.bucket.block_until(now + min(retry_after, self.max_retry_after))
+                # 并发中的请求往往同时被限流，一个冷却期内只降速一次
+                if state.bucket.rate <= 0 or now - state.last_decrease >= DECREASE_COOLDOWN:
+                    current = state.bucket.rate or state.observed_rate() or float(self.burst)
+                    if state.bucket.rate <= 0:
+                        state.peak = current
+                    state.bucket.set_rate(max(current * RATE_DECREASE, MIN_HOST_RATE), now)
+                    state.last_adjust = state.last_decrease = now
+            if status == 429:
+                # 主机仍在正常响应，只是要求降速，不计入熔断
+                state.breaker.record_success()
+            else:
+                state.breaker.record_failure(now)
+
+    def retry_delay(self, attempt, retry_after=None):
+        """
+        第 attempt 次重试（从 0 开始）前等待的秒数：min(backoff_max, base * 2^attempt) 以内的随机值 (full jitter)，
+        且不少于 Retry-After。超过重试次数或 Retry-After 过长时返回 None，表示放弃。
+        """
+        if attempt >= self.max_retries:
+            return None
+        if retry_after is not None and retry_after > self.max_retry_after:
+            return None
+        with self._lock:
+            self._retries += 1
+            delay = self._random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        return max(delay, retry_after or 0.0)
+
+    def ready_in(self):
+        """所有熔断的主机中最晚恢复探测的剩余秒数（没有熔断的主机时为 0）。"""
+        now = time.monotonic()
+        with self._lock:
+            return max((state.breaker.retry_in(now) for state in self._hosts.values()
+                        if state.breaker.state == CircuitBreaker.OPEN), default=0.0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'retries': self._retries,
+                'throttled': sum(state.throttled for state in self._hosts.values()),
+                'circuit_opens': sum(state.breaker.opens for state in self._hosts.values()),
+                'rates': {key: round(state.bucket.rate, 2) for key, state in self._hosts.items()
+                          if state.bucket.rate > 0},
+            }
@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime
+
+from image_encoder import OUTPUT_SUFFIXES
+
+DEFAULT_CACHE_DIR = '.image_cache'
+MANIFEST_FILENAME = 'manifest.sqlite3'
+SOURCES_DIRNAME = 'sources'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    url             TEXT PRIMARY KEY,
+    etag            TEXT,
+    last_modified   TEXT,
+    source_hash     TEXT,
+    source_size     INTEGER,
+    output_dir      TEXT,
+    output_filename TEXT,
+    width           INTEGER,
+    height          INTEGER,
+    encode_params   TEXT,
+    updated_at      TEXT
+);
+CREATE TABLE IF NOT EXISTS dimensions (
+    path            TEXT PRIMARY KEY,
+    size            INTEGER,
+    mtime_ns        INTEGER,
+    width           INTEGER,
+    height          INTEGER
+);
+"""
+
+
+def hash_stream(fileobj, chunk_size=1024 * 1024):
+    """计算类文件对象内容的 SHA-256 和字节数，完成后把文件指针移回开头。"""
+    digest = hashlib.sha256()
+    size = 0
+    fileobj.seek(0)
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+        size += len(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest(), size
+
+
+class ImageCache:
+    """
+    按源URL记录图片处理结果的持久化清单 (SQLite)，并可选地保存源文件副本。
+
+    每条记录包含 ETag / Last-Modified、源文件哈希、输出文件名、尺寸和编码参数，
+    用于下次运行时发送条件请求（304 即跳过），以及在 WebP 被删除时直接从源文件副本重新编码。
+    所有方法都是线程安全的。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, keep_sources=True):
+        self.cache_dir = cache_dir
+        self.keep_sources = keep_sources
+        self.sources_dir = os.path.join(cache_dir, SOURCES_DIRNAME)
+        os.makedirs(self.sources_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # 流水线中并行的多个 process_images 进程可能共用同一份清单，写入冲突时等待对方提交
+        self._conn = sqlite3.connect(os.path.join(cache_dir, MANIFEST_FILENAME), timeout=30,
+                                     check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+        # 尺寸缓存在第一次查询时整表载入内存：{绝对路径: (大小, mtime_ns, 宽, 高)}
+        self._dimensions = None
+
+    # --- 记录读写 ---
+
+    def get(self, url):
+        """返回 url 对应的记录字典，不存在时返回 None。"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM sources WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        record = dict(row)
+        record['encode_params'] = json.loads(record['encode_params']) if record['encode_params'] else {}
+        return record
+
+    def all_records(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM sources").fetchall()
+        return [dict(row) for row in rows]
+
+    def record_result(self, url, *, etag, last_modified, source_hash, source_size,
+                      output_dir, output_filename, width, height, encode_params):
+        """写入（或覆盖）一次成功处理的完整记录。"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sources (url, etag, last_modified, source_hash, source_size, output_dir, "
+                "output_filename, width, height, encode_params, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, source_hash, source_size, os.path.abspath(output_dir),
+                 output_filename, width, height, json.dumps(encode_params, sort_keys=True),
+                 datetime.now().isoformat()),
+            )
+
+    def update_validators(self, url, etag, last_modified):
+        """源文件未变化时只刷新校验信息（服务器可能在 304/200 响应中返回新的 ETag）。"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE sources SET etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified), "
+                "updated_at = ? WHERE url = ?",
+                (etag, last_modified, datetime.now().isoformat(), url),
+            )
+
+    def delete(self, urls):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM sources WHERE url = ?", [(url,) for url in urls])
+
+    def forget_dimensions(self, paths):
+        keys = [os.path.abspath(path) for path in paths]
+        with self._lock, self._conn:
+            dimensions = self._load_dimensions()
+            for key in keys:
+                dimensions.pop(key, None)
+            self._conn.executemany("DELETE FROM dimensions WHERE path = ?", [(key,) for key in keys])
+
+    # --- 源文件副本 ---
+
+    def source_blob_path(self, source_hash):
+        return os.path.join(self.sources_dir, source_hash)
+
+    def has_source_blob(self, record):
+        return bool(record and record.get('source_hash')) and os.path.exists(self.source_blob_path(record['source_hash']))
+
+    def store_source(self, fileobj):
+        """
+        计算源文件哈希，并在 keep_sources 开启时把内容保存为以哈希命名的副本。
+        返回 (source_hash, source_size)，文件指针会被移回开头。
+        """
+        source_hash, source_size = hash_stream(fileobj)
+        if self.keep_sources:
+            blob_path = self.source_blob_path(source_hash)
+            if not os.path.exists(blob_path):
+                fd, temp_path = tempfile.mkstemp(dir=self.sources_dir, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    shutil.copyfileobj(fileobj, f)
+                os.replace(temp_path, blob_path)
+                fileobj.seek(0)
+        return source_hash, source_size
+
+    # --- 尺寸缓存 ---
+
+    def _load_dimensions(self):
+        if self._dimensions is None:
+            rows = self._conn.execute("SELECT path, size, mtime_ns, width, height FROM dimensions").fetchall()
+            self._dimensions = {row['path']: tuple(row)[1:] for row in rows}
+        return self._dimensions
+
+    def get_dimensions(self, path):
+        """返回文件的 (宽, 高)；文件不存在或大小/修改时间与记录不一致时返回 None。"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._load_dimensions().get(os.path.abspath(path))
+        if entry is None or entry[0] != st.st_size or entry[1] != st.st_mtime_ns:
+            return None
+        return entry[2], entry[3]
+
+    def put_dimensions(self, path, width, height):
+        """以 (路径, 大小, 修改时间) 为键记录文件尺寸。"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        key = os.path.abspath(path)
+        with self._lock, self._conn:
+            self._load_dimensions()[key] = (st.st_size, st.st_mtime_ns, width, height)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dimensions (path, size, mtime_ns, width, height) VALUES (?, ?, ?, ?, ?)",
+                (key, st.st_size, st.st_mtime_ns, width, height),
+            )
+
+    # --- 清理 ---
+
+    def gc(self, output_dir, referenced_filenames, dry_run=False):
+        """
+        删除 output_dir 中未被引用的输出图片（WebP/AVIF），以及指向这些文件的清单记录和不再被任何记录引用的源文件副本。
+        referenced_filenames 为 JSON 中仍在使用的文件名集合。返回删除（或将要删除）的条目报告。
+        """
+        output_dir_abs = os.path.abspath(output_dir)
+        orphan_files = sorted(
+            name for name in os.listdir(output_dir)
+            if name.lower().endswith(OUTPUT_SUFFIXES) and name not in referenced_filenames
+        )
+        orphan_bytes = sum(os.path.getsize(os.path.join(output_dir, name)) for name in orphan_files)
+
+        records = self.all_records()
+        stale_urls = [
+            r['url'] for r in records
+            if r['output_dir'] == output_dir_abs and r['output_filename'] not in referenced_filenames
+        ]
+        stale_set = set(stale_urls)
+        live_hashes = {r['source_hash'] for r in records if r['url'] not in stale_set}
+        orphan_blobs = sorted(
+            name for name in os.listdir(self.sources_dir)
+            if not name.endswith('.tmp') and name not in live_hashes
+        )
+
+        if not dry_run:
+            for name in orphan_files:
+                os.remove(os.path.join(output_dir, name))
+            self.delete(stale_urls)
+            self.forget_dimensions(os.path.join(output_dir_abs, name) for name in orphan_files)
+            for name in orphan_blobs:
+                os.remove(os.path.join(self.sources_dir, name))
+
+        return {
+            'orphan_files': orphan_files,
+            'orphan_bytes': orphan_bytes,
+            'stale_records': stale_urls,
+            'orphan_blobs': orphan_blobs,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
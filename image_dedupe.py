@@ -0,0 +1,162 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+DEDUPE_INDEX_FILENAME = 'dedupe.sqlite3'
+# 两个感知哈希之间允许的最大汉明距离（64 位中不同的位数），0 表示哈希完全相同
+DEFAULT_MAX_DISTANCE = 2
+HASH_SIZE = 8
+# 源图片宽高比的允许误差：裁剪方式不同的图片即使哈希接近也不视为同一张
+ASPECT_TOLERANCE = 0.01
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    output_path     TEXT PRIMARY KEY,
+    output_dir      TEXT,
+    content_hash    TEXT,
+    dhash           TEXT,
+    source_width    INTEGER,
+    source_height   INTEGER,
+    width           INTEGER,
+    height          INTEGER,
+    bytes           INTEGER,
+    encode_seconds  REAL,
+    encode_params   TEXT,
+    created_at      TEXT
+);
+CREATE INDEX IF NOT EXISTS outputs_content_hash ON outputs (content_hash);
+CREATE TABLE IF NOT EXISTS aliases (
+    url             TEXT,
+    output_dir      TEXT,
+    output_path     TEXT,
+    PRIMARY KEY (url, output_dir)
+);
+"""
+
+
+def dhash(img, hash_size=HASH_SIZE):
+    """
+    计算图片的差值哈希 (dHash)：缩小为 (hash_size+1) x hash_size 的灰度图，逐行比较相邻像素的明暗。
+    对缩放、重新压缩和轻微的颜色调整不敏感。返回 hash_size*hash_size 位的整数。
+    """
+    from PIL import Image
+
+    small = img.resize((hash_size + 1, hash_size), Image.BOX).convert('L')
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+
+class DedupeIndex:
+    """
+    已生成WebP的内容索引 (SQLite)：记录每个输出文件对应的源图片精确哈希 (SHA-256) 和感知哈希 (dHash)，
+    以及生成它花费的字节数和编码时间。内容相同或视觉相同的新图片可以直接复用已有输出，不再编码。
+
+    aliases 表记录"源URL -> 复用的输出文件"，下次运行时这些项目直接指向共享的WebP。
+    索引可以被多个进程同时打开（分阶段引擎的编码进程各自持有连接）；同一进程内所有方法都是线程安全的。
+    """
+
+    def __init__(self, path, max_distance=DEFAULT_MAX_DISTANCE):
+        self.path = path
+        self.max_distance = max_distance
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+
+    def _usable(self, row, encode_params, exclude_path):
+        return (row['encode_params'] == json.dumps(encode_params, sort_keys=True)
+                and row['output_path'] != os.path.abspath(exclude_path or '')
+                and os.path.exists(row['output_path']))
+
+    def find_exact(self, content_hash, output_dir, encode_params, exclude_path=None):
+        """查找源图片内容完全相同、编码参数一致且文件仍存在的已有输出。"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM outputs WHERE content_hash = ? AND output_dir = ?",
+                (content_hash, os.path.abspath(output_dir)),
+            ).fetchall()
+        for row in rows:
+            if self._usable(row, encode_params, exclude_path):
+                return dict(row, distance=0, match='exact')
+        return None
+
+    def find_similar(self, fingerprint, source_size, output_dir, encode_params, exclude_path=None):
+        """查找感知哈希距离不超过 max_distance 且宽高比一致的已有输出，返回距离最小的一个。"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM outputs WHERE output_dir = ?", (os.path.abspath(output_dir),)
+            ).fetchall()
+        aspect = source_size[0] / source_size[1]
+        best = None
+        for row in rows:
+            distance = hamming_distance(fingerprint, int(row['dhash'], 16))
+            if distance > self.max_distance or (best is not None and distance >= best['distance']):
+                continue
+            if abs(row['source_width'] / row['source_height'] - aspect) > aspect * ASPECT_TOLERANCE:
+                continue
+            if self._usable(row, encode_params, exclude_path):
+                best = dict(row, distance=distance, match='perceptual')
+        return best
+
+    def add(self, output_path, *, content_hash, fingerprint, source_size, width, height,
+            total_bytes, encode_seconds, encode_params):
+        """
+        记录一个新生成的输出。同一路径的内容发生变化（源图片更新后重新编码）时，
+        指向它的别名随之失效，这些项目下次运行时重新判断。
+        """
+        output_path = os.path.abspath(output_path)
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT content_hash FROM outputs WHERE output_path = ?",
+                                     (output_path,)).fetchone()
+            if row is not None and row['content_hash'] != content_hash:
+                self._conn.execute("DELETE FROM aliases WHERE output_path = ?", (output_path,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO outputs (output_path, output_dir, content_hash, dhash, source_width, "
+                "source_height, width, height, bytes, encode_seconds, encode_params, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (output_path, os.path.dirname(output_path), content_hash, f"{fingerprint:016x}",
+                 source_size[0], source_size[1], width, height, total_bytes, encode_seconds,
+                 json.dumps(encode_params, sort_keys=True), datetime.now().isoformat()),
+            )
+
+    def alias_for(self, url, output_dir):
+        """返回 url 之前被去重到的输出文件路径；没有记录或文件已不存在时返回 None。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT output_path FROM aliases WHERE url = ? AND output_dir = ?",
+                (url, os.path.abspath(output_dir)),
+            ).fetchone()
+        if row is None or not os.path.exists(row['output_path']):
+            return None
+        return row['output_path']
+
+    def set_alias(self, url, output_dir, output_path):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO aliases (url, output_dir, output_path) VALUES (?, ?, ?)",
+                (url, os.path.abspath(output_dir), os.path.abspath(output_path)),
+            )
+
+    def remove_alias(self, url, output_dir):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM aliases WHERE url = ? AND output_dir = ?",
+                               (url, os.path.abspath(output_dir)))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
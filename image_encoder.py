@@ -0,0 +1,431 @@
+import contextlib
+import io
+import math
+import operator
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，此时不统计内存
+    resource = None
+
+# WebP 的 method 参数：数值越大压缩越慢、文件越小。Pillow 默认值为 4
+DEFAULT_WEBP_METHOD = 4
+MAX_WEBP_METHOD = 6
+# 质量搜索区间（已知满足与超限的两个质量之差）缩小到该宽度时停止
+QUALITY_TOLERANCE = 3
+# 质量降到下限仍超出大小限制时，最多尝试缩小尺寸的次数
+MAX_RESIZE_ATTEMPTS = 3
+
+# 估算解码内存时每像素的字节数（Pillow 的 RGB 也按 4 字节存储）和同时存在的副本数
+# （解码结果、格式转换、缩放或并行候选各一份）
+DECODE_BYTES_PER_PIXEL = 4
+DECODE_COPIES = 3
+
+# 候选输出格式。有损 WebP 始终参与并作为兜底；无损 WebP 只对带透明通道或颜色很少的图片（图标、标志）尝试
+FORMAT_WEBP = 'webp'
+FORMAT_WEBP_LOSSLESS = 'webp-lossless'
+FORMAT_AVIF = 'avif'
+FORMAT_SUFFIXES = {FORMAT_WEBP: '.webp', FORMAT_WEBP_LOSSLESS: '.webp', FORMAT_AVIF: '.avif'}
+OUTPUT_SUFFIXES = ('.webp', '.avif')
+# 不超过该颜色数的图片视为调色板类图片
+PALETTE_MAX_COLORS = 256
+# 无损 WebP 的压缩强度（lossless 模式下 quality 表示压缩力度，不影响画质）
+LOSSLESS_WEBP_EFFORT = 80
+# AVIF 的质量搜索区间与编码速度（0 最慢最小，10 最快）
+AVIF_MIN_QUALITY = 45
+AVIF_INITIAL_QUALITY = 65
+DEFAULT_AVIF_SPEED = 6
+# SSIM 在缩小到最长边 SSIM_SIZE 的灰度图上按 SSIM_WINDOW x SSIM_WINDOW 的不重叠窗口计算
+SSIM_SIZE = 512
+SSIM_WINDOW = 8
+
+
+def peak_rss_kb():
+    """返回当前进程的峰值常驻内存 (KB)，不支持的平台返回 None。"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 上 ru_maxrss 的单位是字节，Linux 上是 KB
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+class SizeModel:
+    """
+    根据之前处理过的图片，估计 "每像素字节数" 与质量之间的关系，用来为质量搜索选择更好的起点。
+
+    记录两个量（都是线程安全的滑动平均）：
+    - 初始质量下的每像素字节数 (bpp)，用于预测一张新图片在初始质量下的大小；
+    - ln(文件大小) 随质量变化的斜率，用于从预测大小推算出刚好满足大小限制的质量。
+    """
+
+    def __init__(self, smoothing=0.2):
+        self.smoothing = smoothing
+        self._bpp_at_initial = None
+        self._log_slope = None
+        self._lock = threading.Lock()
+
+    def _blend(self, old, new):
+        return new if old is None else old + self.smoothing * (new - old)
+
+    def observe(self, pixels, samples, initial_quality):
+        """samples 为同一张图片上的 (quality, size) 列表。"""
+        with self._lock:
+            for quality, size in samples:
+                if quality == initial_quality:
+                    self._bpp_at_initial = self._blend(self._bpp_at_initial, size / pixels)
+            ordered = sorted(samples)
+            for (q1, s1), (q2, s2) in zip(ordered, ordered[1:]):
+                if q2 > q1 and s1 > 0 and s2 > s1:
+                    self._log_slope = self._blend(self._log_slope, (math.log(s2) - math.log(s1)) / (q2 - q1))
+
+    def slope(self):
+        with self._lock:
+            return self._log_slope
+
+    def seed_quality(self, pixels, max_bytes, min_quality, initial_quality):
+        """返回建议的起始质量；模型尚未积累数据或预测不会超限时返回 initial_quality。"""
+        with self._lock:
+            bpp, slope = self._bpp_at_initial, self._log_slope
+        if bpp is None or slope is None:
+            return initial_quality
+        predicted = bpp * pixels
+        if predicted <= max_bytes:
+            return initial_quality
+        quality = initial_quality - math.log(predicted / max_bytes) / slope
+        return max(min_quality, min(initial_quality, int(round(quality))))
+
+
+def decode_cost(size, copies=DECODE_COPIES):
+    """解码并编码一张 size = (宽, 高) 的图片时估算占用的内存（字节）。"""
+    return size[0] * size[1] * DECODE_BYTES_PER_PIXEL * copies
+
+
+class MemoryBudget:
+    """
+    按估算的内存限制同时进行的解码（加权信号量）。capacity 为字节数，0/None 表示不限制。
+    估算超过 capacity 的单个任务按 capacity 计，即等到其他任务都释放预算后独占运行，不会一直阻塞。
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.peak = 0
+        self._used = 0
+        self._cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def reserve(self, cost):
+        """占用 cost 字节的预算直到代码块结束，as 得到等待的秒数。"""
+        if not self.capacity:
+            yield 0.0
+            return
+        cost = min(cost, self.capacity)
+        start = time.perf_counter()
+        with self._cond:
+            blocked = self._used + cost > self.capacity
+            while self._used + cost > self.capacity:
+                self._cond.wait()
+            self._used += cost
+            self.peak = max(self.peak, self._used)
+            waited = time.perf_counter() - start if blocked else 0.0
+            if blocked:
+                self.waits += 1
+                self.wait_seconds += waited
+        try:
+            yield waited
+        finally:
+            with self._cond:
+                self._used -= cost
+                self._cond.notify_all()
+
+
+class EncodeResult:
+    """
+    一次尺寸约束编码的结果。data 为最终的编码字节，size 为最终的 (宽, 高)，format 为 FORMAT_* 之一。
+    ssim 为与原图比较的结构相似度，未计算（或无损编码）时为 None。
+    """
+
+    def __init__(self, data, quality, method, size, original_size, encodes, fits, format=FORMAT_WEBP):
+        self.data = data
+        self.quality = quality
+        self.method = method
+        self.size = size
+        self.original_size = original_size
+        self.encodes = encodes
+        self.fits = fits
+        self.format = format
+        self.ssim = None
+
+    @property
+    def resized(self):
+        return self.size != self.original_size
+
+    def __len__(self):
+        return len(self.data)
+
+
+def encode_webp(img, quality, method=DEFAULT_WEBP_METHOD, **save_kwargs):
+    """把图片编码为内存中的 WebP 字节。"""
+    buffer = io.BytesIO()
+    img.save(buffer, 'webp', quality=quality, method=method, **save_kwargs)
+    return buffer.getvalue()
+
+
+def encode_avif(img, quality, method=None, speed=DEFAULT_AVIF_SPEED, **save_kwargs):
+    """把图片编码为内存中的 AVIF 字节。method 是 WebP 的参数，这里忽略（保持与 encode_webp 相同的签名）。"""
+    buffer = io.BytesIO()
+    img.save(buffer, 'avif', quality=quality, speed=speed, **save_kwargs)
+    return buffer.getvalue()
+
+
+def avif_supported():
+    """当前的 Pillow 能否编码 AVIF（Pillow 11.2 起内置，之前需要 pillow-avif-plugin）。"""
+    from PIL import Image, features
+
+    try:
+        if features.check_module('avif'):
+            return True
+    except ValueError:
+        pass
+    try:
+        import pillow_avif  # noqa: F401
+    except ImportError:
+        return False
+    Image.init()
+    return 'AVIF' in Image.SAVE
+
+
+def has_alpha(img):
+    """图片是否带有真正用到的透明通道（alpha 全为 255 的 RGBA 视为不透明）。"""
+    if img.mode in ('RGBA', 'LA', 'PA'):
+        return img.getchannel('A').getextrema()[0] < 255
+    if img.mode == 'P' and 'transparency' in img.info:
+        return img.convert('RGBA').getchannel('A').getextrema()[0] < 255
+    return False
+
+
+def is_palette_like(img, max_colors=PALETTE_MAX_COLORS):
+    """颜色数不超过 max_colors 的图片（平涂的图标、标志、截图），这类图片无损编码通常更小。"""
+    return img.mode == 'P' or img.getcolors(max_colors) is not None
+
+
+def _luma(img):
+    """转为灰度；带透明通道时先合成到中灰背景上，避免比较透明区域中无意义的颜色。"""
+    from PIL import Image
+
+    if img.mode in ('RGBA', 'LA', 'PA'):
+        background = Image.new('RGBA', img.size, (128, 128, 128, 255))
+        img = Image.alpha_composite(background, img.convert('RGBA'))
+    return img.convert('L')
+
+
+def ssim(reference, candidate, size=SSIM_SIZE, window=SSIM_WINDOW):
+    """
+    计算 candidate 相对 reference 的平均结构相似度 (SSIM，1 表示完全相同)。
+    两张图缩小到相同尺寸（最长边 size）的灰度图后，按 window x window 的不重叠窗口计算再取平均，
+    不依赖 numpy。candidate 的尺寸可以与 reference 不同（例如被缩小过）。
+    """
+    from PIL import Image
+
+    scale = min(1.0, size / max(reference.size))
+    dims = (max(window, round(reference.width * scale)), max(window, round(reference.height * scale)))
+    a = _luma(reference).resize(dims, Image.BILINEAR).tobytes()
+    b = _luma(candidate).resize(dims, Image.BILINEAR).tobytes()
+    width, height = dims
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    n = window * window
+    total = 0.0
+    count = 0
+    for top in range(0, height - window + 1, window):
+        for left in range(0, width - window + 1, window):
+            sa = sb = saa = sbb = sab = 0
+            for row in range(top, top + window):
+                start = row * width + left
+                ra, rb = a[start:start + window], b[start:start + window]
+                sa += sum(ra)
+                sb += sum(rb)
+                saa += sum(map(operator.mul, ra, ra))
+                sbb += sum(map(operator.mul, rb, rb))
+                sab += sum(map(operator.mul, ra, rb))
+            mean_a, mean_b = sa / n, sb / n
+            var_a = saa / n - mean_a * mean_a
+            var_b = sbb / n - mean_b * mean_b
+            cov = sab / n - mean_a * mean_b
+            total += (((2 * mean_a * mean_b + c1) * (2 * cov + c2))
+                      / ((mean_a * mean_a + mean_b * mean_b + c1) * (var_a + var_b + c2)))
+            count += 1
+    return total / count if count else 1.0
+
+
+def _decode(data):
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+        return img
+
+
+def _interpolate_quality(fit, miss, max_bytes):
+    """在 ln(大小) 与质量近似线性的假设下，在已知满足/超限的两个点之间插值出目标质量。"""
+    (q_fit, s_fit), (q_miss, s_miss) = fit, miss
+    span = math.log(s_miss) - math.log(s_fit)
+    if span <= 0:
+        return (q_fit + q_miss) // 2
+    ratio = (math.log(max_bytes) - math.log(s_fit)) / span
+    return q_fit + int(ratio * (q_miss - q_fit))
+
+
+def encode_to_target(img, max_bytes, min_quality, initial_quality, size_model=None,
+                     allow_method=True, allow_resize=True, encoder=encode_webp, format=FORMAT_WEBP, **save_kwargs):
+    """
+    在内存中编码，找到不超过 max_bytes 的（近似）最高质量，不写磁盘。encoder 默认为 encode_webp，
+    也可以传入 encode_avif（此时 method 后备没有意义，应关闭 allow_method）。
+
+    1. 以 initial_quality（或 size_model 给出的起点）编码，满足限制则直接返回；
+    2. 否则在 [min_quality, initial_quality] 之间按 ln(大小) 插值搜索，区间缩小到 QUALITY_TOLERANCE 内即停止；
+    3. 质量下限仍超限时，依次尝试更高的 method 和按比例缩小尺寸。
+    始终返回 EncodeResult；若所有手段都无法满足限制，返回其中最小的一次结果（fits 为 False）。
+    """
+    encodes = 0
+    samples = []
+
+    def attempt(image, quality, method=DEFAULT_WEBP_METHOD):
+        nonlocal encodes
+        encodes += 1
+        data = encoder(image, quality, method, **save_kwargs)
+        if image is img and method == DEFAULT_WEBP_METHOD:
+            samples.append((quality, len(data)))
+        return data
+
+    pixels = img.width * img.height
+    slope = None
+    quality = initial_quality
+    if size_model is not None:
+        quality = size_model.seed_quality(pixels, max_bytes, min_quality, initial_quality)
+        slope = size_model.slope()
+
+    fit = None   # (quality, size, data)：满足限制的最高质量
+    miss = None  # (quality, size, data)：超出限制的最低质量
+    previous_side = None
+    same_side = False
+    while True:
+        data = attempt(img, quality)
+        side = len(data) <= max_bytes
+        if side:
+            fit = (quality, len(data), data)
+        else:
+            miss = (quality, len(data), data)
+        # 插值连续落在同一侧说明曲线弯曲明显，下一步改用中点，保证区间至少减半
+        same_side = side == previous_side
+        previous_side = side
+
+        if fit and fit[0] == initial_quality:
+            break
+        if miss and miss[0] == min_quality:
+            break
+        if fit and miss and miss[0] - fit[0] <= QUALITY_TOLERANCE:
+            break
+
+        if fit and miss:
+            if same_side:
+                quality = (fit[0] + miss[0]) // 2
+            else:
+                quality = _interpolate_quality(fit[:2], miss[:2], max_bytes)
+            quality = max(fit[0] + 1, min(miss[0] - 1, quality))
+        elif miss:
+            # 只有超限的点：有斜率时直接预测，否则先探测下限
+            quality = min_quality
+            if slope:
+                quality = int(miss[0] - math.log(miss[1] / max_bytes) / slope)
+            quality = max(min_quality, min(miss[0] - 1, quality))
+        else:
+            # 只有满足的点（起点被模型压低了）：向上探测
+            quality = initial_quality
+            if slope:
+                quality = int(fit[0] + math.log(max_bytes / fit[1]) / slope)
+            quality = max(fit[0] + 1, min(initial_quality, quality))
+
+    if size_model is not None and samples:
+        size_model.observe(pixels, samples, initial_quality)
+
+    if fit is not None:
+        return EncodeResult(fit[2], fit[0], DEFAULT_WEBP_METHOD, img.size, img.size, encodes, True, format)
+
+    # 质量下限仍然超限：先尝试更高的压缩强度
+    current, method, data = img, DEFAULT_WEBP_METHOD, miss[2]
+    if allow_method:
+        candidate = attempt(img, min_quality, MAX_WEBP_METHOD)
+        if len(candidate) < len(data):
+            method, data = MAX_WEBP_METHOD, candidate
+
+    # 再按面积比例缩小尺寸
+    if allow_resize:
+        from PIL import Image
+        for _ in range(MAX_RESIZE_ATTEMPTS):
+            if len(data) <= max_bytes:
+                break
+            scale = math.sqrt(max_bytes / len(data)) * 0.95
+            new_size = (max(1, int(current.width * scale)), max(1, int(current.height * scale)))
+            current = current.resize(new_size, Image.LANCZOS)
+            data = attempt(current, min_quality, method)
+
+    return EncodeResult(data, min_quality, method, current.size, img.size, encodes, len(data) <= max_bytes, format)
+
+
+def encode_lossless(img, max_bytes, **save_kwargs):
+    """无损 WebP 编码一次（不搜索质量也不缩小尺寸），超出 max_bytes 时 fits 为 False。"""
+    data = encode_webp(img, LOSSLESS_WEBP_EFFORT, DEFAULT_WEBP_METHOD, lossless=True, **save_kwargs)
+    return EncodeResult(data, 100, DEFAULT_WEBP_METHOD, img.size, img.size, 1, len(data) <= max_bytes,
+                        FORMAT_WEBP_LOSSLESS)
+
+
+def candidate_formats(img, formats):
+    """按图片内容筛选要尝试的格式：无损 WebP 只用于带透明通道或调色板类的图片。有损 WebP 总在第一位。"""
+    chosen = [FORMAT_WEBP]
+    if FORMAT_WEBP_LOSSLESS in formats and (has_alpha(img) or is_palette_like(img)):
+        chosen.append(FORMAT_WEBP_LOSSLESS)
+    if FORMAT_AVIF in formats:
+        chosen.append(FORMAT_AVIF)
+    return chosen
+
+
+def encode_best(img, max_bytes, min_quality, initial_quality, formats=(FORMAT_WEBP,), ssim_floor=None,
+                size_model=None, allow_method=True, allow_resize=True, executor=None,
+                avif_quality=(AVIF_MIN_QUALITY, AVIF_INITIAL_QUALITY), avif_kwargs=None):
+    """
+    按 formats 为同一张图片编码多个候选，返回 (最佳结果, 全部候选)。
+    - 有损 WebP 走 encode_to_target 的完整流程（含 method/缩小尺寸后备），它也是所有候选都不合格时的兜底；
+    - 无损 WebP 只对带透明通道或调色板类的图片尝试；
+    - AVIF 在自己的质量区间内搜索，不缩小尺寸。avif_kwargs 为额外的保存参数（例如 exif）。
+    合格的候选需不超过 max_bytes，且有多个候选时有损编码的 SSIM 不低于 ssim_floor；合格者中取最小的。
+    提供 executor 时除有损 WebP 以外的候选提交到该线程池并行编码（Pillow 编码时释放 GIL）。
+    """
+    formats = candidate_formats(img, formats)
+    jobs = []
+    if FORMAT_WEBP_LOSSLESS in formats:
+        jobs.append(lambda image: encode_lossless(image, max_bytes))
+    if FORMAT_AVIF in formats:
+        avif_min, avif_initial = avif_quality
+        jobs.append(lambda image: encode_to_target(image, max_bytes, avif_min, avif_initial, allow_method=False,
+                                                   allow_resize=False, encoder=encode_avif, format=FORMAT_AVIF,
+                                                   **(avif_kwargs or {})))
+    # Image.save 会把保存参数记在图片对象上 (encoderinfo)，并行编码时每个候选必须使用自己的副本
+    futures = [executor.submit(job, img.copy()) for job in jobs] if executor is not None else None
+    baseline = encode_to_target(img, max_bytes, min_quality, initial_quality, size_model=size_model,
+                                allow_method=allow_method, allow_resize=allow_resize)
+    others = [future.result() for future in futures] if futures is not None else [job(img) for job in jobs]
+    candidates = [baseline] + others
+    if len(candidates) == 1:
+        return baseline, candidates
+
+    for candidate in candidates:
+        if candidate.format != FORMAT_WEBP_LOSSLESS and ssim_floor is not None and candidate.fits:
+            candidate.ssim = ssim(img, _decode(candidate.data))
+    eligible = [c for c in candidates
+                if c.fits and (ssim_floor is None or c.ssim is None or c.ssim >= ssim_floor)]
+    best = min(eligible, key=len) if eligible else baseline
+    return best, candidates
@@ -0,0 +1,558 @@
+import logging
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+from fetch_scheduler import CircuitOpenError, HostScheduler, RETRYABLE_STATUSES, parse_retry_after
+
+# requests 和 aiohttp 导入较慢，只在第一次真正发起下载时才导入，所有输出都已存在的运行不会加载它们。
+# asyncio 引擎为可选功能，只有使用时才需要 aiohttp
+requests = None
+aiohttp = None
+
+# --- 默认下载配置 ---
+DEFAULT_PROXY = 'socks5://127.0.0.1:1080'
+DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 20
+# 小于该阈值的响应体完全保存在内存中，超过后才落盘
+DEFAULT_SPOOL_THRESHOLD = 4 * 1024 * 1024
+# 源图片的字节上限：Content-Length 超出时不读取响应体，没有 Content-Length 时边读边检查，超出即中止
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# asyncio 引擎的默认并发限制
+DEFAULT_MAX_IN_FLIGHT = 200
+DEFAULT_PER_HOST_LIMIT = 32
+
+
+logger = logging.getLogger('process_images')
+
+
+class FetchError(Exception):
+    """
+    下载失败：网络错误、HTTP错误状态或响应内容不是图片。
+    retryable 表示失败是暂时性的（连接错误、超时、429/5xx、熔断），稍后重新下载可能成功；
+    status 为 HTTP 状态码，retry_after 为服务器通过 Retry-After 要求等待的秒数。
+    """
+
+    def __init__(self, message, status=None, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+        self.retries = 0
+
+
+def _require_requests():
+    global requests
+    if requests is None:
+        import requests as module
+        requests = module
+    return requests
+
+
+def _require_aiohttp():
+    global aiohttp
+    if aiohttp is None:
+        try:
+            import aiohttp as module
+        except ImportError:
+            raise FetchError("asyncio 引擎需要安装 aiohttp: pip install aiohttp")
+        aiohttp = module
+    return aiohttp
+
+
+def conditional_headers(etag=None, last_modified=None):
+    """根据上次记录的校验信息构造条件请求头。"""
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+
+def http_error(message, status, headers):
+    """根据HTTP错误状态构造 FetchError：RETRYABLE_STATUSES 可以重试，并带上 Retry-After。"""
+    retry_after = parse_retry_after(headers.get('retry-after')) if headers is not None else None
+    return FetchError(message, status=status, retryable=status in RETRYABLE_STATUSES, retry_after=retry_after)
+
+
+def too_large_error(size, max_bytes, what='已读取'):
+    """源图片超出字节上限。重试不会改变结果，因此不可重试。"""
+    return FetchError(f"源图片过大: {what} {size / 1024 / 1024:.1f}MB 超出上限 {max_bytes / 1024 / 1024:.1f}MB")
+
+
+def check_content_length(headers, max_bytes):
+    """响应头声明的大小超出 max_bytes 时抛出 FetchError，不再读取响应体。max_bytes 为 0/None 表示不限制。"""
+    if not max_bytes:
+        return
+    try:
+        declared = int(headers.get('content-length'))
+    except (TypeError, ValueError):
+        return
+    if declared > max_bytes:
+        raise too_large_error(declared, max_bytes, 'Content-Length')
+
+
+def acquire_slot(scheduler, url):
+    """向调度器预订一次请求，返回需要等待的秒数；主机已熔断时抛出可重试的 FetchError。"""
+    try:
+        return scheduler.acquire(url)
+    except CircuitOpenError as e:
+        raise FetchError(f'下载失败: {e}', retryable=True) from e
+
+
+def retry_after_failure(scheduler, url, error, attempt):
+    """
+    记录一次失败并决定是否重试：返回重试前等待的秒数，不再重试时返回 None。
+    不可重试的错误（404、内容不是图片等）说明主机正常响应，按成功记录。
+    """
+    if not error.retryable:
+        scheduler.record_success(url)
+        return None
+    scheduler.record_failure(url, error.status, error.retry_after)
+    delay = scheduler.retry_delay(attempt, error.retry_after)
+    if delay is None:
+        error.retries = attempt
+    else:
+        logger.info(f"  [重试] ↻ {url} 第 {attempt + 1} 次重试（{delay:.1f}s 后）: {error}")
+    return delay
+
+
+class FetchResult:
+    """
+    一次下载的结果。body 是已定位到开头的类文件对象，可直接交给 Image.open。
+    小响应体保存在内存中，大响应体自动转存到临时文件；用完后需要 close()。
+    条件请求命中 (304) 时 not_modified 为 True，body 为 None。
+    timings 为本次请求各阶段的耗时（秒）：download（从发出请求到读完响应体）、ttfb（收到响应头），
+    asyncio 下载器新建连接时还有 dns / connect。retries 为重试次数。
+    """
+
+    def __init__(self, url, content_type, body, size, etag=None, last_modified=None, not_modified=False,
+                 timings=None, retries=0):
+        self.url = url
+        self.content_type = content_type
+        self.body = body
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.not_modified = not_modified
+        self.timings = timings or {}
+        self.retries = retries
+
+    def read(self):
+        """读取全部字节（会把文件指针移回开头）。"""
+        self.body.seek(0)
+        data = self.body.read()
+        self.body.seek(0)
+        return data
+
+    def close(self):
+        if self.body is not None:
+            self.body.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ImageFetcher:
+    """
+    线程安全的图片下载器。每个主机 (scheme://host) 使用一个独立的 requests.Session，
+    会话内的连接池在所有工作线程间共享，因此同一CDN的TCP/TLS/SOCKS握手只发生一次。
+    scheduler 为 HostScheduler（未提供时使用默认配置），负责按主机限速、暂时性失败的退避重试和熔断。
+    max_bytes 为源图片的字节上限（0/None 表示不限制），超出时抛出不可重试的 FetchError。
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, chunk_size=DEFAULT_CHUNK_SIZE,
+                 proxy=DEFAULT_PROXY, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, spool_threshold=DEFAULT_SPOOL_THRESHOLD,
+                 user_agent=DEFAULT_USER_AGENT, spool_dir=None, scheduler=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.scheduler = scheduler or HostScheduler()
+        self.pool_size = pool_size
+        self.chunk_size = chunk_size
+        self.proxy = proxy
+        self.timeout = (connect_timeout, read_timeout)
+        self.spool_threshold = spool_threshold
+        self.spool_dir = spool_dir
+        self.user_agent = user_agent
+        self.max_bytes = max_bytes
+
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._request_count = 0
+        self._not_modified_count = 0
+        self._bytes_downloaded = 0
+        self._too_large_count = 0
+
+    def _session_for(self, url):
+        parsed = urlparse(url)
+        host_key = f"{parsed.scheme}://{parsed.netloc}"
+        with self._lock:
+            session = self._sessions.get(host_key)
+            if session is None:
+                _require_requests()
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                # pool_block=True: 连接全部占用时让线程排队等待，而不是新建用完即弃的连接
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['User-Agent'] = self.user_agent
+                if self.proxy:
+                    session.proxies = {'http': self.proxy, 'https': self.proxy}
+                self._sessions[host_key] = session
+            return session
+
+    def fetch(self, url, etag=None, last_modified=None):
+        """
+        下载一张图片并返回 FetchResult。失败时抛出 FetchError。
+        提供 etag / last_modified 时发送条件请求，源文件未变化则返回 not_modified 的结果。
+        请求前按主机限速；暂时性失败按退避策略重试，等待时间计入 timings['throttle']。
+        """
+        headers = conditional_headers(etag, last_modified)
+        waited = 0.0
+        attempt = 0
+        while True:
+            delay = acquire_slot(self.scheduler, url)
+            if delay > 0:
+                time.sleep(delay)
+                waited += delay
+            try:
+                result = self._fetch_once(url, headers)
+            except FetchError as e:
+                delay = retry_after_failure(self.scheduler, url, e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                waited += delay
+                continue
+            except Exception:
+                self.scheduler.record_failure(url)
+                raise
+            self.scheduler.record_success(url)
+            result.retries = attempt
+            if waited:
+                result.timings['throttle'] = waited
+            return result
+
+    def _fetch_once(self, url, headers):
+        session = self._session_for(url)
+        start = time.perf_counter()
+        try:
+            with session.get(url, stream=True, timeout=self.timeout, headers=headers) as response:
+                # requests 不区分DNS/建立连接的耗时：新建连接时它们都包含在 ttfb 中
+                timings = {'ttfb': response.elapsed.total_seconds()}
+                if response.status_code == 304:
+                    with self._lock:
+                        self._request_count += 1
+                        self._not_modified_count += 1
+                    timings['download'] = time.perf_counter() - start
+                    return FetchResult(url, None, None, 0, etag=response.headers.get('etag'),
+                                       last_modified=response.headers.get('last-modified'), not_modified=True,
+                                       timings=timings)
+                response.raise_for_status()
+
+                content_type = response.headers.get('content-type', '').lower()
+                if not content_type.startswith('image/'):
+                    raise FetchError(f"下载内容不是图片 (Content-Type: {content_type})")
+                self._check_declared_size(response.headers)
+
+                body = tempfile.SpooledTemporaryFile(max_size=self.spool_threshold, dir=self.spool_dir)
+                size = 0
+                try:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        size += len(chunk)
+                        self._check_read_size(size)
+                        body.write(chunk)
+                except BaseException:
+                    body.close()
+                    raise
+        except requests.exceptions.HTTPError as e:
+            response = e.response
+            raise http_error(f'下载失败: {e}', getattr(response, 'status_code', None),
+                             getattr(response, 'headers', None)) from e
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            raise FetchError(f'下载失败: {e}', retryable=True) from e
+        except requests.exceptions.RequestException as e:
+            raise FetchError(f'下载失败: {e}') from e
+
+        with self._lock:
+            self._request_count += 1
+            self._bytes_downloaded += size
+
+        timings['download'] = time.perf_counter() - start
+        body.seek(0)
+        return FetchResult(url, content_type, body, size, etag=response.headers.get('etag'),
+                           last_modified=response.headers.get('last-modified'), timings=timings)
+
+    def _check_declared_size(self, headers):
+        try:
+            check_content_length(headers, self.max_bytes)
+        except FetchError:
+            with self._lock:
+                self._too_large_count += 1
+            raise
+
+    def _check_read_size(self, size):
+        if self.max_bytes and size > self.max_bytes:
+            with self._lock:
+                self._too_large_count += 1
+            raise too_large_error(size, self.max_bytes)
+
+    def stats(self):
+        """返回请求数、实际新建的连接数以及因连接复用而节省的握手次数。"""
+        connections = 0
+        with self._lock:
+            sessions = list(self._sessions.values())
+            request_count = self._request_count
+            not_modified_count = self._not_modified_count
+            bytes_downloaded = self._bytes_downloaded
+            too_large_count = self._too_large_count
+
+        for session in sessions:
+            for adapter in set(session.adapters.values()):
+                managers = [adapter.poolmanager, *adapter.proxy_manager.values()]
+                for manager in managers:
+                    for key in list(manager.pools.keys()):
+                        pool = manager.pools.get(key)
+                        if pool is not None:
+                            connections += pool.num_connections
+
+        return {
+            'hosts': len(sessions),
+            'requests': request_count,
+            'connections': connections,
+            'handshakes_saved': max(request_count - connections, 0),
+            'not_modified': not_modified_count,
+            'bytes': bytes_downloaded,
+            'too_large': too_large_count,
+            **self.scheduler.stats(),
+        }
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+def socks_connector_class():
+    """返回 aiohttp_socks.ProxyConnector；未安装时抛出 FetchError，供命令行在启动前检查。"""
+    try:
+        from aiohttp_socks import ProxyConnector
+    except ImportError:
+        raise FetchError("asyncio 引擎使用 SOCKS 代理需要安装 aiohttp_socks: pip install aiohttp_socks")
+    return ProxyConnector
+
+
+class AsyncImageFetcher:
+    """
+    基于 aiohttp 的协程下载器，供 asyncio 引擎使用。
+    max_in_flight 限制全局并发下载数，per_host_limit 限制单个主机的并发数，
+    scheduler 的限速、重试和熔断与 ImageFetcher 相同（等待在事件循环中进行，不占用并发名额）。
+    必须在 `async with fetcher:` 中使用；fetch() 返回与 ImageFetcher 相同的 FetchResult。
+    """
+
+    def __init__(self, max_in_flight=DEFAULT_MAX_IN_FLIGHT, per_host_limit=DEFAULT_PER_HOST_LIMIT,
+                 chunk_size=DEFAULT_CHUNK_SIZE, proxy=DEFAULT_PROXY, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, spool_threshold=DEFAULT_SPOOL_THRESHOLD,
+                 user_agent=DEFAULT_USER_AGENT, spool_dir=None, scheduler=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.scheduler = scheduler or HostScheduler()
+        self.max_in_flight = max_in_flight
+        self.per_host_limit = per_host_limit
+        self.chunk_size = chunk_size
+        self.proxy = proxy
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.spool_threshold = spool_threshold
+        self.spool_dir = spool_dir
+        self.user_agent = user_agent
+        self.max_bytes = max_bytes
+
+        self._session = None
+        self._request_proxy = None
+        self._host_slots = {}
+        self._hosts = set()
+        self._request_count = 0
+        self._not_modified_count = 0
+        self._connections = 0
+        self._bytes_downloaded = 0
+        self._too_large_count = 0
+
+    def _make_connector(self):
+        """返回 (connector, 每个请求使用的proxy参数)。SOCKS代理需要 aiohttp_socks。"""
+        if self.proxy and self.proxy.startswith('socks'):
+            ProxyConnector = socks_connector_class()
+            connector = ProxyConnector.from_url(self.proxy, limit=self.max_in_flight)
+            return connector, None
+        # 按主机的并发由 _host_slots 控制（代理模式下所有请求的连接目标都是代理，connector 无法区分主机）
+        return aiohttp.TCPConnector(limit=self.max_in_flight), self.proxy
+
+    async def _on_connection_created(self, session, context, params):
+        self._connections += 1
+        timings = context.trace_request_ctx
+        if timings is not None and 'connect_start' in timings:
+            timings['connect'] = time.perf_counter() - timings.pop('connect_start')
+
+    async def _on_connection_create_start(self, session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx['connect_start'] = time.perf_counter()
+
+    async def _on_dns_start(self, session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx['dns_start'] = time.perf_counter()
+
+    async def _on_dns_end(self, session, context, params):
+        timings = context.trace_request_ctx
+        if timings is not None and 'dns_start' in timings:
+            timings['dns'] = time.perf_counter() - timings.pop('dns_start')
+
+    async def __aenter__(self):
+        _require_aiohttp()
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_start.append(self._on_connection_create_start)
+        trace.on_connection_create_end.append(self._on_connection_created)
+        trace.on_dns_resolvehost_start.append(self._on_dns_start)
+        trace.on_dns_resolvehost_end.append(self._on_dns_end)
+        connector, self._request_proxy = self._make_connector()
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers={'User-Agent': self.user_agent},
+            timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout),
+            trace_configs=[trace],
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._session.close()
+        self._session = None
+
+    async def fetch(self, url, etag=None, last_modified=None):
+        """下载一张图片并返回 FetchResult，条件请求、限速和重试语义与 ImageFetcher.fetch 相同。失败时抛出 FetchError。"""
+        import asyncio
+
+        headers = conditional_headers(etag, last_modified)
+        waited = 0.0
+        attempt = 0
+        while True:
+            delay = acquire_slot(self.scheduler, url)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                waited += delay
+            try:
+                result = await self._fetch_once(url, headers)
+            except FetchError as e:
+                delay = retry_after_failure(self.scheduler, url, e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                waited += delay
+                continue
+            except Exception:
+                self.scheduler.record_failure(url)
+                raise
+            self.scheduler.record_success(url)
+            result.retries = attempt
+            if waited:
+                result.timings['throttle'] = waited
+            return result
+
+    async def _fetch_once(self, url, headers):
+        import asyncio
+
+        host = urlparse(url).netloc
+        self._hosts.add(host)
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = self._host_slots[host] = asyncio.Semaphore(self.per_host_limit)
+
+        async with slot:
+            # 由 TraceConfig 回调填入本次请求的 dns / connect 耗时
+            timings = {}
+            start = time.perf_counter()
+            try:
+                async with self._session.get(url, proxy=self._request_proxy, trace_request_ctx=timings,
+                                             headers=headers) as response:
+                    timings['ttfb'] = time.perf_counter() - start
+                    if response.status == 304:
+                        self._request_count += 1
+                        self._not_modified_count += 1
+                        timings['download'] = time.perf_counter() - start
+                        return FetchResult(url, None, None, 0, etag=response.headers.get('etag'),
+                                           last_modified=response.headers.get('last-modified'), not_modified=True,
+                                           timings=timings)
+                    response.raise_for_status()
+
+                    content_type = response.headers.get('content-type', '').lower()
+                    if not content_type.startswith('image/'):
+                        raise FetchError(f"下载内容不是图片 (Content-Type: {content_type})")
+                    try:
+                        check_content_length(response.headers, self.max_bytes)
+                    except FetchError:
+                        self._too_large_count += 1
+                        raise
+
+                    body = tempfile.SpooledTemporaryFile(max_size=self.spool_threshold, dir=self.spool_dir)
+                    size = 0
+                    try:
+                        async for chunk in response.content.iter_chunked(self.chunk_size):
+                            size += len(chunk)
+                            if self.max_bytes and size > self.max_bytes:
+                                self._too_large_count += 1
+                                raise too_large_error(size, self.max_bytes)
+                            body.write(chunk)
+                    except BaseException:
+                        body.close()
+                        raise
+            except aiohttp.ClientResponseError as e:
+                raise http_error(f'下载失败: {e}', e.status, e.headers) from e
+            except aiohttp.InvalidURL as e:
+                raise FetchError(f'下载失败: {e}') from e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise FetchError(f'下载失败: {e or type(e).__name__}', retryable=True) from e
+
+        self._request_count += 1
+        self._bytes_downloaded += size
+        timings['download'] = time.perf_counter() - start
+        body.seek(0)
+        return FetchResult(url, content_type, body, size, etag=response.headers.get('etag'),
+                           last_modified=response.headers.get('last-modified'), timings=timings)
+
+    def stats(self):
+        """与 ImageFetcher.stats() 相同格式的统计信息。"""
+        return {
+            'hosts': len(self._hosts),
+            'requests': self._request_count,
+            'connections': self._connections,
+            'handshakes_saved': max(self._request_count - self._connections, 0),
+            'not_modified': self._not_modified_count,
+            'bytes': self._bytes_downloaded,
+            'too_large': self._too_large_count,
+            **self.scheduler.stats(),
+        }
+
+    def close(self):
+        """会话在 `async with` 退出时已关闭，这里仅为与 ImageFetcher 保持接口一致。"""
+
+
+_default_fetcher = None
+_default_fetcher_lock = threading.Lock()
+
+
+def get_default_fetcher():
+    """返回进程内共享的默认下载器（按需创建）。"""
+    global _default_fetcher
+    with _default_fetcher_lock:
+        if _default_fetcher is None:
+            _default_fetcher = ImageFetcher()
+        return _default_fetcher
@@ -0,0 +1,351 @@
+"""
+图片来源解析：process_images 通过 SourceResolver 获取源图片，按顺序尝试本地来源，都没有时才走 HTTP 下载。
+
+- file:// URL 直接读取本地文件。
+- MirrorSource：本地镜像目录，URL 依次映射为 <目录>/<主机>/<路径>、<目录>/<路径>、<目录>/<文件名>。
+- ArchiveSource：tar（含 .tar.gz / .tar.bz2 / .tar.xz）或 zip 归档，成员按路径或文件名匹配 URL，
+  内容读入内存缓冲区（超过阈值时转存临时文件）后直接交给解码/编码阶段，不解压到磁盘。
+  tar 归档按成员在归档中的顺序顺序读取：process_images 先按 plan_reads() 给出的顺序排列待处理项目，
+  读取某个成员时顺带缓存途经的、其他线程稍后会请求的成员，压缩的 tar 不会反复从头解压。
+
+本地来源返回的 FetchResult 与 HTTP 下载相同；ETag 由文件大小和修改时间（zip 为 CRC）生成，
+因此 --revalidate 时未变化的本地图片同样按 304 处理。离线模式 (offline) 下本地来源中找不到的图片直接失败。
+"""
+import mimetypes
+import os
+import tempfile
+import threading
+from urllib.parse import unquote, urlparse
+
+from image_fetcher import DEFAULT_MAX_BYTES, DEFAULT_SPOOL_THRESHOLD, FetchError, FetchResult, too_large_error
+
+LOCAL_SCHEMES = ('file://',)
+HTTP_SCHEMES = ('http://', 'https://')
+SUPPORTED_SCHEMES = HTTP_SCHEMES + LOCAL_SCHEMES
+# 从归档复制到缓冲区时每次读取的字节数
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def is_source_url(url):
+    """是否为可以解析的源图片URL（HTTP/HTTPS 或 file://）。"""
+    return isinstance(url, str) and url.startswith(SUPPORTED_SCHEMES)
+
+
+def candidate_paths(url):
+    """
+    URL 在本地来源中的候选相对路径，按优先级排列：主机/路径、路径、文件名。
+    file:// URL 只有路径本身。
+    """
+    parsed = urlparse(url)
+    path = unquote(parsed.path).lstrip('/')
+    if not path:
+        return []
+    candidates = [f"{parsed.netloc}/{path}", path] if parsed.netloc else [path]
+    basename = path.rsplit('/', 1)[-1]
+    if basename not in candidates:
+        candidates.append(basename)
+    return candidates
+
+
+def guess_content_type(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def local_result(url, name, body, size, etag, etag_in=None):
+    """构造本地来源的 FetchResult；etag 与调用方传入的相同时按 304 处理并关闭 body。"""
+    if etag_in and etag_in == etag:
+        body.close()
+        return FetchResult(url, None, None, 0, etag=etag, not_modified=True)
+    body.seek(0)
+    return FetchResult(url, guess_content_type(name), body, size, etag=etag)
+
+
+class FileSource:
+    """file:// URL：直接打开本地文件，不复制。"""
+
+    name = 'file'
+
+    def lookup(self, url):
+        if not url.startswith(LOCAL_SCHEMES):
+            return None
+        path = unquote(urlparse(url).path)
+        return path if os.path.isfile(path) else None
+
+    def open(self, url, path, etag=None):
+        st = os.stat(path)
+        return local_result(url, path, open(path, 'rb'), st.st_size, f'"{st.st_size:x}-{st.st_mtime_ns:x}"', etag)
+
+    def plan_reads(self, urls):
+        return {}
+
+    def close(self):
+        pass
+
+
+class MirrorSource(FileSource):
+    """本地镜像目录：按 candidate_paths() 的顺序查找第一个存在的文件。"""
+
+    name = 'mirror'
+
+    def __init__(self, root):
+        if not os.path.isdir(root):
+            raise FileNotFoundError(f"镜像目录不存在: {root}")
+        self.root = root
+
+    def lookup(self, url):
+        for candidate in candidate_paths(url):
+            path = os.path.join(self.root, *candidate.split('/'))
+            if os.path.isfile(path):
+                return path
+        return None
+
+
+class ArchiveSource:
+    """
+    tar 或 zip 归档。打开时只读取成员列表（tar 需要顺序扫描一遍头部），
+    之后每个成员的内容读入 SpooledTemporaryFile：小于 spool_threshold 时完全在内存中。
+    所有读取在同一把锁内进行，可以被多个下载线程共享。
+    """
+
+    name = 'archive'
+
+    def __init__(self, path, spool_threshold=DEFAULT_SPOOL_THRESHOLD, spool_dir=None):
+        self.path = path
+        self.spool_threshold = spool_threshold
+        self.spool_dir = spool_dir
+        self._lock = threading.Lock()
+        self._zip = None
+        self._tar = None
+        self._tar_members = None
+        self._position = -1
+        self._wanted = set()
+        self._buffered = {}
+        self.rewinds = 0
+
+        # tarfile / zipfile 只在使用归档时才导入，不影响没有归档的热运行启动耗时
+        import tarfile
+        import zipfile
+
+        if zipfile.is_zipfile(path):
+            self._zip = zipfile.ZipFile(path)
+            infos = [info for info in self._zip.infolist() if not info.is_dir()]
+            names = [info.filename for info in infos]
+            self._etags = {info.filename: f'"{info.CRC:08x}-{info.file_size:x}"' for info in infos}
+        else:
+            try:
+                with tarfile.open(path, 'r:*') as archive:
+                    members = [member for member in archive if member.isfile()]
+            except tarfile.TarError as e:
+                raise ValueError(f"{path} 不是可识别的 tar 或 zip 归档: {e}") from e
+            names = [member.name for member in members]
+            self._etags = {member.name: f'"{member.size:x}-{int(member.mtime):x}"' for member in members}
+
+        # 成员在归档中的顺序，以及按规范化路径和文件名的查找表（同名文件只按完整路径匹配）
+        self.order = {name: i for i, name in enumerate(names)}
+        self._by_path = {}
+        basenames = {}
+        for name in names:
+            normalized = name[2:] if name.startswith('./') else name.lstrip('/')
+            self._by_path.setdefault(normalized, name)
+            basenames.setdefault(normalized.rsplit('/', 1)[-1], []).append(name)
+        self._by_basename = {base: found[0] for base, found in basenames.items() if len(found) == 1}
+
+    def __len__(self):
+        return len(self.order)
+
+    def lookup(self, url):
+        candidates = candidate_paths(url)
+        for candidate in candidates:
+            name = self._by_path.get(candidate)
+            if name is not None:
+                return name
+        return self._by_basename.get(candidates[-1]) if candidates else None
+
+    def plan_reads(self, urls):
+        """登记本次会读取的成员，返回 {url: 成员在归档中的位置}，供调用方按归档顺序安排读取。"""
+        positions = {}
+        with self._lock:
+            for url in urls:
+                name = self.lookup(url)
+                if name is not None:
+                    self._wanted.add(name)
+                    positions[url] = self.order[name]
+        return positions
+
+    def _spool(self, fileobj):
+        body = tempfile.SpooledTemporaryFile(max_size=self.spool_threshold, dir=self.spool_dir)
+        size = 0
+        try:
+            while True:
+                chunk = fileobj.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                body.write(chunk)
+                size += len(chunk)
+        except BaseException:
+            body.close()
+            raise
+        return body, size
+
+    def _read_tar_member(self, name):
+        """顺序读取到成员 name，途经的已登记成员先缓存起来；目标在当前位置之前时重新打开归档。"""
+        import tarfile
+
+        target = self.order[name]
+        if self._tar is None or target <= self._position:
+            if self._tar is not None:
+                self._tar.close()
+                self.rewinds += 1
+            self._tar = tarfile.open(self.path, 'r:*')
+            self._tar_members = iter(self._tar)
+            self._position = -1
+        for member in self._tar_members:
+            if not member.isfile():
+                continue
+            self._position = self.order.get(member.name, self._position)
+            if member.name == name:
+                return self._spool(self._tar.extractfile(member))
+            if member.name in self._wanted and member.name not in self._buffered:
+                self._buffered[member.name] = self._spool(self._tar.extractfile(member))
+        raise FetchError(f"归档 {self.path} 中读取成员 {name} 失败")
+
+    def open(self, url, name, etag=None):
+        with self._lock:
+            self._wanted.discard(name)
+            if name in self._buffered:
+                body, size = self._buffered.pop(name)
+            elif self._zip is not None:
+                with self._zip.open(name) as member:
+                    body, size = self._spool(member)
+            else:
+                body, size = self._read_tar_member(name)
+        return local_result(url, name, body, size, self._etags[name], etag)
+
+    def close(self):
+        with self._lock:
+            for body, _ in self._buffered.values():
+                body.close()
+            self._buffered.clear()
+            if self._zip is not None:
+                self._zip.close()
+            if self._tar is not None:
+                self._tar.close()
+                self._tar = None
+
+
+class SourceResolver:
+    """
+    按顺序在本地来源（file://、镜像目录、归档）中查找源图片，都没有时交给 http_fetcher（ImageFetcher）。
+    http_fetcher 为 None（离线模式）时找不到的图片直接失败，不会重试。
+    max_bytes 与 ImageFetcher 的字节上限相同，本地文件超出时同样失败。
+    接口与 ImageFetcher 相同：fetch() / stats() / close()，scheduler 为 HTTP 下载器的调度器。
+    """
+
+    def __init__(self, sources=(), http_fetcher=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.sources = [FileSource(), *sources]
+        self.http_fetcher = http_fetcher
+        self.scheduler = getattr(http_fetcher, 'scheduler', None)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._local = {'local_hits': 0, 'local_bytes': 0, 'local_not_modified': 0, 'local_misses': 0,
+                       'local_too_large': 0}
+        self._by_source = {}
+
+    def _find(self, url):
+        for source in self.sources:
+            key = source.lookup(url)
+            if key is not None:
+                return source, key
+        return None, None
+
+    def _count(self, source, result):
+        if self.max_bytes and result.size > self.max_bytes:
+            result.close()
+            with self._lock:
+                self._local['local_too_large'] += 1
+            raise too_large_error(result.size, self.max_bytes, '文件大小')
+        with self._lock:
+            self._local['local_hits'] += 1
+            self._local['local_bytes'] += result.size
+            if result.not_modified:
+                self._local['local_not_modified'] += 1
+            self._by_source[source.name] = self._by_source.get(source.name, 0) + 1
+
+    def _miss(self, url):
+        with self._lock:
+            self._local['local_misses'] += 1
+        if url.startswith(LOCAL_SCHEMES):
+            return FetchError(f"本地文件不存在: {url}")
+        return FetchError(f"离线模式：本地来源中没有 {url}")
+
+    def fetch(self, url, etag=None, last_modified=None):
+        source, key = self._find(url)
+        if source is not None:
+            result = source.open(url, key, etag)
+            self._count(source, result)
+            return result
+        if self.http_fetcher is None or not url.startswith(HTTP_SCHEMES):
+            raise self._miss(url)
+        return self.http_fetcher.fetch(url, etag=etag, last_modified=last_modified)
+
+    def plan_reads(self, urls):
+        """
+        返回每个 URL 的读取顺序键：归档中的成员按 (来源序号, 成员位置) 排在前面，其余保持原有顺序。
+        调用方按该顺序提交任务，tar 归档就能顺序读取。
+        """
+        order = {}
+        for rank, source in enumerate(self.sources):
+            for url, position in source.plan_reads(urls).items():
+                order.setdefault(url, (rank, position))
+        return lambda url: order.get(url, (len(self.sources), 0))
+
+    def stats(self):
+        stats = self.http_fetcher.stats() if self.http_fetcher is not None else {
+            'hosts': 0, 'requests': 0, 'connections': 0, 'handshakes_saved': 0, 'not_modified': 0, 'bytes': 0}
+        with self._lock:
+            stats.update(self._local, local_sources=dict(self._by_source))
+        stats['too_large'] = stats.get('too_large', 0) + stats['local_too_large']
+        stats['archive_rewinds'] = sum(getattr(source, 'rewinds', 0) for source in self.sources)
+        return stats
+
+    def close(self):
+        for source in self.sources:
+            source.close()
+        if self.http_fetcher is not None:
+            self.http_fetcher.close()
+
+
+class AsyncSourceResolver(SourceResolver):
+    """asyncio 引擎使用的版本：本地读取在线程中进行，HTTP 下载交给 AsyncImageFetcher。"""
+
+    @property
+    def max_in_flight(self):
+        return getattr(self.http_fetcher, 'max_in_flight', 0)
+
+    async def __aenter__(self):
+        if self.http_fetcher is not None:
+            await self.http_fetcher.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.http_fetcher is not None:
+            await self.http_fetcher.__aexit__(exc_type, exc, tb)
+
+    async def fetch(self, url, etag=None, last_modified=None):
+        import asyncio
+
+        source, key = self._find(url)
+        if source is not None:
+            result = await asyncio.get_running_loop().run_in_executor(None, source.open, url, key, etag)
+            self._count(source, result)
+            return result
+        if self.http_fetcher is None or not url.startswith(HTTP_SCHEMES):
+            raise self._miss(url)
+        return await self.http_fetcher.fetch(url, etag=etag, last_modified=last_modified)
+
+
+def build_sources(mirrors=(), archives=(), spool_threshold=DEFAULT_SPOOL_THRESHOLD, spool_dir=None):
+    """根据命令行参数创建本地来源列表：镜像目录在前，归档在后，按给出的顺序查找。"""
+    sources = [MirrorSource(root) for root in mirrors]
+    sources.extend(ArchiveSource(path, spool_threshold, spool_dir) for path in archives)
+    return sources
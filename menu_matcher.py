@@ -0,0 +1,121 @@
+"""
+菜名匹配引擎：为一个分类的所有菜名建立一次索引，之后每次查找只访问与查询共享 n-gram 的菜品，
+不再逐个比较整个分类。
+
+- 标准化名称哈希表：忽略大小写、括号内容、重音符号和标点，"Spinach Artichoke Dip" 与
+  "Spinach-Artichoke Dip" 直接命中。
+- n-gram 倒排索引：每个菜名拆成字符三元组和单词，查询时按共享的 n-gram 数计算 Dice 相似度 (0~1)，
+  超过阈值的最高分即为匹配。出现频率过高的 n-gram（如 "chi"）只用于打分，不用于召回候选，
+  分类有上千个菜品时查找开销仍只与候选数相关。
+- 最高分与次高分相差不到 margin 时标记为有歧义，写入匹配报告供人工确认。
+"""
+import collections
+import re
+import unicodedata
+
+DEFAULT_THRESHOLD = 0.75
+DEFAULT_MARGIN = 0.05
+NGRAM_SIZE = 3
+# 候选召回时跳过出现在超过该比例菜品中的 n-gram（菜品数不超过 COMMON_GRAM_MIN_DOCS 时全部使用）
+COMMON_GRAM_RATIO = 0.2
+COMMON_GRAM_MIN_DOCS = 50
+# 参与精确打分的最多候选数（按共享的 n-gram 数预选）
+MAX_CANDIDATES = 20
+
+_PARENS = re.compile(r'\(.*?(\)|$)')
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def canonical_name(name):
+    """
+    匹配用的规范化名称：去掉括号内容（包括未闭合的括号，如 "Chicken Alfredo (Serves 4-6"）、
+    重音符号和标点，"&" 视为 "and"，转为小写并合并空白。
+    """
+    if not isinstance(name, str):
+        return ''
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(ch for ch in name if not unicodedata.combining(ch))
+    name = _PARENS.sub(' ', name.lower()).replace('&', ' and ')
+    return _NON_WORD.sub(' ', name).strip()
+
+
+def name_grams(key, n=NGRAM_SIZE):
+    """规范化名称的 n-gram 集合：每个单词（带 'w:' 前缀）以及去掉空格后的字符 n-gram（首尾补空格）。"""
+    grams = {f"w:{token}" for token in key.split()}
+    compact = f" {key.replace(' ', '')} "
+    grams.update(compact[i:i + n] for i in range(max(len(compact) - n + 1, 1)))
+    return grams
+
+
+def dice(a, b):
+    return 2 * len(a & b) / (len(a) + len(b)) if a or b else 0.0
+
+
+class MenuIndex:
+    """
+    一个分类的菜名索引。titles 为源菜单中的原始菜名，lookup() 返回匹配结果字典：
+    title（匹配到的原始菜名，未匹配时为 None）、score、method（'exact' / 'fuzzy' / None）、
+    candidates（得分最高的几个 (菜名, 分数)）和 ambiguous。
+    """
+
+    def __init__(self, titles, threshold=DEFAULT_THRESHOLD, margin=DEFAULT_MARGIN):
+        self.threshold = threshold
+        self.margin = margin
+        self.titles = []
+        self.grams = []
+        self.exact = {}
+        self.postings = collections.defaultdict(list)
+        for title in titles:
+            key = canonical_name(title)
+            if not key:
+                continue
+            doc = len(self.titles)
+            self.titles.append(title)
+            self.exact.setdefault(key, []).append(doc)
+            grams = name_grams(key)
+            self.grams.append(grams)
+            for gram in grams:
+                self.postings[gram].append(doc)
+        count = len(self.titles)
+        self.max_postings = count if count <= COMMON_GRAM_MIN_DOCS else max(int(count * COMMON_GRAM_RATIO), 1)
+
+    def __len__(self):
+        return len(self.titles)
+
+    def _candidates(self, grams):
+        shared = collections.Counter()
+        for gram in grams:
+            docs = self.postings.get(gram)
+            if docs and len(docs) <= self.max_postings:
+                shared.update(docs)
+        if not shared:
+            # 查询只包含常见的 n-gram 时退回到使用全部 n-gram
+            for gram in grams:
+                shared.update(self.postings.get(gram, ()))
+        return [doc for doc, _ in shared.most_common(MAX_CANDIDATES)]
+
+    def lookup(self, name):
+        key = canonical_name(name)
+        result = {'query': name, 'title': None, 'score': 0.0, 'method': None, 'candidates': [], 'ambiguous': False}
+        if not key:
+            return result
+
+        docs = self.exact.get(key)
+        if docs:
+            result.update(title=self.titles[docs[0]], score=1.0, method='exact',
+                          candidates=[(self.titles[doc], 1.0) for doc in docs[:3]], ambiguous=len(docs) > 1)
+            return result
+
+        grams = name_grams(key)
+        scored = sorted(((dice(grams, self.grams[doc]), doc) for doc in self._candidates(grams)),
+                        key=lambda entry: (-entry[0], entry[1]))
+        result['candidates'] = [(self.titles[doc], round(score, 3)) for score, doc in scored[:3]]
+        if not scored or scored[0][0] < self.threshold:
+            if scored:
+                result['score'] = round(scored[0][0], 3)
+            return result
+        best_score, best_doc = scored[0]
+        runner_up = scored[1][0] if len(scored) > 1 else 0.0
+        result.update(title=self.titles[best_doc], score=round(best_score, 3), method='fuzzy',
+                      ambiguous=runner_up >= self.threshold and best_score - runner_up < self.margin)
+        return result
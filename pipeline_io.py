@@ -0,0 +1,71 @@
+"""
+流水线各脚本共用的文件工具：原子写入 JSON、读取图片尺寸。
+
+只依赖标准库和 webp_container（读取非 WebP 图片的尺寸时才导入 Pillow），
+process_positions、process_keywords、process_regions、compile_data 和 run_pipeline 导入它时
+不会加载 process_images 及其下载、编码相关的依赖；run_pipeline 的阶段指纹也只需包含本文件。
+"""
+import logging
+import os
+import stat
+import tempfile
+
+from webp_container import probe_dimensions
+
+logger = logging.getLogger('process_images')
+
+
+def file_mode_for(path):
+    """替换 path 时应使用的权限：沿用已有文件的权限，新文件按当前 umask 计算（与 open() 创建的文件相同）。"""
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def write_json_atomic(path, text):
+    """
+    先写入同目录下的临时文件再原子替换，写入过程中崩溃不会截断原文件。
+    mkstemp 创建的临时文件权限为 0600，替换前改为原文件（或新文件按 umask）应有的权限。
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, file_mode_for(path))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def get_image_dimensions(image_path, cache=None):
+    """
+    读取并返回图片的宽度和高度。WebP 直接从文件头解析，其他格式才交给 Pillow。
+    提供 cache 时按 (路径, 大小, 修改时间) 缓存结果，文件未变化就不再打开。
+    """
+    if cache is not None:
+        size = cache.get_dimensions(image_path)
+        if size is not None:
+            return size
+    try:
+        size = probe_dimensions(image_path)
+        if size is None:
+            from PIL import Image
+            with Image.open(image_path) as img:
+                size = img.size
+    except OSError:
+        # Pillow 的 UnidentifiedImageError 也是 OSError 的子类
+        logger.warning(f"  [警告] ✗ 无法读取图片尺寸 (文件可能无效或不存在): {os.path.basename(image_path)}")
+        return (0, 0)
+    except Exception as e:
+        logger.warning(f"  [警告] ✗ 读取图片尺寸时发生未知错误: {os.path.basename(image_path)} (错误: {e})")
+        return (0, 0)
+    if cache is not None:
+        cache.put_dimensions(image_path, *size)
+    return size
@@ -1,27 +1,95 @@
+import io
+import itertools
 import json
+import logging
+import multiprocessing
 import os
-import requests
+import queue
 import threading
+import time
 import uuid
 import argparse
+import glob
 import hashlib
 from datetime import datetime
 from urllib.parse import urlparse, unquote, parse_qs
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from PIL import Image, UnidentifiedImageError
-import piexif
-import piexif.helper
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+# PIL、requests、aiohttp 都按需导入：所有WebP都已存在的运行不需要它们，启动时间主要花在这些导入上
+
+from fetch_scheduler import (
+    HostScheduler, DEFAULT_HOST_RATE, DEFAULT_HOST_BURST, DEFAULT_MAX_RETRIES, DEFAULT_BACKOFF_BASE,
+    DEFAULT_BACKOFF_MAX, DEFAULT_BREAKER_THRESHOLD, DEFAULT_BREAKER_COOLDOWN,
+)
+from image_cache import ImageCache, DEFAULT_CACHE_DIR, hash_stream
+from image_dedupe import DedupeIndex, DEDUPE_INDEX_FILENAME, DEFAULT_MAX_DISTANCE, dhash
+from image_encoder import (
+    MemoryBudget, SizeModel, avif_supported, decode_cost, encode_best, has_alpha, peak_rss_kb,
+    FORMAT_AVIF, FORMAT_SUFFIXES, FORMAT_WEBP, FORMAT_WEBP_LOSSLESS, OUTPUT_SUFFIXES,
+)
+from image_fetcher import (
+    ImageFetcher, AsyncImageFetcher, FetchError, get_default_fetcher, socks_connector_class,
+    DEFAULT_MAX_IN_FLIGHT, DEFAULT_PER_HOST_LIMIT,
+    DEFAULT_PROXY, DEFAULT_POOL_SIZE, DEFAULT_CHUNK_SIZE, DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_READ_TIMEOUT, DEFAULT_SPOOL_THRESHOLD, DEFAULT_MAX_BYTES,
+)
+from image_sources import ArchiveSource, AsyncSourceResolver, SourceResolver, build_sources, is_source_url
+from pipeline_io import get_image_dimensions, write_json_atomic
+from run_journal import RunJournal, DEFAULT_JOURNAL_FILENAME
+from run_metrics import RunMetrics, LOG_LEVELS, DEFAULT_REPORT_FILENAME, setup_logging, timed
+from webp_container import (
+    WebPFormatError, build_comment_exif, build_comment_xmp, content_digest, set_metadata,
+)
 
 # --- 配置信息 ---
 # 1. 移除全局配置，这些将通过CLI传入
 # IMAGE_DOWNLOAD_DIR = 'public/static/image/upload/'
 # NEW_IMAGE_URL_PREFIX = '/static/image/upload/'
 MAX_WORKERS = 10
+# 因暂时性错误（超时、429/5xx、熔断）失败的项目在运行末尾重新排队的最大轮数
+REQUEUE_ROUNDS = 2
 MAX_FILE_SIZE_KB = 300
 MIN_WEBP_QUALITY = 65
 INITIAL_WEBP_QUALITY = 85
+# 候选输出格式：每张图片在其中选出不超过大小限制、且有损编码的 SSIM 不低于 SSIM_FLOOR 的最小结果。
+# avif 会把输出文件的扩展名改为 .avif（需要浏览器支持 AVIF），因此默认不启用
+OUTPUT_FORMATS = (FORMAT_WEBP, FORMAT_WEBP_LOSSLESS)
+SSIM_FLOOR = 0.98
+# 质量降到 MIN_WEBP_QUALITY 仍超出大小限制时的后备手段
+ALLOW_METHOD_FALLBACK = True
+ALLOW_RESIZE_FALLBACK = True
+# 源图片的像素上限（宽 x 高），超出时不解码，直接记为失败
+MAX_SOURCE_PIXELS = 100_000_000
+# 主图的最大宽度，更宽的源图片按该宽度解码和输出（JPEG 直接以缩小的尺寸解码），0 表示保持原尺寸
+MAX_OUTPUT_WIDTH = 2048
+# 同时进行的解码/编码按估算占用的内存上限 (MB)，超出时后到的图片排队等待，0 表示不限制
+MEMORY_BUDGET_MB = 1024
+# 唯一性标记：'random' 每次写入时间戳和UUID；'source-hash' 由源图片哈希生成，重复运行结果可复现
+STAMP_MODE = 'random'
+# 标记写入的元数据块：'exif' (UserComment) 或 'xmp' (dc:description)
+STAMP_CHUNK = 'exif'
+# 响应式尺寸变体的宽度（如 (160, 320, 640)），为空时只生成原尺寸的WebP。只缩小，不放大
+VARIANT_WIDTHS = ()
+# resize 先用 reduce() 按整数倍缩小到目标尺寸的该倍数以内，再做 LANCZOS 重采样
+VARIANT_REDUCING_GAP = 3.0
+# 感知哈希去重索引的路径，为 None 时不去重；视觉相同的判定阈值（dHash 汉明距离）
+DEDUPE_INDEX_PATH = None
+DEDUPE_MAX_DISTANCE = DEFAULT_MAX_DISTANCE
+# 日志级别（同步给编码子进程）
+LOG_LEVEL = 'INFO'
 
-print_lock = threading.Lock()
+# 日志经由队列输出（见 run_metrics.setup_logging），工作线程不会因为等待标准输出而阻塞
+logger = logging.getLogger('process_images')
+# 在本次运行的所有图片间共享的大小模型，为质量搜索提供更好的起点
+size_model = SizeModel()
+# 尺寸变体编码使用的线程池（按需创建）
+_variant_executor = None
+_variant_executor_lock = threading.Lock()
+# 解码内存预算（按需创建，每个进程一个）
+_memory_budget = None
+_memory_budget_lock = threading.Lock()
+# 去重索引（按需打开，每个进程一个连接）
+_dedupe_index = None
+_dedupe_index_lock = threading.Lock()
 
 def generate_unique_filename_base(url: str) -> str:
     """
@@ -43,8 +111,7 @@ def generate_unique_filename_base(url: str) -> str:
 
         url_bytes = url.encode('utf-8')
         md5_hash = hashlib.md5(url_bytes).hexdigest()
-        with print_lock:
-            print(f"  [提示] ⓘ 未找到明确文件名，使用哈希值 {md5_hash[:12]}... 作为文件名")
+        logger.info(f"  [提示] ⓘ 未找到明确文件名，使用哈希值 {md5_hash[:12]}... 作为文件名")
         return md5_hash
 
     except Exception:
@@ -67,281 +134,1483 @@ def find_all_items_recursive(data):
             yield from find_all_items_recursive(element)
 
 
-def get_image_dimensions(image_path):
-    """读取并返回图片的宽度和高度。"""
-    try:
-        with Image.open(image_path) as img:
-            return img.size
-    except (UnidentifiedImageError, FileNotFoundError):
-        with print_lock:
-            print(f"  [警告] ✗ 无法读取图片尺寸 (文件可能无效或不存在): {os.path.basename(image_path)}")
-        return (0, 0)
-    except Exception as e:
-        with print_lock:
-            print(f"  [警告] ✗ 读取图片尺寸时发生未知错误: {os.path.basename(image_path)} (错误: {e})")
-        return (0, 0)
+def build_stamp_comment(source_hash=None):
+    """生成写入元数据的唯一性标记文本。source-hash 模式下相同的源图片总是得到相同的标记。"""
+    if STAMP_MODE == 'source-hash' and source_hash:
+        return f"Source sha256 {source_hash}"
+    return f"Processed on {datetime.now().isoformat()} with UID {uuid.uuid4()}"
+
+
+def stamp_webp(data, source_hash=None):
+    """
+    把唯一性标记直接写入已编码的 WebP 字节（插入或替换 EXIF/XMP 块），用于改变输出文件的MD5。
+    只改写容器，不解码也不重新编码。
+    """
+    comment = build_stamp_comment(source_hash)
+    if STAMP_CHUNK == 'xmp':
+        return set_metadata(data, xmp=build_comment_xmp(comment))
+    return set_metadata(data, exif=build_comment_exif(comment))
+
+
+def stamp_save_kwargs(source_hash=None):
+    """AVIF 没有可以直接改写的容器，唯一性标记在编码时以 exif/xmp 保存参数写入。"""
+    comment = build_stamp_comment(source_hash)
+    if STAMP_CHUNK == 'xmp':
+        return {'xmp': build_comment_xmp(comment)}
+    return {'exif': build_comment_exif(comment)}
+
+
+def working_image(img):
+    """编码使用的图片：带透明通道时保留为 RGBA（WebP 和 AVIF 都支持透明），否则转为 RGB。"""
+    if has_alpha(img):
+        return img if img.mode == 'RGBA' else img.convert('RGBA')
+    return img if img.mode == 'RGB' else img.convert('RGB')
+
+
+def output_size_for(size, max_width):
+    """宽度不超过 max_width（0/None 表示不限制）的输出尺寸，高度按宽高比计算。"""
+    width, height = size
+    if not max_width or width <= max_width:
+        return size
+    return max_width, max(1, round(height * max_width / width))
+
+
+def draft_for(img, target):
+    """JPEG 在 DCT 阶段直接按 1/2、1/4、1/8 缩小解码到不小于 target 的尺寸（img.size 随之更新），其他格式不变。"""
+    if img.format == 'JPEG' and target[0] < img.width:
+        img.draft('RGB', target)
+
+
+def decode_to_size(img, target):
+    """解码并转换为编码用的图片（见 working_image）；仍宽于 target 时先 reduce() 按整数倍缩小，再 LANCZOS 缩放到 target。"""
+    from PIL import Image
+
+    img.load()
+    work_img = working_image(img)
+    if work_img.width > target[0]:
+        work_img = work_img.resize(target, Image.LANCZOS, reducing_gap=VARIANT_REDUCING_GAP)
+    return work_img
+
+
+def memory_budget():
+    """返回进程内共享的解码内存预算。分阶段引擎的每个编码进程各自持有 MEMORY_BUDGET_MB 的一份（见 encoder_settings）。"""
+    global _memory_budget
+    with _memory_budget_lock:
+        if _memory_budget is None:
+            _memory_budget = MemoryBudget(int(MEMORY_BUDGET_MB * 1024 * 1024))
+        return _memory_budget
+
+
+def output_path_for(path, image_format):
+    """把输出路径的扩展名改为 image_format 对应的扩展名。"""
+    return os.path.splitext(path)[0] + FORMAT_SUFFIXES[image_format]
+
+
+def write_atomic(output_path, data):
+    temp_path = output_path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, output_path)
+
+
+def encode_candidates(work_img, formats, source_hash=None, model=None, executor=None):
+    """按 formats 编码各个候选并选出最小的合格结果，返回 (结果, 候选列表)。主图和尺寸变体使用相同的设置。"""
+    return encode_best(
+        work_img, MAX_FILE_SIZE_KB * 1024, MIN_WEBP_QUALITY, INITIAL_WEBP_QUALITY, formats=formats,
+        ssim_floor=SSIM_FLOOR, size_model=model, allow_method=ALLOW_METHOD_FALLBACK,
+        allow_resize=ALLOW_RESIZE_FALLBACK, executor=executor,
+        avif_kwargs=stamp_save_kwargs(source_hash) if FORMAT_AVIF in formats else None)
+
+
+def stamped_data(result, source_hash=None):
+    """写入磁盘的字节：WebP 在容器中写入唯一性标记，AVIF 的标记已在编码时写入。"""
+    return result.data if result.format == FORMAT_AVIF else stamp_webp(result.data, source_hash)
+
+
+def write_output(output_path, data):
+    """写入输出文件，并删除同名的其他格式的旧输出（如改选 AVIF 后遗留的 .webp）。"""
+    write_atomic(output_path, data)
+    for suffix in OUTPUT_SUFFIXES:
+        stale = os.path.splitext(output_path)[0] + suffix
+        if stale != output_path and os.path.exists(stale):
+            os.remove(stale)
+
+
+def encode_decoded_image(img, output_path, model=None, source_hash=None, timings=None, formats=None):
+    """
+    单次解码流水线的编码阶段：对已解码的图片按 formats（默认为 OUTPUT_FORMATS）编码各个候选并选出最小的合格结果，
+    再把唯一性标记写入编码结果的容器，最终结果写入磁盘一次。尺寸直接取自编码结果，不再重新打开输出文件。
+    选中 AVIF 时输出路径的扩展名改为 .avif，同名的旧格式输出随之删除。
+    返回统计字典 (size/encodes/quality/method/resized/bytes/format/path/saved_bytes/ssim)，
+    saved_bytes 为相对有损 WebP 节省的字节数。提供 timings 时累加 encode/stamp/write 各阶段的耗时。
+    """
+    if model is None:
+        model = size_model
+    if timings is None:
+        timings = {}
+    if formats is None:
+        formats = OUTPUT_FORMATS
+
+    work_img = working_image(img)
+    with timed(timings, 'encode'):
+        result, candidates = encode_candidates(work_img, formats, source_hash, model,
+                                               executor=variant_executor() if len(formats) > 1 else None)
+    with timed(timings, 'stamp'):
+        data = stamped_data(result, source_hash)
+    output_path = output_path_for(output_path, result.format)
+    with timed(timings, 'write'):
+        write_output(output_path, data)
+
+    final_size_kb = len(data) / 1024
+    saved_bytes = len(candidates[0]) - len(result)
+    detail = f"质量 {result.quality}，method {result.method}，编码 {sum(c.encodes for c in candidates)} 次"
+    if len(candidates) > 1:
+        detail = f"{result.format}，" + detail
+        if saved_bytes:
+            detail += f"，比有损 WebP 小 {saved_bytes / 1024:.1f}KB"
+    if result.resized:
+        detail += f"，尺寸缩小为 {result.size[0]}x{result.size[1]}"
+    if not result.fits:
+        logger.warning(f"  [警告] ✗ {os.path.basename(output_path)} 无法压缩至 {MAX_FILE_SIZE_KB}KB 以下。最终大小: {final_size_kb:.1f}KB ({detail})")
+    else:
+        logger.info(f"  [成功] ✓ {os.path.basename(output_path)} 的最终大小: {final_size_kb:.1f}KB ({detail})")
+    return {
+        'size': result.size,
+        'encodes': sum(c.encodes for c in candidates),
+        'quality': result.quality,
+        'method': result.method,
+        'resized': result.resized,
+        'bytes': len(data),
+        'format': result.format,
+        'path': output_path,
+        'saved_bytes': saved_bytes,
+        'ssim': result.ssim,
+    }
+
+
+def finalize_and_compress_image(image_path, model=None):
+    """
+    确保已有图片文件的MD5哈希值被更改，并保证文件大小符合要求（原地重写）。
+    已经是大小合格的 WebP 时只改写容器中的标记，不解码也不重新编码；否则解码后走完整的编码流程。
+    成功时返回编码统计字典，失败时返回 False。新下载的图片走 convert_downloaded_image 的单次解码流程。
+    """
+    from PIL import Image, UnidentifiedImageError
 
-def finalize_and_compress_image(image_path):
-    """确保图片的MD5哈希值被更改，并通过循环压缩保证文件大小符合要求。"""
-    max_size_bytes = MAX_FILE_SIZE_KB * 1024
     try:
-        try:
-            unique_comment = f"Processed on {datetime.now().isoformat()} with UID {uuid.uuid4()}"
-            exif_dict = piexif.load(image_path)
-            exif_dict["Exif"][piexif.ExifIFD.UserComment] = piexif.helper.UserComment.dump(unique_comment, encoding="unicode")
-            exif_bytes = piexif.dump(exif_dict)
-            with Image.open(image_path) as img:
-                img.save(image_path, 'webp', exif=exif_bytes, quality=INITIAL_WEBP_QUALITY)
-            with print_lock:
-                print(f"  [更新-EXIF] ✓ {os.path.basename(image_path)} 的元数据已更新")
-        except Exception:
-            with print_lock:
-                print(f"  [提示] EXIF更新失败，回退到像素修改模式: {os.path.basename(image_path)}")
-            with Image.open(image_path) as img:
-                img = img.convert('RGBA')
-                pixels = img.load()
-                r, g, b, a = pixels[0, 0]
-                pixels[0, 0] = ((r + 1) % 256, g, b, a)
-                img.save(image_path, 'webp', quality=INITIAL_WEBP_QUALITY)
-
-        if os.path.getsize(image_path) > max_size_bytes:
-            with Image.open(image_path) as img:
-                img = img.convert('RGB')
-                current_quality = INITIAL_WEBP_QUALITY
-                temp_path = image_path + ".tmp"
-                while os.path.getsize(image_path) > max_size_bytes and current_quality > MIN_WEBP_QUALITY:
-                    current_quality -= 5
-                    with print_lock:
-                        print(f"  [压缩中] -> {os.path.basename(image_path)} 质量调整为 {current_quality}")
-                    img.save(temp_path, 'webp', quality=current_quality)
-                    if os.path.exists(temp_path):
-                        os.replace(temp_path, image_path)
-
-        final_size_kb = os.path.getsize(image_path) / 1024
-        if final_size_kb > MAX_FILE_SIZE_KB:
-            with print_lock:
-                print(f"  [警告] ✗ {os.path.basename(image_path)} 无法压缩至 {MAX_FILE_SIZE_KB}KB 以下。最终大小: {final_size_kb:.1f}KB")
-        else:
-            with print_lock:
-                print(f"  [成功] ✓ {os.path.basename(image_path)} 的最终大小: {final_size_kb:.1f}KB")
-        return True
+        with open(image_path, 'rb') as f:
+            original = f.read()
+        if len(original) <= MAX_FILE_SIZE_KB * 1024:
+            try:
+                data = stamp_webp(original, content_digest(original))
+            except WebPFormatError:
+                data = None
+            if data is not None:
+                write_atomic(image_path, data)
+                logger.info(f"  [成功] ✓ {os.path.basename(image_path)} 已更新标记，未重新编码 ({len(data) / 1024:.1f}KB)")
+                return {'size': get_image_dimensions(image_path), 'encodes': 0, 'bytes': len(data)}
+
+        with Image.open(io.BytesIO(original)) as img:
+            img.load()
+            # 原地重写必须保持文件名，不参与会改变扩展名的 AVIF 候选
+            formats = tuple(f for f in OUTPUT_FORMATS if FORMAT_SUFFIXES[f] == '.webp')
+            return encode_decoded_image(img, image_path, model, hashlib.sha256(original).hexdigest(),
+                                        formats=formats)
     except UnidentifiedImageError:
-        with print_lock:
-            print(f"  [失败] ✗ 图片最终处理失败: {os.path.basename(image_path)} 不是一个有效的图片文件。")
+        logger.error(f"  [失败] ✗ 图片最终处理失败: {os.path.basename(image_path)} 不是一个有效的图片文件。")
         if os.path.exists(image_path):
             os.remove(image_path)
         return False
     except Exception as e:
-        with print_lock:
-            print(f"  [失败] ✗ 图片最终处理失败: {os.path.basename(image_path)}: {e}")
+        logger.error(f"  [失败] ✗ 图片最终处理失败: {os.path.basename(image_path)}: {e}")
         return False
 
-# 2. 将目录和前缀作为参数传入
-def process_item(item, image_download_dir, new_image_url_prefix):
+
+def variant_widths_for(width):
+    """返回宽度为 width 的主图需要生成的变体宽度（升序，只缩小不放大）。"""
+    return sorted({w for w in VARIANT_WIDTHS if w < width})
+
+
+def variant_filename(job, width, image_format=FORMAT_WEBP):
+    return f"{job['filename_base']}-{width}w{FORMAT_SUFFIXES[image_format]}"
+
+
+def find_variant(job, width):
+    """返回宽度为 width 的变体已存在的文件名（变体与主图一样可能是 .webp 或 .avif），不存在时返回 None。"""
+    base = f"{job['filename_base']}-{width}w"
+    for suffix in OUTPUT_SUFFIXES:
+        if os.path.exists(os.path.join(job['output_dir'], base + suffix)):
+            return base + suffix
+    return None
+
+
+def missing_variant_widths(job, width, cache=None):
+    """返回主图宽度为 width 时需要（重新）生成的变体宽度：文件不存在，或文件存在但读不出尺寸。"""
+    missing = []
+    for variant_width in variant_widths_for(width):
+        filename = find_variant(job, variant_width)
+        if filename is None or 0 in get_image_dimensions(os.path.join(job['output_dir'], filename), cache):
+            missing.append(variant_width)
+    return missing
+
+
+def existing_variants(job, width, cache=None):
     """
-    处理单个菜品项：确定源URL，下载、转换、压缩并获取尺寸。
-    如果最终的WebP图片已存在，则跳过大部分处理步骤。
+    检查宽度为 width 的主图所需的变体是否都已存在。全部存在时返回变体列表
+    [{'url', 'width', 'height', 'bytes'}, ...]（尺寸读取文件头，不解码），有缺失时返回 None。
     """
-    item_title = item.get('title', f"一个缺少标题的项目 (ID: {id(item)})")
+    variants = []
+    for variant_width in variant_widths_for(width):
+        filename = find_variant(job, variant_width)
+        if filename is None:
+            return None
+        path = os.path.join(job['output_dir'], filename)
+        with timed(job['timings'], 'probe'):
+            w, h = get_image_dimensions(path, cache)
+        if w == 0 or h == 0:
+            return None
+        variants.append({'url': f"{job['url_prefix']}{filename}", 'width': w, 'height': h,
+                         'bytes': os.path.getsize(path)})
+    return variants
+
+
+def variant_executor():
+    """返回进程内共享的变体编码线程池。Pillow 的缩放和 WebP 编码会释放 GIL，多个变体可以真正并行。"""
+    global _variant_executor
+    with _variant_executor_lock:
+        if _variant_executor is None:
+            _variant_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1,
+                                                   thread_name_prefix='variant-encoder')
+        return _variant_executor
+
+
+def encode_variants(img, job, widths, source_hash=None, base_size=None, formats=None):
+    """
+    把已解码的图片缩小为 widths 中的各个宽度并编码写入磁盘，多个变体并行处理。
+    每个变体与主图一样按 formats（默认为 OUTPUT_FORMATS）选出最小的合格格式，透明通道得以保留。
+    高度按 base_size（主图尺寸，默认为 img 的尺寸）的宽高比计算。返回 (变体列表, 编码次数)。
+    """
+    if not widths:
+        return [], 0
+    from PIL import Image
+
+    base_width, base_height = base_size or img.size
+    if formats is None:
+        formats = OUTPUT_FORMATS
+
+    def encode_one(width):
+        height = max(1, round(base_height * width / base_width))
+        # reducing_gap: 先用 reduce() 按整数倍快速缩小，再做 LANCZOS 重采样
+        resized = img.resize((width, height), Image.LANCZOS, reducing_gap=VARIANT_REDUCING_GAP)
+        # 变体本身已在 variant_executor 中并行，候选格式在本线程中依次编码，避免向同一线程池提交任务后等待
+        result, candidates = encode_candidates(resized, formats, source_hash)
+        data = stamped_data(result, source_hash)
+        filename = variant_filename(job, width, result.format)
+        write_output(os.path.join(job['output_dir'], filename), data)
+        variant = {'url': f"{job['url_prefix']}{filename}", 'width': result.size[0],
+                   'height': result.size[1], 'bytes': len(data)}
+        return variant, result.format, sum(c.encodes for c in candidates)
+
+    if len(widths) > 1:
+        encoded = list(variant_executor().map(encode_one, widths))
+    else:
+        encoded = [encode_one(widths[0])]
+
+    variants = [variant for variant, _, _ in encoded]
+    summary = '，'.join(f"{v['width']}w {v['bytes'] / 1024:.1f}KB" + (f" ({image_format})" if len(formats) > 1 else '')
+                       for v, image_format, _ in encoded)
+    logger.info(f"  [变体] ✓ {job['webp_filename']}: {summary}")
+    return variants, sum(encodes for _, _, encodes in encoded)
+
+
+def dedupe_index():
+    """返回进程内共享的去重索引，未启用去重时返回 None。分阶段引擎的编码进程各自打开同一个索引文件。"""
+    global _dedupe_index
+    if DEDUPE_INDEX_PATH is None:
+        return None
+    with _dedupe_index_lock:
+        if _dedupe_index is None:
+            _dedupe_index = DedupeIndex(DEDUPE_INDEX_PATH, DEDUPE_MAX_DISTANCE)
+        return _dedupe_index
+
 
-    source_url = None
-    source_key = None
+def retarget_job(job, output_path):
+    """
+    把任务的输出改为 output_path 指向的文件（与其他源图片共享的输出，或选中了其他格式的输出），
+    尺寸变体也随之使用该文件名。
+    """
+    webp_filename = os.path.basename(output_path)
+    job.update(filename_base=os.path.splitext(webp_filename)[0], webp_filename=webp_filename,
+               webp_local_path=os.path.join(job['output_dir'], webp_filename),
+               final_url=f"{job['url_prefix']}{webp_filename}")
+
+
+def detach_alias(job, index):
+    """
+    任务之前被去重到其他源图片的共享输出，本次却需要重新编码（例如 --revalidate 发现源图片已变化）时，
+    删除别名并恢复由自己的源URL推导出的文件名，避免新内容覆盖其他项目仍在使用的共享输出。
+    """
+    shared_path = index.alias_for(job['source_url'], job['output_dir'])
+    if shared_path is None:
+        return
+    index.remove_alias(job['source_url'], job['output_dir'])
+    own_filename = f"{generate_unique_filename_base(job['source_url'])}.webp"
+    if os.path.basename(shared_path) != own_filename:
+        retarget_job(job, os.path.join(job['output_dir'], own_filename))
+        logger.info(f"  [去重] -> 源图片已变化，不再共用 {os.path.basename(shared_path)}，改为生成 {own_filename}")
+
+
+def reuse_duplicate(job, match, index, decodes):
+    """
+    复用与本图片内容相同（或视觉相同）的已有输出：任务改为指向该WebP，不再编码，并记录别名供下次运行使用。
+    配置了尺寸变体但共享输出的变体不完整时返回 None，照常编码。
+    """
+    shared = dict(job)
+    retarget_job(shared, match['output_path'])
+    variants = None
+    if VARIANT_WIDTHS:
+        variants = existing_variants(shared, match['width'])
+        if variants is None:
+            return None
+
+    original_filename = job['webp_filename']
+    retarget_job(job, match['output_path'])
+    index.set_alias(job['source_url'], job['output_dir'], match['output_path'])
+    kind = '内容完全相同' if match['match'] == 'exact' else f"感知哈希距离 {match['distance']}"
+    logger.info(f"  [去重] ✓ {original_filename} 与已有的 {job['webp_filename']} 相同 ({kind})，"
+                f"跳过编码，节省 {match['bytes'] / 1024:.1f}KB")
+
+    result = build_success_result(job, match['width'], match['height'])
+    if VARIANT_WIDTHS:
+        result['variants'] = variants
+    result['decodes'] = decodes
+    result['encodes'] = 0
+    result['deduped'] = {'match': match['match'], 'distance': match['distance'],
+                         'bytes': match['bytes'], 'seconds': match['encode_seconds']}
+    return result
+
+
+def build_success_result(job, width, height):
+    """构造 JSON 更新阶段使用的成功结果字典。timings / bytes_in / retries 供运行报告使用。"""
+    return {
+        'status': 'success',
+        'item': job['item'],
+        'new_url': job['final_url'],
+        'source_key': job['source_key'],
+        'is_first_run': job['is_first_run'],
+        'width': width,
+        'height': height,
+        'timings': job['timings'],
+        'bytes_in': job.get('bytes_in', job.get('source_size')),
+        'retries': job.get('retries', 0),
+    }
+
+
+def current_encode_params():
+    """当前的编码参数。参数变化后，--revalidate 会把旧的输出视为过期并重新编码。"""
+    return {
+        'formats': list(OUTPUT_FORMATS),
+        'ssim_floor': SSIM_FLOOR,
+        'alpha': True,
+        'max_width': MAX_OUTPUT_WIDTH,
+        'initial_quality': INITIAL_WEBP_QUALITY,
+        'min_quality': MIN_WEBP_QUALITY,
+        'max_file_size_kb': MAX_FILE_SIZE_KB,
+        'method_fallback': ALLOW_METHOD_FALLBACK,
+        'resize_fallback': ALLOW_RESIZE_FALLBACK,
+        'stamp': STAMP_MODE,
+        'stamp_chunk': STAMP_CHUNK,
+    }
+
+
+def item_source(item):
+    """
+    返回菜品项的 (源图片URL, 源字段名)。已处理过的项目从 raw_image_url 读取源URL，此时字段名为 None；
+    首次处理的项目从 imageUrl 或 image_url 读取。
+    """
     if 'raw_image_url' in item:
-        source_url = item['raw_image_url']
-    elif 'imageUrl' in item:
-        source_url = item['imageUrl']
-        source_key = 'imageUrl'
-    elif 'image_url' in item:
-        source_url = item['image_url']
-        source_key = 'image_url'
+        return item['raw_image_url'], None
+    if 'imageUrl' in item:
+        return item['imageUrl'], 'imageUrl'
+    if 'image_url' in item:
+        return item['image_url'], 'image_url'
+    return None, None
+
+
+def prepare_item(item, image_download_dir, new_image_url_prefix, cache=None, revalidate=False):
+    """
+    处理单个菜品项的第一阶段：确定源URL和输出路径，不做任何网络请求。
+    返回 None 表示跳过；返回 status 为 'success'/'error' 的字典表示已处理完毕
+    （例如WebP已存在）；返回 status 为 'pending' 的任务字典表示需要下载和转换。
+    提供 cache 且 revalidate 为 True 时，已存在的WebP也会进入 'pending'，由条件请求决定是否复用。
+    """
+    item_title = item.get('title', f"一个缺少标题的项目 (ID: {id(item)})")
+
+    source_url, source_key = item_source(item)
 
     if not source_url:
-        with print_lock:
-            print(f"  [信息] ⓘ '{item_title}' 中未找到 'imageUrl' 或 'image_url' 字段，已跳过。")
+        logger.info(f"  [信息] ⓘ '{item_title}' 中未找到 'imageUrl' 或 'image_url' 字段，已跳过。")
         return None
 
-    if not isinstance(source_url, str) or not source_url.startswith(('http://', 'https://')):
-        with print_lock:
-            # 使用传入的参数进行检查
-            if 'image_url' in item and item['image_url'].startswith(new_image_url_prefix):
-                 print(f"  [跳过] ✓ '{item_title}' 已是处理过的本地路径。")
-            else:
-                 print(f"  [跳过] ✓ '{item_title}' 的图片URL [{source_url}] 无效。")
+    if not is_source_url(source_url):
+        # 使用传入的参数进行检查
+        if 'image_url' in item and item['image_url'].startswith(new_image_url_prefix):
+            logger.info(f"  [跳过] ✓ '{item_title}' 已是处理过的本地路径。")
+        else:
+            logger.info(f"  [跳过] ✓ '{item_title}' 的图片URL [{source_url}] 无效。")
         return None
 
     is_first_run = source_key is not None and 'raw_image_url' not in item
 
     filename_base = generate_unique_filename_base(source_url)
 
-    original_file_hash = hashlib.md5(source_url.encode('utf-8')).hexdigest()
-    # 使用传入的参数构建路径
-    local_image_path = os.path.join(image_download_dir, f"{original_file_hash}.tmp")
-
     webp_filename = f"{filename_base}.webp"
-    # 使用传入的参数构建路径
-    webp_local_path = os.path.join(image_download_dir, webp_filename)
-    # 使用传入的参数构建URL
-    final_url = f"{new_image_url_prefix}{webp_filename}"
-
-    if os.path.exists(webp_local_path):
-        with print_lock:
-            print(f"  [已存在] ✓ {webp_filename} 本地已存在，跳过下载和转换。")
-        width, height = get_image_dimensions(webp_local_path)
+    job = {
+        'status': 'pending',
+        'item': item,
+        'source_url': source_url,
+        'source_key': source_key,
+        'is_first_run': is_first_run,
+        'filename_base': filename_base,
+        'webp_filename': webp_filename,
+        # 使用传入的参数构建路径和URL
+        'output_dir': image_download_dir,
+        'webp_local_path': os.path.join(image_download_dir, webp_filename),
+        'final_url': f"{new_image_url_prefix}{webp_filename}",
+        'url_prefix': new_image_url_prefix,
+        'record': cache.get(source_url) if cache else None,
+        'revalidate': revalidate,
+        # 各阶段耗时（秒），随结果进入运行报告
+        'timings': {},
+    }
+
+    index = dedupe_index()
+    if index is not None:
+        # 之前被去重到其他源图片输出的项目，直接指向共享的WebP
+        shared_path = index.alias_for(source_url, image_download_dir)
+        if shared_path is not None:
+            retarget_job(job, shared_path)
+    if not os.path.exists(job['webp_local_path']):
+        # 上次选中的格式可能不同（例如 .avif）：沿用已有的输出
+        for suffix in OUTPUT_SUFFIXES:
+            existing_path = os.path.splitext(job['webp_local_path'])[0] + suffix
+            if os.path.exists(existing_path):
+                retarget_job(job, existing_path)
+                break
+
+    if os.path.exists(job['webp_local_path']) and not (cache and revalidate):
+        result = reuse_existing_output(job, cache)
+        if result is None:
+            # WebP已存在但尺寸变体不完整：只补充生成变体
+            return job
+        logger.info(f"  [已存在] ✓ {job['webp_filename']} 本地已存在，跳过下载和转换。")
+        return result
+
+    return job
+
+
+def reuse_existing_output(job, cache=None):
+    """
+    复用已存在的WebP：尺寸优先取自清单记录，其次是尺寸缓存，最后才读取文件头。
+    配置了尺寸变体但有变体缺失时返回 None，并把任务标记为只需生成变体 (variants_only)。
+    """
+    record = job.get('record')
+    if (record and record['output_filename'] == job['webp_filename']
+            and record['output_dir'] == os.path.abspath(job['output_dir'])
+            and record['width'] and record['height']):
+        result = build_success_result(job, record['width'], record['height'])
+    else:
+        with timed(job['timings'], 'probe'):
+            width, height = get_image_dimensions(job['webp_local_path'], cache)
         if width == 0 or height == 0:
-            return {'status': 'error', 'reason': f'无法获取已存在文件 {webp_filename} 的尺寸'}
-
-        return {
-            'status': 'success',
-            'item': item,
-            'new_url': final_url,
-            'source_key': source_key,
-            'is_first_run': is_first_run,
-            'width': width,
-            'height': height
-        }
+            return {'status': 'error', 'reason': f"无法获取已存在文件 {job['webp_filename']} 的尺寸"}
+        result = build_success_result(job, width, height)
 
-    try:
-        with print_lock:
-            print(f"  [下载中] -> {source_url}")
+    if VARIANT_WIDTHS:
+        variants = existing_variants(job, result['width'], cache)
+        if variants is None:
+            job['variants_only'] = True
+            job['main_size'] = (result['width'], result['height'])
+            return None
+        result['variants'] = variants
+    return result
 
-        proxies = {
-           'http': 'socks5://127.0.0.1:1080',
-           'https': 'socks5://127.0.0.1:1080'
-        }
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-        response = requests.get(source_url, stream=True, timeout=20, headers=headers,proxies=proxies)
-        response.raise_for_status()
-
-        content_type = response.headers.get('content-type', '').lower()
-        if not content_type.startswith('image/'):
-            return {'status': 'error', 'reason': f"下载内容不是图片 (Content-Type: {content_type})"}
-
-        with open(local_image_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=812):
-                f.write(chunk)
-    except requests.exceptions.RequestException as e:
-        if os.path.exists(local_image_path):
-            os.remove(local_image_path)
-        return {'status': 'error', 'reason': f'下载失败: {e}'}
 
+def _record_is_current(job):
+    """清单记录是否描述了当前这个输出文件，且编码参数没有变化。"""
+    record = job.get('record')
+    return (record is not None
+            and record['output_filename'] == job['webp_filename']
+            and record['output_dir'] == os.path.abspath(job['output_dir'])
+            and record['encode_params'] == current_encode_params()
+            and os.path.exists(job['webp_local_path']))
+
+
+def cached_source_path(job, cache):
+    """
+    WebP（或其尺寸变体）缺失但清单中保存了源文件副本，且本次不要求重新校验时，返回该副本路径，可直接重新编码而无需联网。
+    """
+    if cache is None or job['revalidate']:
+        return None
+    if os.path.exists(job['webp_local_path']) and not job.get('variants_only'):
+        return None
+    if cache.has_source_blob(job['record']):
+        return cache.source_blob_path(job['record']['source_hash'])
+    return None
+
+
+def validators_for(job, cache):
+    """返回条件请求使用的 etag / last_modified。只有 304 时本地确实有可复用的内容才发送条件请求。"""
+    record = job.get('record')
+    if cache is None or record is None:
+        return {}
+    validators = {'etag': record['etag'], 'last_modified': record['last_modified']}
+    if cache.has_source_blob(record):
+        return validators
+    # 没有源文件副本时，304 只在输出（含尺寸变体）完整的情况下才有意义
+    if _record_is_current(job) and (not VARIANT_WIDTHS or existing_variants(job, record['width'], cache) is not None):
+        return validators
+    return {}
+
+
+def resolve_fetched(job, fetched, cache):
+    """
+    根据下载结果决定是复用已有输出还是重新编码。
+    返回 (result, source)：result 不为 None 表示已完成（复用），否则 source 为需要编码的文件对象或路径。
+    """
+    if cache is None:
+        return None, fetched.body
+
+    record = job.get('record')
+    url = job['source_url']
+    if fetched.not_modified:
+        cache.update_validators(url, fetched.etag, fetched.last_modified)
+        if _record_is_current(job):
+            result = reuse_existing_output(job, cache)
+            if result is not None:
+                logger.info(f"  [未变化] ✓ {job['webp_filename']} 源图片未变化 (304)，复用已有输出。")
+                return result, None
+        # 源未变化但输出缺失、编码参数已变化或尺寸变体不完整：从源文件副本重新编码
+        job.update(etag=record['etag'], last_modified=record['last_modified'],
+                   source_hash=record['source_hash'], source_size=record['source_size'])
+        return None, cache.source_blob_path(record['source_hash'])
+
+    source_hash, source_size = cache.store_source(fetched.body)
+    job.update(etag=fetched.etag, last_modified=fetched.last_modified,
+               source_hash=source_hash, source_size=source_size)
+
+    unchanged = _record_is_current(job) and record['source_hash'] == source_hash
+    # 没有清单记录的已有WebP（启用清单之前生成的）直接纳入清单，不重新编码
+    adopted = record is None and os.path.exists(job['webp_local_path'])
+    if unchanged or adopted:
+        result = reuse_existing_output(job, cache)
+        if result is None:
+            # 主图无需重新编码，只补充尺寸变体
+            return None, fetched.body
+        if result['status'] == 'success':
+            record_job_result(job, result, cache)
+            logger.info(f"  [未变化] ✓ {job['webp_filename']} 源图片内容未变化，复用已有输出。")
+        return result, None
+
+    return None, fetched.body
+
+
+def record_job_result(job, result, cache):
+    """把成功的处理结果写入清单。"""
+    if cache is None or result is None or result.get('status') != 'success' or 'source_hash' not in job:
+        return
+    cache.record_result(
+        job['source_url'],
+        etag=job.get('etag'),
+        last_modified=job.get('last_modified'),
+        source_hash=job['source_hash'],
+        source_size=job['source_size'],
+        output_dir=job['output_dir'],
+        # 去重后的输出文件名可能与源URL推导出的文件名不同（分阶段引擎中 job 也未被改写）
+        output_filename=result['new_url'][len(job['url_prefix']):],
+        width=result['width'],
+        height=result['height'],
+        encode_params=current_encode_params(),
+    )
+
+
+def resolve_source(job, fetched, cache=None):
+    """
+    决定一个待处理任务的编码来源。fetched 为 None 时表示使用清单中的源文件副本。
+    返回 (result, source)：result 不为 None 表示无需编码（复用已有输出），否则 source 为需要编码的文件对象或路径。
+    """
+    if fetched is None:
+        record = job['record']
+        job.update(etag=record['etag'], last_modified=record['last_modified'],
+                   source_hash=record['source_hash'], source_size=record['source_size'])
+        logger.info(f"  [缓存] -> 使用源文件副本重新生成 {job['webp_filename']}")
+        return None, cache.source_blob_path(record['source_hash'])
+
+    job['timings'].update(fetched.timings)
+    job['retries'] = fetched.retries
+    if not fetched.not_modified:
+        job['bytes_in'] = fetched.size
+    result, source = resolve_fetched(job, fetched, cache)
+    if result is None:
+        logger.info(f"  [转换中] -> {job['filename_base']} ({fetched.size / 1024:.1f}KB) to {job['webp_filename']}")
+    return result, source
+
+
+def complete_job(job, fetched, cache=None):
+    """
+    处理单个菜品项的第二阶段：复用或编码。
+    该函数只做本地计算和磁盘读写，threads/asyncio 引擎都在工作线程中调用它。
+    """
+    result, source = resolve_source(job, fetched, cache)
+    if result is not None:
+        return result
+
+    result = convert_downloaded_image(job, source)
+    record_job_result(job, result, cache)
+    return result
+
+
+def source_digest(source):
+    """未启用清单时，为 source-hash 标记计算源图片的 SHA-256。source 为文件路径或类文件对象。"""
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return hash_stream(f)[0]
+    return hash_stream(source)[0]
+
+
+def convert_downloaded_image(job, source):
+    """
+    处理单个菜品项的第二阶段（CPU密集）：源图片只解码一次，转换、元数据、尺寸约束编码都在内存中完成，
+    WebP 只写入一次，尺寸取自编码结果；配置了尺寸变体时，变体由同一个解码结果缩小得到。
+    宽于 MAX_OUTPUT_WIDTH 的源图片按该宽度解码（JPEG 在 DCT 阶段直接缩小），像素数超过 MAX_SOURCE_PIXELS 的不解码；
+    解码和编码期间按估算的内存占用 memory_budget()，超出预算的大图排队等待。
+    任务标记为 variants_only（主图已存在且无需更新）时只生成缺失或无法读取的变体，JPEG 源图片直接以缩小的尺寸解码。
+    启用去重时，解码前先按源图片哈希、解码后再按感知哈希查找已有的相同输出，找到则直接复用，不再编码。
+    source 可以是文件路径或已定位到开头的类文件对象。
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    webp_local_path = job['webp_local_path']
+    timings = job['timings']
     try:
-        with print_lock:
-            print(f"  [转换中] -> {os.path.basename(local_image_path)} to {webp_filename}")
-        with Image.open(local_image_path) as img:
-            img.convert('RGB').save(webp_local_path, 'webp', quality=INITIAL_WEBP_QUALITY)
+        index = None if job.get('variants_only') else dedupe_index()
+        source_hash = job.get('source_hash')
+        if (STAMP_MODE == 'source-hash' or index is not None) and source_hash is None:
+            source_hash = source_digest(source)
+        if index is not None:
+            detach_alias(job, index)
+            webp_local_path = job['webp_local_path']
+            with timed(timings, 'dedupe'):
+                match = index.find_exact(source_hash, job['output_dir'], current_encode_params(), webp_local_path)
+            result = match and reuse_duplicate(job, match, index, decodes=0)
+            if result:
+                return result
+        if job.get('variants_only'):
+            width, height = job['main_size']
+            widths = missing_variant_widths(job, width)
+            if not widths:
+                # 检查之后变体已经齐全（例如由同一输出的另一个任务生成）：直接返回已有结果
+                variants = existing_variants(job, width)
+                if variants is None:
+                    return {'status': 'error', 'reason': f"无法读取 {job['webp_filename']} 的尺寸变体"}
+                result = build_success_result(job, width, height)
+                result['variants'] = variants
+                return result
+        with Image.open(source) as img:
+            # Image.open 只读取文件头：先检查像素数，再按需要的尺寸设置缩小解码，最后按解码后的尺寸占用内存预算
+            if MAX_SOURCE_PIXELS and img.width * img.height > MAX_SOURCE_PIXELS:
+                return {'status': 'error', 'reason': f"源图片像素过多: {img.width}x{img.height} 超出上限 "
+                                                     f"{MAX_SOURCE_PIXELS / 1e6:.0f} 百万像素"}
+            if job.get('variants_only'):
+                # 只需要小尺寸：按最大的变体宽度缩小解码
+                draft_for(img, output_size_for(img.size, widths[-1]))
+            else:
+                target = output_size_for(img.size, MAX_OUTPUT_WIDTH)
+                draft_for(img, target)
+            with memory_budget().reserve(decode_cost(img.size)) as waited:
+                if waited:
+                    timings['memory_wait'] = timings.get('memory_wait', 0.0) + waited
+                if job.get('variants_only'):
+                    with timed(timings, 'decode'):
+                        img.load()
+                        work_img = working_image(img)
+                    with timed(timings, 'variants'):
+                        _, encodes = encode_variants(work_img, job, widths, source_hash, base_size=job['main_size'])
+                    variants = existing_variants(job, width)
+                    bytes_out = os.path.getsize(webp_local_path) + sum(v['bytes'] for v in variants or [])
+                else:
+                    with timed(timings, 'decode'):
+                        work_img = decode_to_size(img, target)
+                    if index is not None:
+                        with timed(timings, 'dedupe'):
+                            fingerprint = dhash(work_img)
+                            match = index.find_similar(fingerprint, work_img.size, job['output_dir'],
+                                                       current_encode_params(), webp_local_path)
+                        result = match and reuse_duplicate(job, match, index, decodes=1)
+                        if result:
+                            return result
+                    encode_start = time.perf_counter()
+                    encode_stats = encode_decoded_image(work_img, webp_local_path, source_hash=source_hash,
+                                                        timings=timings)
+                    if encode_stats['path'] != webp_local_path:
+                        retarget_job(job, encode_stats['path'])
+                        webp_local_path = job['webp_local_path']
+                    width, height = encode_stats['size']
+                    with timed(timings, 'variants'):
+                        variants, variant_encodes = encode_variants(work_img, job, variant_widths_for(width),
+                                                                    source_hash, base_size=encode_stats['size'])
+                    encodes = encode_stats['encodes'] + variant_encodes
+                    bytes_out = encode_stats['bytes'] + sum(v['bytes'] for v in variants)
+                    encoding = {'format': encode_stats['format'], 'bytes': encode_stats['bytes'],
+                                'saved_bytes': encode_stats['saved_bytes']}
+                    if encode_stats['ssim'] is not None:
+                        encoding['ssim'] = round(encode_stats['ssim'], 4)
+                    if index is not None:
+                        index.add(webp_local_path, content_hash=source_hash, fingerprint=fingerprint,
+                                  source_size=work_img.size, width=width, height=height,
+                                  total_bytes=encode_stats['bytes'] + sum(v['bytes'] for v in variants),
+                                  encode_seconds=time.perf_counter() - encode_start,
+                                  encode_params=current_encode_params())
     except UnidentifiedImageError:
-        if os.path.exists(local_image_path):
-            os.remove(local_image_path)
         return {'status': 'error', 'reason': f'转换失败: 下载的文件不是有效的图片格式'}
     except Exception as e:
-        if os.path.exists(local_image_path):
-            os.remove(local_image_path)
         return {'status': 'error', 'reason': f'转换失败: {e}'}
 
-    if not finalize_and_compress_image(webp_local_path):
-        return {'status': 'error', 'reason': '最终处理失败'}
-
-    width, height = get_image_dimensions(webp_local_path)
     if width == 0 or height == 0:
         return {'status': 'error', 'reason': '无法获取尺寸'}
 
-    if os.path.exists(local_image_path):
+    result = build_success_result(job, width, height)
+    if VARIANT_WIDTHS:
+        result['variants'] = variants
+    result['decodes'] = 1
+    result['encodes'] = encodes
+    result['bytes_out'] = bytes_out
+    if not job.get('variants_only'):
+        result['encoding'] = encoding
+    result['peak_rss_kb'] = peak_rss_kb()
+    if result['peak_rss_kb'] is not None:
+        logger.debug(f"  [统计] {job['webp_filename']}: 解码 1 次，编码 {encodes} 次，"
+                     f"进程峰值内存 {result['peak_rss_kb'] / 1024:.1f}MB")
+    return result
+
+
+def fetch_error_result(error):
+    """下载失败的结果。retryable 的项目会在本轮结束后重新排队（见 with_requeue）。"""
+    return {'status': 'error', 'reason': str(error), 'retryable': error.retryable, 'retries': error.retries}
+
+
+# 2. 将目录和前缀作为参数传入
+def process_item(item, image_download_dir, new_image_url_prefix, fetcher=None, cache=None, revalidate=False):
+    """
+    处理单个菜品项：确定源URL，下载、转换、压缩并获取尺寸。
+    如果最终的WebP图片已存在，则跳过大部分处理步骤。
+    fetcher 为共享的 ImageFetcher，未提供时使用进程内默认实例；
+    cache 为可选的 ImageCache，用于条件请求和源文件副本复用。
+    """
+    job = prepare_item(item, image_download_dir, new_image_url_prefix, cache, revalidate)
+    if job is None or job['status'] != 'pending':
+        return job
+
+    if cached_source_path(job, cache):
+        return complete_job(job, None, cache)
+
+    if fetcher is None:
+        fetcher = get_default_fetcher()
+
+    logger.info(f"  [下载中] -> {job['source_url']}")
+    try:
+        fetched = fetcher.fetch(job['source_url'], **validators_for(job, cache))
+    except FetchError as e:
+        return fetch_error_result(e)
+
+    # 小图片直接在内存中解码，大图片由下载器转存的临时文件中读取，不再单独写 .tmp 文件
+    with fetched:
+        return complete_job(job, fetched, cache)
+
+
+def run_thread_engine(items, image_download_dir, new_image_url_prefix, fetcher, max_workers,
+                      cache=None, revalidate=False):
+    """线程池引擎：每个线程完整处理一个项目（下载+转换）。按完成顺序产出 (item, result, exc)。"""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # 将参数传递给 process_item
+        future_to_item = {
+            executor.submit(process_item, item, image_download_dir, new_image_url_prefix, fetcher,
+                            cache, revalidate): item
+            for item in items
+        }
+        for future in as_completed(future_to_item):
+            try:
+                yield future_to_item[future], future.result(), None
+            except Exception as exc:
+                yield future_to_item[future], None, exc
+
+
+async def _process_item_async(item, image_download_dir, new_image_url_prefix, fetcher,
+                              cpu_executor, encode_slots, cache, revalidate):
+    import asyncio
+
+    job = prepare_item(item, image_download_dir, new_image_url_prefix, cache, revalidate)
+    if job is None or job['status'] != 'pending':
+        return job
+
+    loop = asyncio.get_running_loop()
+    # encode_slots 只限制同时交给编码线程池的图片数量；下载并发由 fetcher 的全局和按主机限制控制。
+    # 等待编码的已下载内容超过 spool_threshold 时保存在临时文件中，不会占满内存。
+    if cached_source_path(job, cache):
+        async with encode_slots:
+            return await loop.run_in_executor(cpu_executor, complete_job, job, None, cache)
+
+    logger.info(f"  [下载中] -> {job['source_url']}")
+    try:
+        fetched = await fetcher.fetch(job['source_url'], **validators_for(job, cache))
+    except FetchError as e:
+        return fetch_error_result(e)
+
+    with fetched:
+        async with encode_slots:
+            return await loop.run_in_executor(cpu_executor, complete_job, job, fetched, cache)
+
+
+async def _run_asyncio_engine(items, image_download_dir, new_image_url_prefix, fetcher, encode_workers,
+                              cache, revalidate, emit):
+    import asyncio
+
+    def on_done(task, item):
         try:
-            os.remove(local_image_path)
-        except OSError as e:
-            with print_lock:
-                print(f"  [警告] ✗ 无法删除临时文件 {os.path.basename(local_image_path)}: {e}")
+            emit((item, task.result(), None))
+        except Exception as exc:
+            emit((item, None, exc))
+
+    encode_slots = asyncio.Semaphore(encode_workers * 4)
+    with ThreadPoolExecutor(max_workers=encode_workers) as cpu_executor:
+        async with fetcher:
+            tasks = []
+            for item in items:
+                task = asyncio.ensure_future(_process_item_async(item, image_download_dir, new_image_url_prefix,
+                                                                 fetcher, cpu_executor, encode_slots,
+                                                                 cache, revalidate))
+                task.add_done_callback(lambda t, item=item: on_done(t, item))
+                tasks.append(task)
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def run_asyncio_engine(items, image_download_dir, new_image_url_prefix, fetcher, encode_workers,
+                       cache=None, revalidate=False):
+    """
+    asyncio 引擎：下载以协程方式并发执行（并发数由 AsyncImageFetcher 的全局和按主机限制控制），
+    解码/编码交给大小为 encode_workers 的有界线程池，网络并发不再受CPU线程数约束。
+    事件循环运行在单独的线程中，按完成顺序产出 (item, result, exc)。
+    """
+    import asyncio
+
+    results = queue.Queue()
+    finished = object()
+    failure = []
+
+    def run_loop():
+        try:
+            asyncio.run(_run_asyncio_engine(items, image_download_dir, new_image_url_prefix,
+                                            fetcher, encode_workers, cache, revalidate, results.put))
+        except BaseException as exc:
+            failure.append(exc)
+        finally:
+            results.put(finished)
+
+    loop_thread = threading.Thread(target=run_loop, name='asyncio-engine', daemon=True)
+    loop_thread.start()
+    while True:
+        entry = results.get()
+        if entry is finished:
+            break
+        yield entry
+    loop_thread.join()
+    if failure:
+        raise failure[0]
+
 
+def encoder_settings(processes=1):
+    """
+    需要同步到编码子进程的模块级配置（spawn/forkserver 启动方式下子进程不会继承命令行设置）。
+    内存预算在 processes 个编码进程间平分。
+    """
     return {
-        'status': 'success',
-        'item': item,
-        'new_url': final_url,
-        'source_key': source_key,
-        'is_first_run': is_first_run,
-        'width': width,
-        'height': height
+        'MAX_FILE_SIZE_KB': MAX_FILE_SIZE_KB,
+        'MIN_WEBP_QUALITY': MIN_WEBP_QUALITY,
+        'INITIAL_WEBP_QUALITY': INITIAL_WEBP_QUALITY,
+        'ALLOW_METHOD_FALLBACK': ALLOW_METHOD_FALLBACK,
+        'ALLOW_RESIZE_FALLBACK': ALLOW_RESIZE_FALLBACK,
+        'STAMP_MODE': STAMP_MODE,
+        'STAMP_CHUNK': STAMP_CHUNK,
+        'OUTPUT_FORMATS': OUTPUT_FORMATS,
+        'SSIM_FLOOR': SSIM_FLOOR,
+        'MAX_SOURCE_PIXELS': MAX_SOURCE_PIXELS,
+        'MAX_OUTPUT_WIDTH': MAX_OUTPUT_WIDTH,
+        'MEMORY_BUDGET_MB': MEMORY_BUDGET_MB / processes,
+        'VARIANT_WIDTHS': VARIANT_WIDTHS,
+        'DEDUPE_INDEX_PATH': DEDUPE_INDEX_PATH,
+        'DEDUPE_MAX_DISTANCE': DEDUPE_MAX_DISTANCE,
+        'LOG_LEVEL': LOG_LEVEL,
     }
 
+
+def _init_encode_worker(settings):
+    globals().update(settings)
+    # 子进程直接写标准输出（进程内只有编码线程，不需要队列）
+    setup_logging(LOG_LEVEL, queued=False)
+
+
+def _encode_in_worker(job, data):
+    """编码子进程的入口：job 中不含 item（由父进程重新关联），返回 (result, 忙碌秒数)。"""
+    start = time.perf_counter()
+    result = convert_downloaded_image(job, io.BytesIO(data))
+    return result, time.perf_counter() - start
+
+
+def _read_source_bytes(source):
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return f.read()
+    source.seek(0)
+    return source.read()
+
+
+def run_staged_engine(items, image_download_dir, new_image_url_prefix, fetcher, download_workers,
+                      encode_workers, cache=None, revalidate=False, queue_size=None):
+    """
+    分阶段引擎：download_workers 个线程负责下载（网络阶段，产出原始字节），
+    通过有界队列交给 encode_workers 个进程的 ProcessPoolExecutor 编码（CPU阶段，不受GIL限制）。
+    队列和进行中的编码任务数都有上限，内存占用不会随菜单规模增长。按完成顺序产出 (item, result, exc)，
+    结束时输出每个阶段的利用率。
+    """
+    encode_queue = queue.Queue(maxsize=queue_size or encode_workers * 2)
+    results = queue.Queue()
+    encode_slots = threading.BoundedSemaphore(encode_workers)
+    stats_lock = threading.Lock()
+    stats = {'download_busy': 0.0, 'queue_put_wait': 0.0, 'encode_busy': 0.0,
+             'encoded': 0, 'max_queue_depth': 0}
+
+    def add_stat(key, value):
+        with stats_lock:
+            stats[key] += value
+
+    def download_stage(item):
+        try:
+            job = prepare_item(item, image_download_dir, new_image_url_prefix, cache, revalidate)
+            if job is None or job['status'] != 'pending':
+                results.put((item, job, None))
+                return
+
+            start = time.perf_counter()
+            if cached_source_path(job, cache):
+                result, source = resolve_source(job, None, cache)
+                data = _read_source_bytes(source)
+            else:
+                logger.info(f"  [下载中] -> {job['source_url']}")
+                try:
+                    fetched = fetcher.fetch(job['source_url'], **validators_for(job, cache))
+                except FetchError as e:
+                    add_stat('download_busy', time.perf_counter() - start)
+                    results.put((item, fetch_error_result(e), None))
+                    return
+                with fetched:
+                    result, source = resolve_source(job, fetched, cache)
+                    data = None if result is not None else _read_source_bytes(source)
+            add_stat('download_busy', time.perf_counter() - start)
+
+            if result is not None:
+                results.put((item, result, None))
+                return
+
+            start = time.perf_counter()
+            encode_queue.put((job, data))
+            add_stat('queue_put_wait', time.perf_counter() - start)
+            with stats_lock:
+                stats['max_queue_depth'] = max(stats['max_queue_depth'], encode_queue.qsize())
+        except Exception as exc:
+            results.put((item, None, exc))
+
+    def on_encoded(job, future):
+        encode_slots.release()
+        try:
+            result, busy = future.result()
+        except Exception as exc:
+            results.put((job['item'], None, exc))
+            return
+        add_stat('encode_busy', busy)
+        add_stat('encoded', 1)
+        if result.get('status') == 'success':
+            result['item'] = job['item']
+            record_job_result(job, result, cache)
+        results.put((job['item'], result, None))
+
+    def feed_encoders(encode_pool):
+        while True:
+            entry = encode_queue.get()
+            if entry is None:
+                return
+            job, data = entry
+            encode_slots.acquire()
+            worker_job = dict(job, item=None)
+            future = encode_pool.submit(_encode_in_worker, worker_job, data)
+            future.add_done_callback(lambda f, job=job: on_encoded(job, f))
+
+    wall_start = time.perf_counter()
+    # 编码进程在下载线程运行期间按需启动，fork 会把其他线程持有的锁（如日志处理器的锁）原样复制到子进程中导致死锁，
+    # 因此固定使用 spawn
+    with ProcessPoolExecutor(max_workers=encode_workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_encode_worker, initargs=(encoder_settings(encode_workers),)) as encode_pool, \
+            ThreadPoolExecutor(max_workers=download_workers) as download_pool:
+        feeder = threading.Thread(target=feed_encoders, args=(encode_pool,), daemon=True)
+        feeder.start()
+        download_futures = [download_pool.submit(download_stage, item) for item in items]
+
+        def close_queue():
+            wait(download_futures)
+            encode_queue.put(None)
+
+        threading.Thread(target=close_queue, daemon=True).start()
+        for _ in items:
+            yield results.get()
+        feeder.join()
+
+    wall = time.perf_counter() - wall_start
+    logger.info("\n--- 阶段利用率 ---")
+    logger.info(f"下载阶段: {download_workers} 个线程，忙碌 {stats['download_busy']:.1f}s，"
+                f"利用率 {stats['download_busy'] / (wall * download_workers):.0%}，"
+                f"因编码队列已满等待 {stats['queue_put_wait']:.1f}s")
+    logger.info(f"编码阶段: {encode_workers} 个进程，编码 {stats['encoded']} 张，忙碌 {stats['encode_busy']:.1f}s，"
+                f"利用率 {stats['encode_busy'] / (wall * encode_workers):.0%}")
+    logger.info(f"编码队列: 容量 {encode_queue.maxsize}，最大深度 {stats['max_queue_depth']}，总耗时 {wall:.1f}s")
+
+
+def collect_garbage(data, image_download_dir, new_image_url_prefix, cache, dry_run=False):
+    """
+    删除输出目录中不再被JSON引用的WebP文件，并清理对应的清单记录和源文件副本。
+    data 可以是单个JSON文档，也可以是多个文档组成的列表（批量模式下所有文件的引用合并计算）。
+    """
+    referenced = set()
+    for item in find_all_items_recursive(data):
+        urls = [item.get('image_url')] + [v.get('url') for v in item.get('variants') or [] if isinstance(v, dict)]
+        for image_url in urls:
+            if isinstance(image_url, str) and image_url.startswith(new_image_url_prefix):
+                referenced.add(image_url[len(new_image_url_prefix):])
+
+    if not referenced:
+        logger.warning(f"\n[清理] ✗ JSON中没有任何以 '{new_image_url_prefix}' 开头的图片URL，为安全起见跳过清理。")
+        return
+
+    report = cache.gc(image_download_dir, referenced, dry_run=dry_run)
+    action = '将删除' if dry_run else '已删除'
+    logger.info(f"\n--- 清理{'预览' if dry_run else '结果'} ---")
+    for name in report['orphan_files']:
+        logger.info(f"  [孤立文件] {name}")
+    logger.info(f"{action}孤立图片: {len(report['orphan_files'])} 个 ({report['orphan_bytes'] / 1024:.1f}KB)")
+    logger.info(f"{action}过期清单记录: {len(report['stale_records'])} 条")
+    logger.info(f"{action}无用源文件副本: {len(report['orphan_blobs'])} 个")
+
+
+def expand_json_paths(patterns):
+    """展开命令行传入的文件路径和通配符 (如 raw/pages/*.json)，按出现顺序去重。"""
+    paths = []
+    seen = set()
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            logger.info(f"[提示] ⓘ 通配符 '{pattern}' 没有匹配到任何文件。")
+        for path in matches:
+            key = os.path.abspath(path)
+            if key not in seen:
+                seen.add(key)
+                paths.append(path)
+    return paths
+
+
+def load_documents(json_file_paths):
+    """读取所有JSON文件，返回 [{'path', 'text', 'data'}, ...]；读取失败的文件会被跳过。"""
+    documents = []
+    for path in json_file_paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            documents.append({'path': path, 'text': text, 'data': json.loads(text)})
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"错误: 读取JSON文件 '{path}' 失败: {e}")
+    return documents
+
+
+def group_items_by_source(items):
+    """
+    按源图片URL对菜品项去重：同一URL只保留第一个项目交给引擎处理，其余项目在结束后共享它的结果。
+    返回 (需要处理的项目列表, {id(代表项目): [共享该结果的其他项目, ...]})。
+    没有有效源URL的项目不参与去重，仍由 prepare_item 输出跳过信息。
+    """
+    representatives = []
+    followers = {}
+    first_by_url = {}
+    for item in items:
+        source_url, _ = item_source(item)
+        if is_source_url(source_url):
+            first = first_by_url.get(source_url)
+            if first is not None:
+                followers[id(first)].append(item)
+                continue
+            first_by_url[source_url] = item
+        representatives.append(item)
+        followers[id(item)] = []
+    return representatives, followers
+
+
+def share_result(result, item):
+    """把代表项目的成功结果复制给引用同一源URL的另一个项目（源字段按该项目自身计算）。"""
+    _, source_key = item_source(item)
+    shared = dict(result, item=item, source_key=source_key,
+                  is_first_run=source_key is not None and 'raw_image_url' not in item)
+    # 解码/编码/去重统计和运行报告的指标只计入代表项目
+    for key in ('decodes', 'encodes', 'peak_rss_kb', 'deduped', 'timings', 'bytes_in', 'bytes_out', 'retries'):
+        shared.pop(key, None)
+    return shared
+
+
+def apply_result(result):
+    """把成功结果写回对应的菜品项：统一为 raw_image_url + image_url，并记录宽高和尺寸变体。"""
+    item = result['item']
+    source_key = result.get('source_key')
+
+    if result['is_first_run'] and source_key:
+        item['raw_image_url'] = item.pop(source_key)
+
+    item['image_url'] = result['new_url']
+    item['width'] = result['width']
+    item['height'] = result['height']
+    if 'encoding' in result:
+        # 本次编码选中的格式、字节数以及相对有损 WebP 节省的字节数；复用已有输出时保留原记录
+        item['image_encoding'] = result['encoding']
+    if 'variants' in result:
+        if result['variants']:
+            item['variants'] = result['variants']
+        else:
+            item.pop('variants', None)
+
+    if 'imageUrl' in item and 'image_url' in item:
+        del item['imageUrl']
+
+
+def write_changed_documents(documents):
+    """
+    只写回数据确实发生变化的JSON文件（仅格式不同不算变化），每个文件都原子替换。
+    返回 (写入的文件数, 写入失败的文件数)。
+    """
+    written = 0
+    failed = 0
+    for document in documents:
+        if document['data'] == json.loads(document['text']):
+            continue
+        text = json.dumps(document['data'], indent=2, ensure_ascii=False)
+        try:
+            write_json_atomic(document['path'], text)
+            document['text'] = text
+            written += 1
+            logger.info(f"  [写入] ✓ {document['path']}")
+        except Exception as e:
+            failed += 1
+            logger.error(f"\n错误: 写入JSON文件 '{document['path']}' 失败: {e}")
+    return written, failed
+
+
+def replay_journal(items, journal, image_download_dir, new_image_url_prefix):
+    """
+    从上次中断运行的完成日志中恢复结果。返回 (已恢复的结果列表, 仍需处理的项目列表)。
+    只有输出目录、URL前缀、尺寸变体配置都一致且WebP（含变体）仍然存在的记录才会被采用。
+    """
+    if journal is None or not len(journal):
+        return [], items
+    replayed = []
+    remaining = []
+    for item in items:
+        source_url, _ = item_source(item)
+        entry = journal.lookup(source_url, image_download_dir) if isinstance(source_url, str) else None
+        if (entry is None or entry['new_url'] != f"{new_image_url_prefix}{entry['output_filename']}"
+                or [v['width'] for v in entry.get('variants') or []] != variant_widths_for(entry['width'])
+                or not all(os.path.exists(os.path.join(image_download_dir, v['url'][len(new_image_url_prefix):]))
+                           for v in entry.get('variants') or [])):
+            remaining.append(item)
+            continue
+        base = {'status': 'success', 'new_url': entry['new_url'], 'width': entry['width'], 'height': entry['height']}
+        if VARIANT_WIDTHS:
+            base['variants'] = entry.get('variants') or []
+        replayed.append((item, share_result(base, item), None))
+    if replayed:
+        logger.info(f"\n[续传] ✓ 从完成日志恢复了 {len(replayed)} 个上次已处理的项目，跳过下载和编码。")
+    return replayed, remaining
+
+
+def with_requeue(run_engine, items, rounds=REQUEUE_ROUNDS, scheduler=None, metrics=None):
+    """
+    运行 run_engine(items) 并按完成顺序产出结果。因暂时性错误失败（结果中 retryable 为 True）的项目暂不产出，
+    本轮全部结束后重新交给引擎，最多 rounds 轮，最后一轮的失败原样产出。
+    有主机处于熔断状态时，先等到它允许探测请求再开始下一轮。
+    """
+    for round_number in range(rounds + 1):
+        retry_items = []
+        for item, result, exc in run_engine(items):
+            if round_number < rounds and result is not None and result.get('retryable'):
+                retry_items.append(item)
+            else:
+                yield item, result, exc
+        if not retry_items:
+            return
+        if metrics is not None:
+            metrics.increment('requeued', len(retry_items))
+        delay = scheduler.ready_in() if scheduler is not None else 0.0
+        logger.warning(f"\n[重新排队] ↻ {len(retry_items)} 个项目因暂时性错误失败，"
+                       f"{f'等待 {delay:.0f}s 后' if delay else ''}开始第 {round_number + 1} 轮重试...")
+        if delay:
+            time.sleep(delay)
+        items = retry_items
+
+
+def journaled(results, journal, image_download_dir, new_image_url_prefix):
+    """在结果到达时把成功的项目写入完成日志，再原样产出。"""
+    for item, result, exc in results:
+        if journal is not None and exc is None and result and result.get('status') == 'success':
+            source_url, _ = item_source(item)
+            journal.record(source_url, new_url=result['new_url'],
+                           output_dir=image_download_dir,
+                           output_filename=result['new_url'][len(new_image_url_prefix):],
+                           width=result['width'], height=result['height'], variants=result.get('variants'))
+        yield item, result, exc
+
+
+def log_stage_summary(summary):
+    """输出各阶段耗时的分位数（毫秒）、字节数和压缩比。没有任何计时数据时不输出。"""
+    if not summary['stages']:
+        return
+    logger.info("\n--- 阶段耗时 (ms) ---")
+    # 中文字符占两列宽度，对齐时少补相应的空格
+    logger.info(f"{'阶段':<8}{'次数':>4}{'p50':>10}{'p95':>10}{'p99':>10}{'最大':>8}")
+    rows = list(summary['stages'].items())
+    if summary['item_total']['count']:
+        rows.append(('单项合计', summary['item_total']))
+    for name, stats in rows:
+        label = name.ljust(10 - sum(1 for ch in name if not ch.isascii()))
+        logger.info(f"{label}{stats['count']:>6}{stats['p50'] * 1000:>10.1f}{stats['p95'] * 1000:>10.1f}"
+                    f"{stats['p99'] * 1000:>10.1f}{stats['max'] * 1000:>10.1f}")
+    if summary['bytes_out']:
+        logger.info(f"输入 {summary['bytes_in'] / 1024:.1f}KB -> 输出 {summary['bytes_out'] / 1024:.1f}KB，"
+                    f"压缩比 {summary['compression_ratio']:.2f}，重试 {summary['retries']} 次")
+
+
 # 2. 将目录和前缀作为参数传入
-def update_and_run_downloader(json_file_path, image_download_dir, new_image_url_prefix):
-    """主函数，读取JSON，递归查找所有项目，并发处理图片，并统一图片URL字段。"""
+def update_and_run_downloader(json_file_path, image_download_dir, new_image_url_prefix, fetcher=None,
+                              max_workers=MAX_WORKERS, engine='threads', encode_workers=None,
+                              cache=None, revalidate=False, gc=False, gc_dry_run=False,
+                              download_workers=None, journal=None, report_path=None, report_items=False,
+                              requeue_rounds=REQUEUE_ROUNDS):
+    """
+    主函数，读取JSON，递归查找所有项目，并发处理图片，并统一图片URL字段。
+    json_file_path 可以是单个路径，也可以是路径列表（批量模式）：所有文件中的项目按源URL去重，
+    每张图片只下载和编码一次，结果写回所有引用它的项目，最后只写回内容有变化的文件。
+    engine 为 'threads'（默认线程池）、'asyncio'（此时 fetcher 须为 AsyncImageFetcher）
+    或 'staged'（下载线程 + 编码进程池，线程数由 download_workers 指定）。
+    cache 为可选的 ImageCache；revalidate 时对已有输出发送条件请求；gc 时在处理结束后清理孤立文件。
+    journal 为可选的 RunJournal：每完成一张图片就追加一条记录，中断后再次运行时直接恢复这些结果；
+    JSON 全部成功写回后删除日志。
+    因暂时性错误失败的项目在本轮结束后重新排队，最多 requeue_rounds 轮（0 表示不重新排队）。
+    运行结束时输出各阶段耗时的 p50/p95/p99；提供 report_path 时把运行报告写入该 JSON 文件，report_items 为真时报告中附带每个项目的明细。
+    """
+    metrics = RunMetrics()
     # 使用传入的参数创建目录
     os.makedirs(image_download_dir, exist_ok=True)
-    print(f"图片目录 '{image_download_dir}' 已就绪。")
+    logger.info(f"图片目录 '{image_download_dir}' 已就绪。")
 
-    try:
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        print(f"错误: 读取JSON文件 '{json_file_path}' 失败: {e}")
+    json_file_paths = [json_file_path] if isinstance(json_file_path, str) else list(json_file_path)
+    documents = load_documents(json_file_paths)
+    if not documents:
         return
 
-    items_to_process = list(find_all_items_recursive(data))
+    items_to_process = list(find_all_items_recursive([document['data'] for document in documents]))
     if not items_to_process:
-        print("\n未在JSON文件中找到任何菜品项。")
+        logger.info("\n未在JSON文件中找到任何菜品项。")
         return
 
-    print(f"\n发现 {len(items_to_process)} 个菜品需要处理。开始使用最多 {MAX_WORKERS} 个线程...")
+    unique_items, shared_items = group_items_by_source(items_to_process)
+    shared_count = len(items_to_process) - len(unique_items)
+    if len(documents) > 1 or shared_count:
+        logger.info(f"\n{len(documents)} 个JSON文件共 {len(items_to_process)} 个菜品，"
+                    f"其中 {shared_count} 个与其他菜品共用同一源图片，只处理一次。")
+
+    # 先恢复上次中断的运行中已完成的结果，再在主线程完成不需要联网的准备工作：WebP已存在的项目直接得到结果，
+    # 只有需要下载或编码的项目才交给引擎，全部就绪时不会启动下载器和线程/进程池
+    ready_results, unfinished_items = replay_journal(unique_items, journal, image_download_dir, new_image_url_prefix)
+    pending_items = []
+    fetch_urls = []
+    for item in unfinished_items:
+        try:
+            job = prepare_item(item, image_download_dir, new_image_url_prefix, cache, revalidate)
+        except Exception as exc:
+            ready_results.append((item, None, exc))
+            continue
+        if job is not None and job['status'] == 'pending':
+            pending_items.append(item)
+            # 可以直接用源文件副本重新编码的项目不会调用 fetch，不向归档登记，避免其成员被缓存到运行结束
+            if not cached_source_path(job, cache):
+                fetch_urls.append(job['source_url'])
+        else:
+            ready_results.append((item, job, None))
+
+    if fetcher is None and pending_items:
+        fetcher = AsyncImageFetcher() if engine == 'asyncio' else get_default_fetcher()
+    plan_reads = getattr(fetcher, 'plan_reads', None)
+    if plan_reads is not None and fetch_urls:
+        # 按归档中的成员顺序提交任务，tar 归档只需顺序读取一遍
+        read_order = plan_reads(fetch_urls)
+        pending_items.sort(key=lambda item: read_order(item_source(item)[0]))
+    if encode_workers is None:
+        encode_workers = os.cpu_count() or 1
 
     successful_updates = []
     failed_count = 0
     skipped_count = 0
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        # 将参数传递给 process_item
-        future_to_item = {
-            executor.submit(process_item, item, image_download_dir, new_image_url_prefix): item
-            for item in items_to_process
-        }
-        for future in as_completed(future_to_item):
-            try:
-                result = future.result()
-                if result is None:
-                    skipped_count += 1
-                elif result.get('status') == 'success':
-                    successful_updates.append(result)
-                else:
-                    failed_count += 1
-                    with print_lock:
-                         print(f"  [错误详情] ✗ 项目 '{future_to_item[future].get('title', '未知')}' 处理失败: {result.get('reason')}")
-            except Exception as exc:
-                failed_count += 1
-                with print_lock:
-                    print(f"  [严重错误] ✗ 项目 '{future_to_item[future].get('title', '未知')}' 产生异常: {exc}")
+    if not pending_items:
+        logger.info(f"\n发现 {len(unique_items)} 个菜品，全部无需下载或转换。")
+        run_engine = None
+    elif engine == 'asyncio':
+        logger.info(f"\n发现 {len(pending_items)} 个菜品需要处理。使用 asyncio 引擎 "
+                    f"(最多 {fetcher.max_in_flight} 个并发下载，{encode_workers} 个编码线程)...")
 
+        def run_engine(items):
+            return run_asyncio_engine(items, image_download_dir, new_image_url_prefix,
+                                      fetcher, encode_workers, cache, revalidate)
+    elif engine == 'staged':
+        download_workers = download_workers or max_workers
+        logger.info(f"\n发现 {len(pending_items)} 个菜品需要处理。使用分阶段引擎 "
+                    f"({download_workers} 个下载线程，{encode_workers} 个编码进程)...")
 
-    if successful_updates:
-        print(f"\n处理完成。正在更新 {len(successful_updates)} 个项目到JSON文件...")
+        def run_engine(items):
+            return run_staged_engine(items, image_download_dir, new_image_url_prefix,
+                                     fetcher, download_workers, encode_workers, cache, revalidate)
+    else:
+        logger.info(f"\n发现 {len(pending_items)} 个菜品需要处理。开始使用最多 {max_workers} 个线程...")
+
+        def run_engine(items):
+            return run_thread_engine(items, image_download_dir, new_image_url_prefix,
+                                     fetcher, max_workers, cache, revalidate)
+
+    results = [] if run_engine is None else with_requeue(run_engine, pending_items, requeue_rounds,
+                                                         getattr(fetcher, 'scheduler', None), metrics)
+    results = journaled(results, journal, image_download_dir, new_image_url_prefix)
+    for item, result, exc in itertools.chain(ready_results, results):
+        # 引用同一源URL的其他项目共享代表项目的结果
+        group_size = 1 + len(shared_items[id(item)])
+        metrics.add_item(item_source(item)[0], item.get('title'), result, exc)
+        if group_size > 1:
+            metrics.increment('shared', group_size - 1)
+        if exc is not None:
+            failed_count += group_size
+            logger.error(f"  [严重错误] ✗ 项目 '{item.get('title', '未知')}' 产生异常: {exc}")
+        elif result is None:
+            skipped_count += group_size
+        elif result.get('status') == 'success':
+            successful_updates.append(result)
+            successful_updates.extend(share_result(result, other) for other in shared_items[id(item)])
+        else:
+            failed_count += group_size
+            logger.error(f"  [错误详情] ✗ 项目 '{item.get('title', '未知')}' 处理失败: {result.get('reason')}")
 
+    if successful_updates:
+        logger.info(f"\n处理完成。正在更新 {len(successful_updates)} 个项目到JSON文件...")
         for result in successful_updates:
-            item = result['item']
-            source_key = result.get('source_key')
+            apply_result(result)
 
-            if result['is_first_run'] and source_key:
-                item['raw_image_url'] = item.pop(source_key)
+        written, write_failed = write_changed_documents(documents)
+        if written:
+            logger.info(f"JSON文件更新成功！共写入 {written} 个文件，{len(documents) - written - write_failed} 个文件内容未变化。")
+        elif not write_failed:
+            logger.info("所有JSON文件内容均未变化，没有写入。")
+    else:
+        write_failed = 0
+        logger.info("\n本次运行没有成功更新任何项目，JSON文件未被修改。")
 
-            item['image_url'] = result['new_url']
-            item['width'] = result['width']
-            item['height'] = result['height']
+    # 所有结果都已写回JSON，完成日志不再需要；写入失败时保留，下次运行仍可恢复
+    if journal is not None:
+        if write_failed:
+            logger.warning(f"[提示] ⓘ 部分JSON写入失败，已保留完成日志 {journal.path}，下次运行将从中恢复。")
+        else:
+            journal.discard()
 
-            if 'imageUrl' in item and 'image_url' in item:
-                del item['imageUrl']
+    logger.info("\n--- 处理结果 ---")
+    logger.info(f"成功处理并更新: {len(successful_updates)} 项")
+    logger.info(f"处理失败: {failed_count} 项")
+    logger.info(f"跳过处理: {skipped_count} 项")
+    logger.info(f"总计: {len(items_to_process)} 项")
+    encoded = [r for r in successful_updates if 'encodes' in r]
+    if encoded:
+        decodes = sum(r['decodes'] for r in encoded)
+        encodes = sum(r['encodes'] for r in encoded)
+        logger.info(f"解码/编码: {len(encoded)} 张图片共解码 {decodes} 次、编码 {encodes} 次，"
+                    f"平均每张编码 {encodes / len(encoded):.1f} 次")
+        peaks = [r['peak_rss_kb'] for r in encoded if r.get('peak_rss_kb') is not None]
+        if peaks:
+            logger.info(f"进程峰值内存: {max(peaks) / 1024:.1f}MB")
+        waits = [r['timings']['memory_wait'] for r in encoded if 'memory_wait' in r.get('timings', {})]
+        if waits:
+            logger.info(f"内存预算: {len(waits)} 张图片等待其他解码释放内存，共 {sum(waits):.1f}s")
+        chosen = [r['encoding'] for r in encoded if 'encoding' in r]
+        if chosen and len(OUTPUT_FORMATS) > 1:
+            counts = {}
+            for encoding in chosen:
+                counts[encoding['format']] = counts.get(encoding['format'], 0) + 1
+            summary = '，'.join(f"{name} {count} 张" for name, count in sorted(counts.items()))
+            logger.info(f"输出格式: {summary}，比全部使用有损 WebP 节省 "
+                        f"{sum(e['saved_bytes'] for e in chosen) / 1024:.1f}KB")
+    deduped = [r['deduped'] for r in successful_updates if 'deduped' in r]
+    if deduped:
+        exact = sum(1 for d in deduped if d['match'] == 'exact')
+        logger.info(f"去重: {len(deduped)} 张图片复用了已有的WebP（{exact} 张内容完全相同，{len(deduped) - exact} 张视觉相同），"
+                    f"节省存储 {sum(d['bytes'] for d in deduped) / 1024:.1f}KB，"
+                    f"节省编码时间约 {sum(d['seconds'] for d in deduped):.1f}s")
+    fetch_stats = fetcher.stats() if fetcher is not None else {'requests': 0}
+    if fetch_stats['requests']:
+        logger.info(f"下载请求: {fetch_stats['requests']} 次，新建连接: {fetch_stats['connections']} 个，"
+                    f"复用连接节省握手: {fetch_stats['handshakes_saved']} 次")
+        if fetch_stats['not_modified']:
+            logger.info(f"源图片未变化 (304): {fetch_stats['not_modified']} 次")
+        if fetch_stats.get('retries') or fetch_stats.get('throttled') or fetch_stats.get('circuit_opens'):
+            logger.info(f"重试: {fetch_stats['retries']} 次，限流响应 (429/503): {fetch_stats['throttled']} 次，"
+                        f"熔断: {fetch_stats['circuit_opens']} 次，重新排队: {metrics.counters.get('requeued', 0)} 项")
+        for host, rate in fetch_stats.get('rates', {}).items():
+            logger.info(f"  {host} 当前限速 {rate:.1f} 次/秒")
+    if fetch_stats.get('too_large'):
+        logger.info(f"源图片超出字节上限被拒绝: {fetch_stats['too_large']} 张")
+    if fetch_stats.get('local_hits') or fetch_stats.get('local_misses'):
+        sources = '，'.join(f"{name} {count} 张" for name, count in fetch_stats['local_sources'].items())
+        logger.info(f"本地来源: 读取 {fetch_stats['local_hits']} 张图片 ({fetch_stats['local_bytes'] / 1024 / 1024:.1f}MB"
+                    f"{'，' + sources if sources else ''})，未变化 {fetch_stats['local_not_modified']} 张，"
+                    f"未找到 {fetch_stats['local_misses']} 张")
+        if fetch_stats.get('archive_rewinds'):
+            logger.info(f"  归档重新从头读取: {fetch_stats['archive_rewinds']} 次")
+    log_stage_summary(metrics.summary())
+    logger.info("------------------\n")
 
+    if report_path:
+        report = metrics.report(
+            include_items=report_items,
+            json_files=[document['path'] for document in documents],
+            output_dir=os.path.abspath(image_download_dir),
+            engine=engine,
+            results={'success': len(successful_updates), 'failed': failed_count,
+                     'skipped': skipped_count, 'total': len(items_to_process)},
+            fetch=fetch_stats,
+        )
         try:
-            with open(json_file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-            print("JSON文件更新成功！")
-        except Exception as e:
-            print(f"\n错误: 写入JSON文件失败: {e}")
-    else:
-        print("\n本次运行没有成功更新任何项目，JSON文件未被修改。")
+            write_json_atomic(report_path, json.dumps(report, indent=2, ensure_ascii=False))
+            logger.info(f"运行报告已写入 {report_path}")
+        except OSError as e:
+            logger.error(f"错误: 写入运行报告 '{report_path}' 失败: {e}")
 
-    print("\n--- 处理结果 ---")
-    print(f"成功处理并更新: {len(successful_updates)} 项")
-    print(f"处理失败: {failed_count} 项")
-    print(f"跳过处理: {skipped_count} 项")
-    print(f"总计: {len(items_to_process)} 项")
-    print("------------------\n")
+    if cache is not None and (gc or gc_dry_run):
+        collect_garbage([document['data'] for document in documents], image_download_dir, new_image_url_prefix,
+                        cache, dry_run=gc_dry_run)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -350,7 +1619,11 @@ if __name__ == '__main__':
     )
 
     # 必要的位置参数
-    parser.add_argument('json_file', type=str, help='需要处理的JSON文件的路径。')
+    parser.add_argument(
+        'json_files',
+        nargs='+',
+        help='需要处理的JSON文件路径，可以传入多个文件或通配符 (如 "raw/pages/*.json")。多个文件按源图片URL统一去重。'
+    )
 
     # 可选参数
     parser.add_argument(
@@ -366,7 +1639,195 @@ if __name__ == '__main__':
         help='写入JSON文件中的图片URL前缀。如果未提供，将根据output-dir自动推断。'
     )
 
+    # 下载相关参数
+    parser.add_argument(
+        '--engine',
+        choices=['threads', 'asyncio', 'staged'],
+        default='threads',
+        help="处理引擎：threads 为每个线程完整处理一个项目；asyncio 以协程并发下载，编码交给有界线程池（需要 aiohttp）；"
+             "staged 为下载线程 + 编码进程池，两个阶段通过有界队列连接。"
+    )
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help='threads 引擎的并发线程数。')
+    parser.add_argument('--download-workers', type=int, default=MAX_WORKERS, help='staged 引擎的下载线程数。')
+    parser.add_argument(
+        '--encode-workers',
+        type=int,
+        default=os.cpu_count() or 1,
+        help='asyncio 引擎的解码/编码线程数，或 staged 引擎的编码进程数。'
+    )
+    parser.add_argument('--max-in-flight', type=int, default=DEFAULT_MAX_IN_FLIGHT, help='asyncio 引擎同时进行的最大下载数。')
+    parser.add_argument('--per-host-limit', type=int, default=DEFAULT_PER_HOST_LIMIT, help='asyncio 引擎对单个主机的最大并发下载数。')
+    parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE, help='每个主机的最大连接池大小。')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='下载时每次读取的字节数。')
+    parser.add_argument('--proxy', type=str, default=DEFAULT_PROXY, help="下载使用的代理地址，传入 'none' 表示直连。")
+    parser.add_argument('--connect-timeout', type=float, default=DEFAULT_CONNECT_TIMEOUT, help='建立连接的超时时间（秒）。')
+    parser.add_argument('--read-timeout', type=float, default=DEFAULT_READ_TIMEOUT, help='读取响应的超时时间（秒）。')
+    parser.add_argument(
+        '--spool-threshold-kb',
+        type=int,
+        default=DEFAULT_SPOOL_THRESHOLD // 1024,
+        help='响应体超过该大小（KB）时转存到磁盘临时文件，否则保留在内存中。'
+    )
+
+    # 本地来源参数
+    parser.add_argument(
+        '--mirror',
+        action='append',
+        default=[],
+        metavar='DIR',
+        help='本地镜像目录（可重复指定）：URL 依次对应 DIR/<主机>/<路径>、DIR/<路径>、DIR/<文件名>，找到时不再下载。'
+    )
+    parser.add_argument(
+        '--archive',
+        action='append',
+        default=[],
+        metavar='PATH',
+        help='tar / tar.gz / zip 归档（可重复指定）：按路径或文件名匹配URL，成员直接在内存中解码，不解压到磁盘。'
+    )
+    parser.add_argument('--offline', action='store_true', help='不发起任何HTTP请求，本地来源中没有的图片记为失败。')
+
+    # 内存限制参数
+    parser.add_argument('--max-source-mb', type=float, default=DEFAULT_MAX_BYTES / 1024 / 1024,
+                        help='源图片的字节上限 (MB)：Content-Length 超出时不下载，边下载边检查，超出即中止。0 表示不限制。')
+    parser.add_argument('--max-source-megapixels', type=float, default=MAX_SOURCE_PIXELS / 1e6,
+                        help='源图片的像素上限（百万像素），超出时不解码，直接记为失败。0 表示不限制。')
+    parser.add_argument('--max-width', type=int, default=MAX_OUTPUT_WIDTH,
+                        help='主图的最大宽度，更宽的源图片直接以缩小的尺寸解码（JPEG 在 DCT 阶段缩小）。0 表示保持原尺寸。')
+    parser.add_argument('--memory-budget-mb', type=float, default=MEMORY_BUDGET_MB,
+                        help='同时进行的解码/编码按估算占用的内存上限 (MB)，超出时大图排队等待；'
+                             'staged 引擎在编码进程间平分。0 表示不限制。')
+
+    # 限速与重试参数
+    parser.add_argument(
+        '--host-rate',
+        type=float,
+        default=DEFAULT_HOST_RATE,
+        help='每个主机每秒最多发出的请求数，0 表示不限速。主机返回 429/503 时自动减半，之后逐渐恢复到该上限。'
+    )
+    parser.add_argument('--host-burst', type=int, default=DEFAULT_HOST_BURST, help='每个主机允许的突发请求数（令牌桶容量）。')
+    parser.add_argument('--max-retries', type=int, default=DEFAULT_MAX_RETRIES,
+                        help='单次下载遇到暂时性错误（超时、连接错误、429/5xx）时的最大重试次数。')
+    parser.add_argument('--backoff-base', type=float, default=DEFAULT_BACKOFF_BASE,
+                        help='重试退避的基准时间（秒），第 n 次重试前随机等待 0 到 base*2^n 秒（不少于 Retry-After）。')
+    parser.add_argument('--backoff-max', type=float, default=DEFAULT_BACKOFF_MAX, help='单次重试退避的最长时间（秒）。')
+    parser.add_argument('--breaker-threshold', type=int, default=DEFAULT_BREAKER_THRESHOLD,
+                        help='同一主机连续失败多少次后熔断（暂停向该主机发送请求）。')
+    parser.add_argument('--breaker-cooldown', type=float, default=DEFAULT_BREAKER_COOLDOWN, help='熔断的冷却时间（秒）。')
+    parser.add_argument('--requeue-rounds', type=int, default=REQUEUE_ROUNDS,
+                        help='因暂时性错误失败的项目在运行末尾重新排队的最大轮数，0 表示不重新排队。')
+
+    # 压缩相关参数
+    parser.add_argument('--no-method-fallback', action='store_true', help='质量下限仍超出大小限制时，不尝试更高的WebP压缩强度 (method=6)。')
+    parser.add_argument('--no-resize-fallback', action='store_true', help='质量下限仍超出大小限制时，不缩小图片尺寸。')
+    parser.add_argument(
+        '--formats',
+        type=str,
+        default=','.join(OUTPUT_FORMATS),
+        help=f'逗号分隔的候选输出格式（{FORMAT_WEBP}、{FORMAT_WEBP_LOSSLESS}、{FORMAT_AVIF}）。有损 WebP 始终参与；'
+             f'无损 WebP 只对带透明通道或颜色很少的图片尝试；选中 AVIF 时输出文件扩展名为 .avif。'
+    )
+    parser.add_argument('--ssim-floor', type=float, default=SSIM_FLOOR,
+                        help='有多个候选格式时，有损候选与原图的最低 SSIM（0~1），低于该值的候选不会被选中。')
+    parser.add_argument(
+        '--stamp',
+        choices=['random', 'source-hash'],
+        default=STAMP_MODE,
+        help="写入WebP的唯一性标记：random 为时间戳+UUID；source-hash 由源图片哈希生成，重复运行结果可复现。"
+    )
+    parser.add_argument('--stamp-chunk', choices=['exif', 'xmp'], default=STAMP_CHUNK, help='唯一性标记写入的元数据块。')
+    parser.add_argument(
+        '--variant-widths',
+        type=str,
+        default='',
+        help='逗号分隔的响应式尺寸变体宽度，如 "160,320,640"。每张图片额外生成这些宽度的WebP（只缩小不放大），'
+             '并在菜品项中写入 variants 数组。'
+    )
+
+    # 缓存相关参数
+    parser.add_argument('--cache-dir', type=str, default=DEFAULT_CACHE_DIR, help='图片清单和源文件副本的存放目录。')
+    parser.add_argument('--no-cache', action='store_true', help='不使用持久化清单（恢复为仅检查WebP是否存在）。')
+    parser.add_argument('--no-source-copies', action='store_true', help='清单中不保存源文件副本（WebP被删除后需要重新下载）。')
+    parser.add_argument(
+        '--revalidate',
+        action='store_true',
+        help='对已存在的WebP发送条件请求 (ETag/Last-Modified)，源图片变化时重新生成。'
+    )
+    parser.add_argument(
+        '--gc',
+        action='store_true',
+        help='处理结束后删除输出目录中不再被该JSON引用的WebP文件（输出目录被多个JSON共用时请勿使用）。'
+    )
+    parser.add_argument('--gc-dry-run', action='store_true', help='只列出 --gc 将要删除的文件，不实际删除。')
+    parser.add_argument(
+        '--dedupe',
+        action='store_true',
+        help=f'按源图片哈希和感知哈希去重：不同URL但内容相同或视觉相同的图片共用同一个WebP，不再重复编码'
+             f'（索引保存在 --cache-dir 下的 {DEDUPE_INDEX_FILENAME}）。'
+    )
+    parser.add_argument(
+        '--dedupe-distance',
+        type=int,
+        default=DEFAULT_MAX_DISTANCE,
+        help='判定视觉相同的最大感知哈希距离（64 位 dHash 中不同的位数），0 表示只接受哈希完全相同。'
+    )
+
+    # 续传相关参数
+    parser.add_argument(
+        '--journal',
+        type=str,
+        default=None,
+        help=f'完成日志的路径（默认为 --cache-dir 下的 {DEFAULT_JOURNAL_FILENAME}）。运行中断后再次运行会从日志恢复已完成的图片。'
+    )
+    parser.add_argument('--no-journal', action='store_true', help='不写完成日志（中断后已完成的结果只能通过已存在的WebP恢复）。')
+
+    # 日志与运行报告
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default=LOG_LEVEL,
+                        help='日志级别：DEBUG 额外输出每张图片的解码/编码统计，WARNING 只输出警告和错误。')
+    parser.add_argument(
+        '--report',
+        type=str,
+        default=None,
+        help=f'JSON 运行报告的路径（默认为 --cache-dir 下的 {DEFAULT_REPORT_FILENAME}，使用 --no-cache 时默认不写），'
+             f'包含计数、下载统计和各阶段耗时的分位数。'
+    )
+    parser.add_argument('--no-report', action='store_true', help='不写 JSON 运行报告。')
+    parser.add_argument('--report-items', action='store_true', help='在运行报告中附带每个项目的状态、耗时和字节数明细。')
+
     args = parser.parse_args()
+    LOG_LEVEL = args.log_level
+    log_listener = setup_logging(LOG_LEVEL)
+
+    ALLOW_METHOD_FALLBACK = not args.no_method_fallback
+    ALLOW_RESIZE_FALLBACK = not args.no_resize_fallback
+    STAMP_MODE = args.stamp
+    STAMP_CHUNK = args.stamp_chunk
+    requested_formats = [f.strip() for f in args.formats.split(',') if f.strip()]
+    unknown_formats = set(requested_formats) - set(FORMAT_SUFFIXES)
+    if unknown_formats:
+        parser.error(f"--formats 中有未知的格式: {', '.join(sorted(unknown_formats))}")
+    if FORMAT_AVIF in requested_formats and not avif_supported():
+        logger.warning("[提示] ⓘ 当前的 Pillow 不支持 AVIF 编码，已从候选格式中去掉 avif。")
+        requested_formats.remove(FORMAT_AVIF)
+    OUTPUT_FORMATS = tuple(dict.fromkeys([FORMAT_WEBP] + requested_formats))
+    if not 0 <= args.ssim_floor <= 1:
+        parser.error('--ssim-floor 必须在 0 到 1 之间。')
+    SSIM_FLOOR = args.ssim_floor
+    if min(args.max_source_mb, args.max_source_megapixels, args.max_width, args.memory_budget_mb) < 0:
+        parser.error('--max-source-mb / --max-source-megapixels / --max-width / --memory-budget-mb 不能为负数。')
+    MAX_SOURCE_PIXELS = int(args.max_source_megapixels * 1e6)
+    MAX_OUTPUT_WIDTH = args.max_width
+    MEMORY_BUDGET_MB = args.memory_budget_mb
+    try:
+        VARIANT_WIDTHS = tuple(sorted({int(w) for w in args.variant_widths.split(',') if w.strip()}))
+    except ValueError:
+        parser.error(f'--variant-widths 格式无效: {args.variant_widths}')
+    if any(w <= 0 for w in VARIANT_WIDTHS):
+        parser.error('--variant-widths 中的宽度必须为正整数。')
+    if args.dedupe:
+        if not 0 <= args.dedupe_distance <= 64:
+            parser.error('--dedupe-distance 必须在 0 到 64 之间。')
+        DEDUPE_INDEX_PATH = os.path.join(args.cache_dir, DEDUPE_INDEX_FILENAME)
+        DEDUPE_MAX_DISTANCE = args.dedupe_distance
 
     # --- 2. 新增的智能逻辑 ---
     final_output_dir = args.output_dir
@@ -394,8 +1855,76 @@ if __name__ == '__main__':
             path_as_url += '/'
 
         final_url_prefix = path_as_url
-        print(f"[提示] ⓘ 未提供 --url-prefix，已根据输出目录自动生成: {final_url_prefix}")
+        logger.info(f"[提示] ⓘ 未提供 --url-prefix，已根据输出目录自动生成: {final_url_prefix}")
 
 
+    if args.host_rate < 0 or args.host_burst < 1 or args.max_retries < 0 or args.requeue_rounds < 0:
+        parser.error('--host-rate / --max-retries / --requeue-rounds 不能为负数，--host-burst 至少为 1。')
+    scheduler = HostScheduler(rate=args.host_rate, burst=args.host_burst, max_retries=args.max_retries,
+                              backoff_base=args.backoff_base, backoff_max=args.backoff_max,
+                              breaker_threshold=args.breaker_threshold, breaker_cooldown=args.breaker_cooldown)
+    fetch_options = dict(
+        scheduler=scheduler,
+        chunk_size=args.chunk_size,
+        proxy=None if args.proxy.lower() == 'none' else args.proxy,
+        connect_timeout=args.connect_timeout,
+        read_timeout=args.read_timeout,
+        spool_threshold=args.spool_threshold_kb * 1024,
+        max_bytes=int(args.max_source_mb * 1024 * 1024),
+    )
+    try:
+        sources = build_sources(args.mirror, args.archive, spool_threshold=fetch_options['spool_threshold'])
+    except (OSError, ValueError) as e:
+        parser.error(f'无法打开本地来源: {e}')
+    if args.engine == 'asyncio':
+        if not args.offline and fetch_options['proxy'] and fetch_options['proxy'].startswith('socks'):
+            try:
+                socks_connector_class()
+            except FetchError as e:
+                parser.error(f"{e}（或使用 --proxy none / --engine threads）")
+        http_fetcher = None if args.offline else AsyncImageFetcher(
+            max_in_flight=args.max_in_flight, per_host_limit=args.per_host_limit, **fetch_options)
+        fetcher = AsyncSourceResolver(sources, http_fetcher, max_bytes=fetch_options['max_bytes'])
+    else:
+        http_fetcher = None if args.offline else ImageFetcher(pool_size=args.pool_size, **fetch_options)
+        fetcher = SourceResolver(sources, http_fetcher, max_bytes=fetch_options['max_bytes'])
+        if args.engine == 'staged' and not args.offline and args.download_workers > args.pool_size:
+            logger.info(f"[提示] ⓘ --download-workers ({args.download_workers}) 大于 --pool-size ({args.pool_size})，"
+                        f"多出的下载线程会排队等待连接。")
+    for source in sources:
+        if isinstance(source, ArchiveSource):
+            logger.info(f"[提示] ⓘ 归档 {source.path} 包含 {len(source)} 个文件。")
+
+    cache = None
+    if not args.no_cache:
+        cache = ImageCache(args.cache_dir, keep_sources=not args.no_source_copies)
+    elif args.revalidate or args.gc or args.gc_dry_run:
+        parser.error('--revalidate / --gc 需要启用清单，不能与 --no-cache 同时使用。')
+
+    # --no-cache 时不使用 --cache-dir，除非显式指定 --report，否则不写运行报告
+    report_path = None
+    if not args.no_report:
+        report_path = args.report or (None if args.no_cache else os.path.join(args.cache_dir, DEFAULT_REPORT_FILENAME))
+
+    journal = None
+    if not args.no_journal:
+        journal = RunJournal(args.journal or os.path.join(args.cache_dir, DEFAULT_JOURNAL_FILENAME))
+
     # 将最终确定好的参数传递给主函数
-    update_and_run_downloader(args.json_file, final_output_dir, final_url_prefix)
\ No newline at end of file
+    try:
+        update_and_run_downloader(expand_json_paths(args.json_files), final_output_dir, final_url_prefix, fetcher=fetcher,
+                                  max_workers=args.workers, engine=args.engine,
+                                  encode_workers=args.encode_workers, cache=cache,
+                                  revalidate=args.revalidate, gc=args.gc, gc_dry_run=args.gc_dry_run,
+                                  download_workers=args.download_workers, journal=journal,
+                                  report_path=report_path, report_items=args.report_items,
+                                  requeue_rounds=args.requeue_rounds)
+    finally:
+        fetcher.close()
+        if journal is not None:
+            journal.close()
+        if cache is not None:
+            cache.close()
+        if _dedupe_index is not None:
+            _dedupe_index.close()
+        log_listener.stop()
\ No newline at end of file
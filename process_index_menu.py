@@ -1,43 +1,21 @@
+import argparse
 import json
 import os
 
-def transform_menu_with_unique_keys(input_file_path, output_file_path):
-    """
-    将原始菜单JSON文件转换为一个新的、以类别名称为键的JSON对象，并处理重复的键。
+# 需要从子类别中删除的键列表
+KEYS_TO_REMOVE = ["code", "slug", "itemCount", "icon"]
+# 流式模式每次从输入文件读取的字符数
+STREAM_CHUNK_SIZE = 64 * 1024
 
-    这个函数会：
-    1. 将所有 subCategories 提取到顶层。
-    2. 如果一个子类别的名称与已存在的键冲突，则使用 "父类别名 - 子类别名" 的格式创建新键。
-    3. 从被提取的子类别中删除 'code', 'slug', 'itemCount', 'icon' 字段。
-    4. 对于没有子类别的顶级类别，直接以其 'name' 作为键添加到输出对象中。
-    5. 将结果保存到新的JSON文件中。
 
-    :param input_file_path: 输入的JSON文件路径 (e.g., 'raw/index-menu.json')
-    :param output_file_path: 输出的JSON文件路径 (e.g., 'raw/index-full-menu.json')
+def flatten_categories(categories, used_keys):
+    """
+    依次产出 (键, 类别对象)：子类别被提取到顶层并删除 KEYS_TO_REMOVE 中的字段，没有子类别的顶级类别原样产出。
+    used_keys 为已使用的键集合（会被更新），子类别名冲突时改用 "父类别名 - 子类别名"。
+    产出的子类别对象会被原地修改，调用方不应再使用原始数据。
     """
-    try:
-        # 确保输入文件所在的目录存在
-        input_dir = os.path.dirname(input_file_path)
-        if input_dir and not os.path.exists(input_dir):
-            print(f"错误：输入目录 '{input_dir}' 不存在。")
-            return
-
-        with open(input_file_path, 'r', encoding='utf-8') as f:
-            original_data = json.load(f)
-    except FileNotFoundError:
-        print(f"错误：输入文件 '{input_file_path}' 未找到。")
-        return
-    except json.JSONDecodeError:
-        print(f"错误：文件 '{input_file_path}' 不是有效的JSON格式。")
-        return
-
-    # 初始化一个空字典来存储最终的JSON对象
-    transformed_data_obj = {}
-    # 需要从子类别中删除的键列表
-    keys_to_remove = ["code", "slug", "itemCount", "icon"]
-
     # 遍历原始数据中的每个顶级类别
-    for category in original_data:
+    for category in categories:
         # 检查 'subCategories' 键是否存在且其值（列表）不为空
         if 'subCategories' in category and category['subCategories']:
             # 获取父类别的名称，用于处理键冲突
@@ -52,20 +30,16 @@ def transform_menu_with_unique_keys(input_file_path, output_file_path):
                 # 确定最终要使用的键
                 final_key = sub_cat_name
                 # 检查键是否存在冲突
-                if final_key in transformed_data_obj and parent_name:
+                if final_key in used_keys and parent_name:
                     # 如果键已存在，并且有父类别名称，则创建组合键
                     final_key = f"{parent_name} - {sub_cat_name}"
 
-                # 创建子类别的一个副本以进行修改
-                processed_sub_cat = sub_category.copy()
-
                 # 遍历需要删除的键列表并删除
-                for key in keys_to_remove:
-                    if key in processed_sub_cat:
-                        del processed_sub_cat[key]
+                for key in KEYS_TO_REMOVE:
+                    sub_category.pop(key, None)
 
-                # 使用最终确定的键将处理后的子类别添加到对象中
-                transformed_data_obj[final_key] = processed_sub_cat
+                used_keys.add(final_key)
+                yield final_key, sub_category
         else:
             # 如果没有子类别，直接将原始类别添加到最终的对象中
             category_name = category.get('name')
@@ -73,7 +47,155 @@ def transform_menu_with_unique_keys(input_file_path, output_file_path):
                 continue # 如果类别没有名称，则跳过
 
             # 这里不检查冲突，允许覆盖，因为顶级类别没有“父级”来创建新名称
-            transformed_data_obj[category_name] = category
+            used_keys.add(category_name)
+            yield category_name, category
+
+
+def iter_json_array(f, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    逐个产出文本文件中顶层 JSON 数组的元素，每次只把当前元素保留在内存中。
+    元素跨越读取边界时继续读入更多内容后重新解析，每次重试读入的量翻倍，
+    大元素只会被重新解析 O(log n) 次；格式错误时抛出 json.JSONDecodeError。
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def read_more(size=chunk_size):
+        nonlocal buffer, pos, eof
+        chunk = f.read(size)
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        eof = not chunk
+
+    def next_char():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos] if pos < len(buffer) else ''
+            read_more()
+
+    if next_char() != '[':
+        raise json.JSONDecodeError("顶层不是JSON数组", buffer, pos)
+    pos += 1
+    if next_char() == ']':
+        return
+    while True:
+        next_char()
+        read_size = chunk_size
+        while True:
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                read_more(read_size)
+                read_size *= 2
+                continue
+            # 元素恰好结束在缓冲区末尾，或数字被截断在小数点、指数之前（"-0." 会先解析为 -0）时，读入更多内容再确认
+            if not eof and (end == len(buffer) or buffer[end] in '.eE'):
+                read_more(read_size)
+                read_size *= 2
+                continue
+            break
+        pos = end
+        yield element
+        separator = next_char()
+        if separator == ']':
+            return
+        if separator != ',':
+            raise json.JSONDecodeError("数组元素之间缺少 ','", buffer, pos)
+        pos += 1
+
+
+def dump_entry(key, value, compact=False):
+    """序列化对象中的一个键值对，缩进格式与 json.dump(obj, indent=2) 的输出一致。"""
+    if compact:
+        return f"{json.dumps(key, ensure_ascii=False)}:{json.dumps(value, ensure_ascii=False, separators=(',', ':'))}"
+    # JSON 字符串中的换行都已转义，格式化产生的换行可以直接替换为更深一级的缩进
+    text = json.dumps(value, indent=2, ensure_ascii=False).replace('\n', '\n  ')
+    return f"\n  {json.dumps(key, ensure_ascii=False)}: {text}"
+
+
+def transform_menu_streaming(input_file_path, output_file_path, compact=False, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    transform_menu_with_unique_keys 的流式版本：逐个解析顶层类别数组，每个扁平化后的子类别确定键后立即写入输出，
+    内存中只保留已使用的键集合，占用不随输入文件增大而增长。输出先写入临时文件，完成后原子替换。
+    解析结果与非流式版本相同；仅在键无法消解（如顶级类别重名）时，非流式版本保留最后一个值，
+    流式版本会写出重复的键（JSON.parse 和 json.load 同样取最后一个值）。
+    compact 为 True 时输出不带缩进和空格的紧凑格式。
+    """
+    output_dir = os.path.dirname(output_file_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    count = 0
+    temp_path = f"{output_file_path}.tmp"
+    try:
+        with open(input_file_path, 'r', encoding='utf-8') as src, open(temp_path, 'w', encoding='utf-8') as out:
+            out.write('{')
+            for key, value in flatten_categories(iter_json_array(src, chunk_size), set()):
+                if count:
+                    out.write(',')
+                out.write(dump_entry(key, value, compact))
+                count += 1
+            out.write('\n}' if count and not compact else '}')
+        os.replace(temp_path, output_file_path)
+    except FileNotFoundError:
+        print(f"错误：输入文件 '{input_file_path}' 未找到。")
+        return
+    except json.JSONDecodeError as e:
+        print(f"错误：文件 '{input_file_path}' 不是有效的JSON格式: {e.msg}")
+        return
+    except IOError as e:
+        print(f"写入文件时发生错误 '{output_file_path}': {e}")
+        return
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    print(f"处理完成！已流式写入 {count} 个类别到 '{output_file_path}'。")
+
+
+def transform_menu_with_unique_keys(input_file_path, output_file_path, compact=False):
+    """
+    将原始菜单JSON文件转换为一个新的、以类别名称为键的JSON对象，并处理重复的键。
+
+    这个函数会：
+    1. 将所有 subCategories 提取到顶层。
+    2. 如果一个子类别的名称与已存在的键冲突，则使用 "父类别名 - 子类别名" 的格式创建新键。
+    3. 从被提取的子类别中删除 'code', 'slug', 'itemCount', 'icon' 字段。
+    4. 对于没有子类别的顶级类别，直接以其 'name' 作为键添加到输出对象中。
+    5. 将结果保存到新的JSON文件中（compact 为 True 时不带缩进）。
+
+    整个文件会被读入内存；输入较大时请使用 transform_menu_streaming。
+
+    :param input_file_path: 输入的JSON文件路径 (e.g., 'raw/index-menu.json')
+    :param output_file_path: 输出的JSON文件路径 (e.g., 'raw/index-full-menu.json')
+    """
+    try:
+        # 确保输入文件所在的目录存在
+        input_dir = os.path.dirname(input_file_path)
+        if input_dir and not os.path.exists(input_dir):
+            print(f"错误：输入目录 '{input_dir}' 不存在。")
+            return
+
+        with open(input_file_path, 'r', encoding='utf-8') as f:
+            original_data = json.load(f)
+    except FileNotFoundError:
+        print(f"错误：输入文件 '{input_file_path}' 未找到。")
+        return
+    except json.JSONDecodeError:
+        print(f"错误：文件 '{input_file_path}' 不是有效的JSON格式。")
+        return
+
+    # 初始化一个空字典来存储最终的JSON对象
+    transformed_data_obj = {}
+    for key, value in flatten_categories(original_data, set()):
+        transformed_data_obj[key] = value
 
     try:
         # 确保输出文件所在的目录存在
@@ -83,7 +205,10 @@ def transform_menu_with_unique_keys(input_file_path, output_file_path):
 
         # 将转换后的对象写入新的JSON文件
         with open(output_file_path, 'w', encoding='utf-8') as f:
-            json.dump(transformed_data_obj, f, indent=2, ensure_ascii=False)
+            if compact:
+                json.dump(transformed_data_obj, f, ensure_ascii=False, separators=(',', ':'))
+            else:
+                json.dump(transformed_data_obj, f, indent=2, ensure_ascii=False)
 
         print(f"处理完成！已成功将结果保存到 '{output_file_path}'。")
 
@@ -92,9 +217,16 @@ def transform_menu_with_unique_keys(input_file_path, output_file_path):
 
 # --- 使用示例 ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="把类别数组转换为以类别名称为键的JSON对象（提取子类别并处理重复的键）。")
     # 定义输入和输出文件路径
-    input_json_path = os.path.join('raw', 'index-menu.json')
-    output_json_path = os.path.join('raw', 'index-full-menu.json')
+    parser.add_argument('--input', default=os.path.join('raw', 'index-menu.json'), help='输入的类别数组JSON。')
+    parser.add_argument('--output', default=os.path.join('raw', 'index-full-menu.json'), help='输出的JSON对象。')
+    parser.add_argument('--stream', action='store_true', help='流式处理：逐个解析和写出类别，内存占用不随输入大小增长。')
+    parser.add_argument('--compact', action='store_true', help='输出不带缩进的紧凑JSON（用于生产构建）。')
+    args = parser.parse_args()
 
     # 运行转换函数
-    transform_menu_with_unique_keys(input_json_path, output_json_path)
\ No newline at end of file
+    if args.stream:
+        transform_menu_streaming(args.input, args.output, compact=args.compact)
+    else:
+        transform_menu_with_unique_keys(args.input, args.output, compact=args.compact)
\ No newline at end of file
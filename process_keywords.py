@@ -0,0 +1,273 @@
+"""
+关键词与菜品的相关度索引：把 SEO 关键词 CSV（raw/olive-garden-menu_keywords_*.csv）与菜单 JSON 关联起来，
+为每个菜品输出按得分排序的关键词列表，供选择页面上展示哪些菜品和关键词时参考。
+
+- 菜名和关键词都用 process_menu.normalize_name 规范化后按单词切分，去掉连接词并把复数还原为单数。
+- 菜品侧建立稀疏的 "单词 -> [(菜品, 权重)]" 倒排索引，权重为单词在菜品中的 IDF，菜品向量预先归一化。
+- 关键词逐行流式读取，每个关键词只沿自己单词的倒排列表累加点积，
+  等价于 "关键词 x 单词" 与 "单词 x 菜品" 两个稀疏矩阵相乘：与所有菜品都不共享单词的组合得分为 0，不需要计算，
+  开销只与非零项数量相关，而不是关键词数 x 菜品数。
+- 相关度为两者的余弦相似度。CSV 先流式读一遍统计每个单词出现在多少个关键词中：不出现在任何菜名里、
+  却出现在超过 GENERIC_KEYWORD_RATIO 的关键词中的词（"olive"、"garden"、"menu"、"price"）是通用词，不参与计算；
+  其他不出现在菜名里的词（"mushroom"、"garlic"）按 UNKNOWN_TOKEN_WEIGHT 计入关键词向量长度，降低相关度。
+- 排序得分为 相关度 x log(1 + 月搜索量)。每个菜品只保留得分最高的 TOP_K 个关键词（有界堆），CSV 不会整体载入内存。
+
+用法: python process_keywords.py [--keywords raw/olive-garden-menu_keywords_2025-08-29.csv]
+                                 [--menu raw/pages/index-full-menu.json] [--top 20] [--min-relevance 0.5]
+"""
+import argparse
+import collections
+import csv
+import heapq
+import json
+import math
+import os
+import time
+
+from pipeline_io import write_json_atomic
+from process_menu import normalize_name
+
+DEFAULT_KEYWORDS = os.path.join('raw', 'olive-garden-menu_keywords_2025-08-29.csv')
+DEFAULT_MENUS = (os.path.join('raw', 'pages', 'index-full-menu.json'),)
+DEFAULT_OUTPUT = os.path.join('raw', 'keywords-index.json')
+# 每个菜品保留的关键词数量，以及进入排名的最低相关度（余弦相似度，0~1）
+TOP_K = 20
+MIN_RELEVANCE = 0.5
+# 出现在超过该比例的关键词中、且不出现在任何菜名里的单词视为通用词，不参与相关度计算
+GENERIC_KEYWORD_RATIO = 0.05
+# 其他不出现在任何菜名里的单词在关键词向量中的权重（约等于出现在一半菜品中的单词的 IDF）
+UNKNOWN_TOKEN_WEIGHT = 1.0
+# 输出中相关度和得分保留的小数位数
+SCORE_DECIMALS = 4
+# 产物格式变化时递增
+KEYWORDS_VERSION = 1
+# 不参与匹配的连接词（菜名中的 "with"、"of"、"includes" 等不能说明两者相关）
+STOP_TOKENS = frozenset({'a', 'an', 'and', 'or', 'of', 'with', 'the', 'for', 'to', 'in', 'on', 'our', 'includes'})
+# CSV 的列名
+KEYWORD_FIELDS = {'keyword': 'Keyword', 'volume': 'Volume', 'difficulty': 'Keyword Difficulty',
+                  'cpc': 'CPC (USD)', 'intent': 'Intent'}
+
+
+def singular(token):
+    """粗略的复数还原：breadsticks -> breadstick，potatoes -> potato；glass、citrus 之类保持不变。"""
+    if len(token) <= 3 or not token.endswith('s') or token.endswith(('ss', 'us', 'is')):
+        return token
+    if token.endswith('oes'):
+        return token[:-2]
+    return token[:-1]
+
+
+def tokenize(text):
+    """规范化名称中的单词集合（去掉连接词，复数还原为单数）。"""
+    return {singular(token) for token in normalize_name(text).split() if token not in STOP_TOKENS}
+
+
+def _number(value, cast=float):
+    try:
+        return cast(str(value).replace(',', '').strip())
+    except ValueError:
+        return None
+
+
+def iter_menu_dishes(path):
+    """逐个返回菜单 JSON（{分类: {'items': [...]}}）中的 (分类名, 菜品)。"""
+    with open(path, 'r', encoding='utf-8') as f:
+        menu = json.load(f)
+    for category_name, category in menu.items():
+        if not isinstance(category, dict):
+            continue
+        for item in category.get('items') or ():
+            if isinstance(item, dict):
+                yield category_name, item
+
+
+def load_dishes(menu_paths):
+    """
+    读取菜单中的菜品，按规范化名称合并出现在多个分类或多个菜单中的同一菜品。
+    返回菜品列表，每项包含 key、title、tokens、categories 和 menus。
+    """
+    dishes, by_key = [], {}
+    for path in menu_paths:
+        for category_name, item in iter_menu_dishes(path):
+            title = item.get('title') or item.get('name')
+            key = normalize_name(title)
+            tokens = tokenize(title)
+            if not key or not tokens:
+                continue
+            dish = by_key.get(key)
+            if dish is None:
+                dish = by_key[key] = {'key': key, 'title': title.strip(), 'tokens': tokens,
+                                      'categories': [], 'menus': []}
+                dishes.append(dish)
+            if category_name not in dish['categories']:
+                dish['categories'].append(category_name)
+            if path not in dish['menus']:
+                dish['menus'].append(path)
+    return dishes
+
+
+class DishIndex:
+    """
+    菜品的稀疏倒排索引。idf[单词] = log(1 + 菜品数 / 含该单词的菜品数)，
+    postings[单词] 为 (菜品编号, idf / 菜品向量长度) 列表，菜品向量已归一化，打分时只需再除以关键词向量长度。
+    """
+
+    def __init__(self, dishes):
+        self.dishes = dishes
+        document_frequency = collections.Counter(token for dish in dishes for token in dish['tokens'])
+        count = len(dishes)
+        self.idf = {token: math.log(1 + count / df) for token, df in document_frequency.items()}
+        self.postings = collections.defaultdict(list)
+        for i, dish in enumerate(dishes):
+            norm = math.sqrt(sum(self.idf[token] ** 2 for token in dish['tokens']))
+            for token in dish['tokens']:
+                self.postings[token].append((i, self.idf[token] / norm))
+
+    def __len__(self):
+        return len(self.dishes)
+
+    def score(self, tokens):
+        """
+        返回 {菜品编号: 余弦相似度}，只包含与关键词共享单词的菜品。
+        不在任何菜名中的单词以 UNKNOWN_TOKEN_WEIGHT 计入关键词向量长度（通用词应由调用方事先去掉）。
+        """
+        weights = [(token, self.idf[token]) for token in tokens if token in self.idf]
+        if not weights:
+            return {}
+        unknown = len(tokens) - len(weights)
+        norm = math.sqrt(sum(weight * weight for _, weight in weights) + unknown * UNKNOWN_TOKEN_WEIGHT ** 2)
+        scores = collections.defaultdict(float)
+        for token, weight in weights:
+            weight /= norm
+            for dish, dish_weight in self.postings[token]:
+                scores[dish] += weight * dish_weight
+        return scores
+
+
+def iter_keywords(path):
+    """流式读取关键词 CSV，逐行返回 keyword、volume、difficulty、cpc 和 intent；跳过空关键词。"""
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        for row in csv.DictReader(f):
+            keyword = (row.get(KEYWORD_FIELDS['keyword']) or '').strip()
+            if not keyword:
+                continue
+            yield {
+                'keyword': keyword,
+                'volume': _number(row.get(KEYWORD_FIELDS['volume']), int) or 0,
+                'difficulty': _number(row.get(KEYWORD_FIELDS['difficulty']), int),
+                'cpc': _number(row.get(KEYWORD_FIELDS['cpc'])),
+                'intent': (row.get(KEYWORD_FIELDS['intent']) or '').strip(),
+            }
+
+
+def generic_tokens(index, rows, ratio=GENERIC_KEYWORD_RATIO):
+    """不出现在任何菜名里、且出现在超过 ratio 比例的关键词中的单词。"""
+    counts = collections.Counter()
+    total = 0
+    for row in rows:
+        total += 1
+        counts.update(tokenize(row['keyword']))
+    return {token for token, count in counts.items() if count > total * ratio and token not in index.idf}
+
+
+def rank_keywords(index, rows, top_k=TOP_K, min_relevance=MIN_RELEVANCE, generic=frozenset()):
+    """
+    对所有关键词与所有菜品打分，返回 (每个菜品的 [(得分, -序号, 相关度, 关键词)] 最小堆, 统计)。
+    generic 中的通用词不参与计算；同一规范化形式的关键词只计算一次相关度。
+    """
+    heaps = [[] for _ in range(len(index))]
+    cache = {}
+    stats = {'keywords': 0, 'matched': 0, 'pairs': 0, 'ranked': 0}
+    for row in rows:
+        sequence = stats['keywords']
+        stats['keywords'] += 1
+        key = normalize_name(row['keyword'])
+        scores = cache.get(key)
+        if scores is None:
+            scores = cache[key] = index.score(tokenize(key) - generic)
+        stats['pairs'] += len(scores)
+        weight = math.log1p(max(row['volume'], 0))
+        matched = False
+        for dish, relevance in scores.items():
+            if relevance < min_relevance:
+                continue
+            matched = True
+            entry = (relevance * weight, -sequence, relevance, row)
+            heap = heaps[dish]
+            if len(heap) < top_k:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+        stats['matched'] += matched
+    stats['ranked'] = sum(len(heap) for heap in heaps)
+    return heaps, stats
+
+
+def build_keyword_index(index, heaps):
+    """把每个菜品的堆整理为按得分从高到低排序的关键词列表。"""
+    dishes = []
+    for dish, heap in zip(index.dishes, heaps):
+        keywords = []
+        for score, _, relevance, row in sorted(heap, reverse=True):
+            keywords.append({**row, 'relevance': round(relevance, SCORE_DECIMALS),
+                             'score': round(score, SCORE_DECIMALS)})
+        dishes.append({
+            'title': dish['title'],
+            'key': dish['key'],
+            'categories': dish['categories'],
+            'menus': [path.replace(os.sep, '/') for path in dish['menus']],
+            'total_volume': sum(keyword['volume'] for keyword in keywords),
+            'keywords': keywords,
+        })
+    return dishes
+
+
+def process_keywords(keywords_path, menu_paths, output_path, top_k=TOP_K, min_relevance=MIN_RELEVANCE):
+    start = time.perf_counter()
+    index = DishIndex(load_dishes(menu_paths))
+    generic = generic_tokens(index, iter_keywords(keywords_path))
+    heaps, stats = rank_keywords(index, iter_keywords(keywords_path), top_k, min_relevance, generic)
+    dishes = build_keyword_index(index, heaps)
+    elapsed = time.perf_counter() - start
+    stats.update({'dishes': len(dishes), 'tokens': len(index.idf),
+                  'generic_tokens': sorted(generic),
+                  'cross_product': stats['keywords'] * len(dishes), 'seconds': round(elapsed, 3)})
+    result = {
+        'version': KEYWORDS_VERSION,
+        'sources': {'keywords': keywords_path.replace(os.sep, '/'),
+                    'menus': [path.replace(os.sep, '/') for path in menu_paths]},
+        'top_k': top_k,
+        'min_relevance': min_relevance,
+        'stats': stats,
+        'dishes': dishes,
+    }
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    write_json_atomic(output_path, json.dumps(result, indent=2, ensure_ascii=False))
+
+    covered = sum(1 for dish in dishes if dish['keywords'])
+    print(f"读取 {stats['keywords']} 个关键词、{len(dishes)} 个菜品（{stats['tokens']} 个不同单词）")
+    print(f"全部 {stats['cross_product']} 个组合中只有 {stats['pairs']} 个共享单词需要计算，"
+          f"耗时 {elapsed:.2f}s")
+    print(f"与至少一个菜品相关的关键词: {stats['matched']} 个；有关键词的菜品: {covered}/{len(dishes)} 个")
+    print(f"✅ 按菜品排序的关键词已写入 {output_path}")
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="为菜单中的每个菜品按相关度和搜索量排序 SEO 关键词，输出按菜品分组的关键词索引。",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--keywords', default=DEFAULT_KEYWORDS, help='关键词 CSV（Keyword、Volume 等列）。')
+    parser.add_argument('--menu', action='append', default=None,
+                        help=f"菜单 JSON，可重复指定。默认 {', '.join(DEFAULT_MENUS)}。")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='按菜品分组的关键词索引的输出路径。')
+    parser.add_argument('--top', type=int, default=TOP_K, help='每个菜品保留的关键词数量。')
+    parser.add_argument('--min-relevance', type=float, default=MIN_RELEVANCE,
+                        help='进入排名的最低相关度（关键词与菜名的余弦相似度，0~1）。')
+    args = parser.parse_args()
+
+    process_keywords(args.keywords, args.menu or list(DEFAULT_MENUS), args.output, top_k=args.top,
+                     min_relevance=args.min_relevance)
@@ -1,6 +1,8 @@
+import argparse
 import json
 import os
-import re
+
+from menu_matcher import MenuIndex, DEFAULT_THRESHOLD, DEFAULT_MARGIN, canonical_name
 
 # 步骤1: 建立精确的“翻译词典” (JSON Key 映射)
 # ==============================================================================
@@ -33,42 +35,65 @@ DISH_MAP = {
 # ==============================================================================
 
 def normalize_name(name):
-    """一个简单的清理函数，用于处理常规的名称匹配。"""
-    if not isinstance(name, str): return ""
-    # 移除括号及其内容，转为小写，去除首尾空格
-    normalized = re.sub(r'\(.*?\)', '', name).lower().strip()
-    return normalized
-
-def create_updated_menu(menu_file_path, order_file_path):
-    """使用精确的、基于Map的映射策略来合并菜单数据。"""
-    try:
-        with open(menu_file_path, 'r', encoding='utf-8') as f:
-            menu_data = json.load(f)
-        with open(order_file_path, 'r', encoding='utf-8') as f:
-            order_data = json.load(f)
-    except FileNotFoundError as e:
-        print(f"错误：找不到文件 {e}。")
-        return None
-
-    # --- 步骤2: 将 hawai-menu.json 的数据构建成一个易于查找的结构 ---
-    calorie_lookup = {}
-    print("--- 正在从 hawai-menu.json 构建查找表 ---")
+    """名称匹配用的清理函数，保留给外部调用者；规则与菜名索引相同，见 menu_matcher.canonical_name。"""
+    return canonical_name(name)
+
+def print_match_report(match_log, threshold):
+    """输出模糊匹配的得分，以及有歧义的匹配和接近阈值但未被接受的候选，供人工确认或补充到 DISH_MAP。"""
+    # 同一分类中重复出现的菜品只报告一次
+    match_log = list({(entry['category'], entry['query']): entry for entry in match_log}.values())
+    fuzzy = [entry for entry in match_log if entry['method'] == 'fuzzy']
+    ambiguous = [entry for entry in match_log if entry['ambiguous']]
+    near_misses = [entry for entry in match_log
+                   if entry['method'] is None and entry['candidates'] and entry['score'] >= threshold - 0.2]
+    if fuzzy:
+        print(f"\n--- 模糊匹配报告 (阈值 {threshold}) ---")
+        for entry in sorted(fuzzy, key=lambda e: e['score']):
+            print(f"  {entry['score']:.2f}  '{entry['query']}' -> '{entry['title']}' (分类 '{entry['category']}')")
+    if ambiguous:
+        print("\n--- 有歧义的匹配（最高分与次高分接近，请确认或加入 DISH_MAP） ---")
+        for entry in ambiguous:
+            options = ', '.join(f"'{title}' {score:.2f}" for title, score in entry['candidates'])
+            status = '' if entry.get('accepted') else '，未采用'
+            print(f"  - '{entry['query']}' (分类 '{entry['category']}'{status}): {options}")
+    if near_misses:
+        print("\n--- 未达到阈值的候选（如确认为同一菜品，请加入 DISH_MAP） ---")
+        for entry in sorted(near_misses, key=lambda e: -e['score']):
+            title, score = entry['candidates'][0]
+            print(f"  {score:.2f}  '{entry['query']}' -> '{title}' (分类 '{entry['category']}')")
+
+
+def compile_menu(menu_data, threshold=DEFAULT_THRESHOLD, margin=DEFAULT_MARGIN):
+    """
+    把源菜单构建成易于查找的结构：{源分类名: (卡路里查找表, MenuIndex)}。
+    每个源分类只建立一次匹配索引，多个订单分类（或多个地区的订单）可以共用。
+    """
+    compiled = {}
     for category_name, content in menu_data.items():
         if 'items' in content:
-            calorie_lookup[category_name] = {}
+            calorie_lookup = {}
             for item in content['items']:
                 title, calories = item.get('title'), item.get('calories')
                 if title and calories:
-                    # 使用原始名称作为键，同时存储一个清理过的名称用于常规匹配
-                    calorie_lookup[category_name][title] = {
-                        'calories': calories,
-                        'normalized': normalize_name(title)
-                    }
-    print("--- 构建完成 ---\n")
-
-    # --- 步骤3: 遍历订单，使用Map进行精确查找 ---
+                    # 使用原始名称作为键
+                    calorie_lookup[title] = {'calories': calories}
+            compiled[category_name] = (calorie_lookup, MenuIndex(calorie_lookup, threshold, margin))
+    return compiled
+
+
+def merge_menus(compiled_menu, order_data, category_map=None, dish_map=None, accept_ambiguous=False):
+    """
+    按订单遍历菜品并从已编译的源菜单中查找卡路里，不输出任何内容。
+    category_map / dish_map 默认为本文件中夏威夷菜单的 CATEGORY_MAP / DISH_MAP。
+    有歧义的匹配（多个候选得分相同或接近）默认不采用，卡路里保持 "N/A" 并记入差异记录；
+    accept_ambiguous 为真时采用得分最高的候选。
+    返回 (合并后的菜单, 差异记录列表, 每个菜品的匹配结果列表)。
+    """
+    category_map = CATEGORY_MAP if category_map is None else category_map
+    dish_map = DISH_MAP if dish_map is None else dish_map
     new_menu = {}
     not_found_log = []
+    match_log = []
 
     for order_category in order_data:
         order_cat_name = order_category.get("name")
@@ -76,14 +101,14 @@ def create_updated_menu(menu_file_path, order_file_path):
 
         new_menu[order_cat_name] = {"items": []}
 
-        # 策略1: 使用 CATEGORY_MAP 找到对应的源分类名
-        source_cat_name = CATEGORY_MAP.get(order_cat_name)
+        # 策略1: 使用 category_map 找到对应的源分类名
+        source_cat_name = category_map.get(order_cat_name)
 
         if not source_cat_name:
             not_found_log.append(f"[分类未在Map中定义]: '{order_cat_name}'")
             continue # 如果分类不在Map中，跳过整个分类
 
-        source_dishes = calorie_lookup.get(source_cat_name)
+        source_dishes, match_index = compiled_menu.get(source_cat_name, (None, None))
         if not source_dishes:
             not_found_log.append(f"[分类未在源文件中找到]: '{source_cat_name}'")
             continue
@@ -94,23 +119,32 @@ def create_updated_menu(menu_file_path, order_file_path):
 
             calories = "N/A"
             found = False
+            ambiguous = False
 
-            # 策略2: 优先使用 DISH_MAP 中的特例
-            special_dish_name = DISH_MAP.get(order_cat_name, {}).get(item_name)
+            # 策略2: 优先使用 dish_map 中的特例
+            special_dish_name = dish_map.get(order_cat_name, {}).get(item_name)
             if special_dish_name and special_dish_name in source_dishes:
                 calories = source_dishes[special_dish_name]['calories']
                 found = True
+                match_log.append({'category': order_cat_name, 'query': item_name, 'title': special_dish_name,
+                                  'score': 1.0, 'method': 'dish_map', 'candidates': [], 'ambiguous': False,
+                                  'accepted': True})
 
-            # 策略3: 如果不是特例，进行常规的标准化名称匹配
-            if not found:
-                norm_item_name = normalize_name(item_name)
-                for dish_data in source_dishes.values():
-                    if dish_data['normalized'] == norm_item_name:
-                        calories = dish_data['calories']
-                        found = True
-                        break # 找到后立即停止搜索
-
+            # 策略3: 如果不是特例，通过索引进行标准化名称匹配，找不到时再进行模糊匹配
             if not found:
+                match = match_index.lookup(item_name)
+                accepted = match['title'] is not None and (accept_ambiguous or not match['ambiguous'])
+                match_log.append(dict(match, category=order_cat_name, accepted=accepted))
+                if accepted:
+                    calories = source_dishes[match['title']]['calories']
+                    found = True
+                elif match['title'] is not None:
+                    not_found_log.append(f"  - [菜品匹配有歧义，未采用]: '{item_name}' (在分类 '{order_cat_name}' -> "
+                                         f"'{source_cat_name}' 中，候选: "
+                                         f"{', '.join(repr(title) for title, _ in match['candidates'])})")
+                    ambiguous = True
+
+            if not found and not ambiguous:
                 not_found_log.append(f"  - [菜品未匹配]: '{item_name}' (在分类 '{order_cat_name}' -> '{source_cat_name}' 中)")
 
             new_item = {
@@ -122,6 +156,34 @@ def create_updated_menu(menu_file_path, order_file_path):
             }
             new_menu[order_cat_name]["items"].append(new_item)
 
+    return new_menu, not_found_log, match_log
+
+
+def create_updated_menu(menu_file_path, order_file_path, threshold=DEFAULT_THRESHOLD, margin=DEFAULT_MARGIN,
+                        match_report_path=None, accept_ambiguous=False):
+    """
+    使用基于Map的映射策略合并菜单数据：分类通过 CATEGORY_MAP 对应，菜品依次尝试 DISH_MAP 特例、
+    标准化名称精确匹配和 n-gram 模糊匹配（得分不低于 threshold 才接受，见 menu_matcher）。
+    有歧义的匹配只报告、不采用，除非 accept_ambiguous 为真。
+    提供 match_report_path 时把每个菜品的匹配方式、得分和候选写入该 JSON 文件。
+    """
+    try:
+        with open(menu_file_path, 'r', encoding='utf-8') as f:
+            menu_data = json.load(f)
+        with open(order_file_path, 'r', encoding='utf-8') as f:
+            order_data = json.load(f)
+    except FileNotFoundError as e:
+        print(f"错误：找不到文件 {e}。")
+        return None
+
+    # --- 步骤2: 将 hawai-menu.json 的数据构建成一个易于查找的结构 ---
+    print("--- 正在从 hawai-menu.json 构建查找表 ---")
+    compiled_menu = compile_menu(menu_data, threshold, margin)
+    print("--- 构建完成 ---\n")
+
+    # --- 步骤3: 遍历订单，使用Map进行查找 ---
+    new_menu, not_found_log, match_log = merge_menus(compiled_menu, order_data, accept_ambiguous=accept_ambiguous)
+
     # --- 步骤4: 报告最终的数据差异 ---
     if not_found_log:
         print("\n--- 最终数据差异报告：以下项目在源文件(hawai-menu.json)中确实不存在 ---")
@@ -129,21 +191,38 @@ def create_updated_menu(menu_file_path, order_file_path):
             print(log_entry)
         print("-----------------------------------------------------------------------------------\n")
 
+    print_match_report(match_log, threshold)
+    if match_report_path:
+        with open(match_report_path, 'w', encoding='utf-8') as f:
+            json.dump({'threshold': threshold, 'margin': margin, 'accept_ambiguous': accept_ambiguous,
+                       'matches': match_log}, f, indent=2, ensure_ascii=False)
+        print(f"\n匹配报告已写入 {match_report_path}")
+
     return json.dumps(new_menu, indent=2, ensure_ascii=False)
 
 
 if __name__ == "__main__":
     raw_folder = 'raw'
-    menu_file = os.path.join(raw_folder, 'hawai-menu.json')
-    order_file = os.path.join(raw_folder, 'hawai-order.json')
-
-    new_menu_json = create_updated_menu(menu_file, order_file)
+    parser = argparse.ArgumentParser(description="按分类合并菜单 (menu) 和订单 (order) 数据，为订单中的菜品补充卡路里。")
+    parser.add_argument('--menu', default=os.path.join(raw_folder, 'hawai-menu.json'), help='源菜单JSON（提供卡路里）。')
+    parser.add_argument('--order', default=os.path.join(raw_folder, 'hawai-order.json'), help='订单菜单JSON。')
+    parser.add_argument('--output', default=os.path.join(raw_folder, 'hawai-full-menu.json'), help='合并结果的输出路径。')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='模糊匹配的最低得分 (0~1)，1 表示只接受标准化后完全相同的名称。')
+    parser.add_argument('--margin', type=float, default=DEFAULT_MARGIN, help='最高分与次高分相差小于该值时标记为有歧义。')
+    parser.add_argument('--match-report', default=None, help='把每个菜品的匹配方式、得分和候选写入该JSON文件。')
+    parser.add_argument('--accept-ambiguous', action='store_true',
+                        help='采用有歧义匹配中得分最高的候选（默认只报告，卡路里保持 N/A）。')
+    args = parser.parse_args()
+
+    new_menu_json = create_updated_menu(args.menu, args.order, threshold=args.threshold, margin=args.margin,
+                                        match_report_path=args.match_report, accept_ambiguous=args.accept_ambiguous)
 
     if new_menu_json:
         print("--- 更新后的菜单JSON ---")
 #         print(new_menu_json)
 
-        output_filename = 'raw/hawai-full-menu.json'
+        output_filename = args.output
         with open(output_filename, 'w', encoding='utf-8') as f:
             f.write(new_menu_json)
         print(f"\n✅ 您的菜单合并任务已成功完成！结果已保存至文件: {output_filename}")
\ No newline at end of file
@@ -0,0 +1,313 @@
+"""
+门店位置的空间索引：读取 raw/maps_position.json（扁平的门店记录数组），清洗并去重后
+预先计算按州/城市的分组和每个门店的 k 个最近邻，并生成供 Worker 查询的按 geohash 排序的紧凑产物。
+
+- 坐标保存在 array('d') 列存储中，门店文字字段为并列的列表，下标即门店编号。
+- 最近邻使用单位球面三维坐标上的 KD 树：三维欧氏距离（弦长）与大圆距离单调对应，
+  因此按弦长找到的 k 个最近邻就是按 haversine 距离的最近邻，查询只访问少数节点。
+- 门店按 geohash 排序输出，buckets 给出每个 BUCKET_PRECISION 位前缀在数组中的 [起始, 结束) 范围。
+  Worker 查询时计算查询点的前缀及其周围 8 个格子，直接取对应范围（或在 geohash 数组上二分查找），
+  只需对这些候选计算距离，不必扫描全部门店。
+
+用法: python process_positions.py [--input raw/maps_position.json] [--k 5] [--query 21.3,-157.8]
+"""
+import argparse
+import heapq
+import json
+import math
+import os
+from array import array
+
+from pipeline_io import write_json_atomic
+from process_index_menu import iter_json_array
+
+EARTH_RADIUS_MILES = 3958.8
+DEFAULT_K = 5
+# 产物中 geohash 的位数（7 位约 150 米）和分桶使用的前缀位数（3 位约 156 公里）
+GEOHASH_PRECISION = 7
+BUCKET_PRECISION = 3
+# 输出坐标和距离保留的小数位数（5 位小数约 1 米）
+COORD_DECIMALS = 5
+DISTANCE_DECIMALS = 2
+# 产物格式变化时递增
+POSITIONS_VERSION = 1
+TEXT_FIELDS = ('name', 'city', 'state', 'country', 'address')
+SOURCE_FIELDS = {'name': 'Name', 'city': 'City', 'state': 'State', 'country': 'Country', 'address': 'CompleteAddress'}
+
+_GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    """标准 geohash 编码：经度和纬度交替二分，每 5 位输出一个 base32 字符。"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        coord, bounds = (lon, lon_range) if even else (lat, lat_range)
+        mid = (bounds[0] + bounds[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            bounds[0] = mid
+        else:
+            bounds[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def unit_vector(lat, lon):
+    phi, lam = math.radians(lat), math.radians(lon)
+    return math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi)
+
+
+def chord_to_miles(chord):
+    """单位球面上的弦长换算为大圆距离（英里）。"""
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, chord / 2))
+
+
+def _text(value):
+    # 源数据中缺失的文字字段是 NaN
+    return value.strip() if isinstance(value, str) else ''
+
+
+def valid_coordinate(lat, lon):
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v) for v in (lat, lon)):
+        return False
+    # (0, 0) 是缺失坐标的占位值，不是真实门店
+    return -90 <= lat <= 90 and -180 <= lon <= 180 and (lat, lon) != (0, 0)
+
+
+class Positions:
+    """门店的列存储：lat / lon 为 array('d')，文字字段为并列的列表，下标即门店编号。"""
+
+    def __init__(self):
+        self.lat = array('d')
+        self.lon = array('d')
+        self.columns = {field: [] for field in TEXT_FIELDS}
+
+    def __len__(self):
+        return len(self.lat)
+
+    def append(self, lat, lon, **fields):
+        self.lat.append(lat)
+        self.lon.append(lon)
+        for field in TEXT_FIELDS:
+            self.columns[field].append(fields.get(field, ''))
+
+    def record(self, i):
+        return {'lat': self.lat[i], 'lon': self.lon[i], **{field: self.columns[field][i] for field in TEXT_FIELDS}}
+
+    def reordered(self, order):
+        """按 order 中的下标顺序返回新的 Positions。"""
+        result = Positions()
+        for i in order:
+            result.append(self.lat[i], self.lon[i], **{field: self.columns[field][i] for field in TEXT_FIELDS})
+        return result
+
+
+def load_positions(path):
+    """
+    逐条读取门店记录，跳过坐标无效的记录，并按 (坐标, 地址) 合并完全重复的记录。
+    返回 (Positions, 统计字典)。
+    """
+    positions = Positions()
+    seen = set()
+    stats = {'records': 0, 'invalid': 0, 'duplicates': 0}
+    with open(path, 'r', encoding='utf-8') as f:
+        for record in iter_json_array(f):
+            stats['records'] += 1
+            lat, lon = record.get('Original_Latitude'), record.get('Original_Longitude')
+            if not valid_coordinate(lat, lon):
+                stats['invalid'] += 1
+                continue
+            fields = {field: _text(record.get(key)) for field, key in SOURCE_FIELDS.items()}
+            key = (round(lat, COORD_DECIMALS), round(lon, COORD_DECIMALS), fields['address'].lower())
+            if key in seen:
+                stats['duplicates'] += 1
+                continue
+            seen.add(key)
+            positions.append(float(lat), float(lon), **fields)
+    stats['locations'] = len(positions)
+    return positions, stats
+
+
+class KDTree:
+    """
+    三维点集上的 KD 树。树以隐式方式保存在下标数组中：区间 [lo, hi) 的中点即该子树的根，
+    左右子树分别是 [lo, mid) 和 [mid + 1, hi)，每个根的切分轴保存在 axes 中。
+    """
+
+    def __init__(self, points):
+        self.points = points
+        self.index = array('i', range(len(points)))
+        self.axes = array('b', bytes(len(points)))
+        self._build(0, len(points))
+
+    def _build(self, lo, hi):
+        stack = [(lo, hi)]
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= 1:
+                continue
+            ids = self.index[lo:hi]
+            # 沿跨度最大的轴切分
+            spreads = [max(self.points[i][axis] for i in ids) - min(self.points[i][axis] for i in ids)
+                       for axis in range(3)]
+            axis = spreads.index(max(spreads))
+            ids = sorted(ids, key=lambda i: self.points[i][axis])
+            self.index[lo:hi] = array('i', ids)
+            mid = (lo + hi) // 2
+            self.axes[mid] = axis
+            stack.append((lo, mid))
+            stack.append((mid + 1, hi))
+
+    def query(self, point, k, exclude=None):
+        """返回距离 point 最近的 k 个点 [(弦长, 下标), ...]，按距离升序；exclude 为要排除的下标。"""
+        heap = []  # 最大堆：(-距离平方, 下标)
+
+        def visit(lo, hi):
+            if lo >= hi:
+                return
+            mid = (lo + hi) // 2
+            i = self.index[mid]
+            candidate = self.points[i]
+            if i != exclude:
+                d2 = sum((candidate[axis] - point[axis]) ** 2 for axis in range(3))
+                if len(heap) < k:
+                    heapq.heappush(heap, (-d2, i))
+                elif d2 < -heap[0][0]:
+                    heapq.heapreplace(heap, (-d2, i))
+            if hi - lo == 1:
+                return
+            axis = self.axes[mid]
+            diff = point[axis] - candidate[axis]
+            near, far = ((mid + 1, hi), (lo, mid)) if diff >= 0 else ((lo, mid), (mid + 1, hi))
+            visit(*near)
+            # 另一侧只有在切分平面比当前第 k 近的点更近时才可能有更近的点
+            if len(heap) < k or diff * diff < -heap[0][0]:
+                visit(*far)
+
+        visit(0, len(self.points))
+        return sorted((math.sqrt(-d2), i) for d2, i in heap)
+
+
+def build_tree(positions):
+    return KDTree([unit_vector(positions.lat[i], positions.lon[i]) for i in range(len(positions))])
+
+
+def nearest(tree, lat, lon, k=DEFAULT_K, exclude=None):
+    """返回距离 (lat, lon) 最近的 k 个门店 [(下标, 英里), ...]。"""
+    return [(i, chord_to_miles(chord)) for chord, i in tree.query(unit_vector(lat, lon), k, exclude)]
+
+
+def group_by_region(positions):
+    """按州、城市分组：{国家: {州: {'count': n, 'cities': {城市: [门店编号, ...]}}}}，键按字母排序。"""
+    groups = {}
+    for i in range(len(positions)):
+        country = positions.columns['country'][i] or 'US'
+        state = groups.setdefault(country, {}).setdefault(positions.columns['state'][i], {'count': 0, 'cities': {}})
+        state['count'] += 1
+        state['cities'].setdefault(positions.columns['city'][i], []).append(i)
+    return {country: {state: {'count': entry['count'], 'cities': dict(sorted(entry['cities'].items()))}
+                      for state, entry in sorted(states.items())}
+            for country, states in sorted(groups.items())}
+
+
+def bucket_ranges(geohashes, precision=BUCKET_PRECISION):
+    """已排序的 geohash 列表中每个前缀的 [起始, 结束) 下标范围。"""
+    buckets = {}
+    for i, geohash in enumerate(geohashes):
+        prefix = geohash[:precision]
+        if prefix in buckets:
+            buckets[prefix][1] = i + 1
+        else:
+            buckets[prefix] = [i, i + 1]
+    return buckets
+
+
+def build_position_index(positions, k=DEFAULT_K):
+    """
+    按 geohash 对门店排序后计算最近邻和分组。返回 (排序后的 Positions, 完整索引, 紧凑产物)，
+    索引和产物中的门店编号都是排序后的下标。
+    """
+    geohashes = [geohash_encode(positions.lat[i], positions.lon[i]) for i in range(len(positions))]
+    order = sorted(range(len(positions)), key=lambda i: (geohashes[i], positions.columns['address'][i]))
+    positions = positions.reordered(order)
+    geohashes = [geohashes[i] for i in order]
+
+    tree = build_tree(positions)
+    k = min(k, max(len(positions) - 1, 0))
+    neighbors = [nearest(tree, positions.lat[i], positions.lon[i], k, exclude=i) for i in range(len(positions))]
+
+    locations = []
+    for i in range(len(positions)):
+        location = positions.record(i)
+        location.update(id=i, lat=round(location['lat'], COORD_DECIMALS), lon=round(location['lon'], COORD_DECIMALS),
+                        geohash=geohashes[i],
+                        neighbors=[{'id': j, 'miles': round(miles, DISTANCE_DECIMALS)} for j, miles in neighbors[i]])
+        locations.append(location)
+
+    index = {
+        'version': POSITIONS_VERSION,
+        'count': len(positions),
+        'k': k,
+        'regions': group_by_region(positions),
+        'locations': locations,
+    }
+    artifact = {
+        'version': POSITIONS_VERSION,
+        'precision': GEOHASH_PRECISION,
+        'bucketPrecision': BUCKET_PRECISION,
+        'geohash': geohashes,
+        'lat': [location['lat'] for location in locations],
+        'lon': [location['lon'] for location in locations],
+        **{field: positions.columns[field] for field in TEXT_FIELDS},
+        'neighbors': [[j for j, _ in entry] for entry in neighbors],
+        'buckets': bucket_ranges(geohashes),
+    }
+    return positions, index, artifact
+
+
+def process_positions(input_path, index_path, artifact_path, k=DEFAULT_K):
+    positions, stats = load_positions(input_path)
+    positions, index, artifact = build_position_index(positions, k)
+    index['stats'] = stats
+    for path, text in ((index_path, json.dumps(index, indent=2, ensure_ascii=False)),
+                       (artifact_path, json.dumps(artifact, ensure_ascii=False, separators=(',', ':')))):
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        write_json_atomic(path, text)
+    states = sum(len(states) for states in index['regions'].values())
+    print(f"读取 {stats['records']} 条记录：有效门店 {stats['locations']} 家，"
+          f"跳过无效坐标 {stats['invalid']} 条，合并重复记录 {stats['duplicates']} 条")
+    print(f"分组: {len(index['regions'])} 个国家，{states} 个州/省；每家门店预先计算 {index['k']} 个最近邻")
+    print(f"✅ 索引已写入 {index_path}，Worker 查询产物已写入 {artifact_path} "
+          f"({os.path.getsize(artifact_path) / 1024:.1f}KB，{len(artifact['buckets'])} 个 geohash 分桶)")
+    return positions, index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="为门店位置建立空间索引：按州/城市分组、预先计算最近邻，并生成按 geohash 分桶的查询产物。",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--input', default=os.path.join('raw', 'maps_position.json'), help='门店记录数组JSON。')
+    parser.add_argument('--output', default=os.path.join('raw', 'positions-index.json'),
+                        help='完整索引（门店、分组和最近邻）的输出路径。')
+    parser.add_argument('--artifact', default=os.path.join('raw', 'positions-geo.json'),
+                        help='供 Worker 查询的紧凑产物的输出路径。')
+    parser.add_argument('--k', type=int, default=DEFAULT_K, help='每家门店预先计算的最近邻数量。')
+    parser.add_argument('--query', default=None, metavar='LAT,LON', help='生成索引后输出距离该坐标最近的 k 家门店。')
+    args = parser.parse_args()
+
+    positions, index = process_positions(args.input, args.output, args.artifact, k=args.k)
+    if args.query:
+        lat, lon = (float(value) for value in args.query.split(','))
+        print(f"\n--- 距离 ({lat}, {lon}) 最近的 {args.k} 家门店 ---")
+        locations = index['locations']
+        for i, miles in nearest(build_tree(positions), lat, lon, args.k):
+            print(f"  {miles:8.2f} 英里  {locations[i]['address']}")
@@ -0,0 +1,283 @@
+"""
+多地区菜单合并：每个地区一个配置文件（默认 regions/*.json），指定源菜单、订单菜单、输出路径，
+以及该地区自己的分类映射 (category_map) 和菜品特例 (dish_map)，合并逻辑与 process_menu 相同。
+
+- 各地区在多个工作进程中并行合并；同一进程内引用同一份源菜单的地区共用编译好的查找结构。
+- 每个地区的输入文件内容、映射配置和合并逻辑版本组成一个指纹，与上次运行相同且输出文件仍存在时直接跳过
+  （输出被 process_images 就地本地化图片后也会跳过）。
+- 输入变化需要重新合并，但输出在上次合并后已被改动（如图片已本地化、手动编辑）时不覆盖，该地区记为失败；
+  确认后使用 --overwrite 覆盖，再重新运行 process_images。
+- 输出只在内容变化时写入；运行结束后生成汇总的差异报告（新增/删除/变化的菜品、未匹配和有歧义的菜品）。
+
+配置文件格式（路径相对于运行目录）:
+    {
+      "region": "hawaii",
+      "menu": "raw/hawai-menu.json",
+      "order": "raw/hawai-order.json",
+      "output": "raw/hawai-full-menu.json",
+      "category_map": {"Appetizers": "APPETIZERS 2025", ...},
+      "dish_map": {"Appetizers": {"Spinach Artichoke Dip": "Spinach-Artichoke Dip"}},
+      "threshold": 0.75,
+      "accept_ambiguous": false
+    }
+accept_ambiguous 为 true 时有歧义的匹配采用得分最高的候选，默认只报告、卡路里保持 "N/A"。
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from image_cache import hash_stream
+from menu_matcher import DEFAULT_THRESHOLD, DEFAULT_MARGIN
+from pipeline_io import write_json_atomic
+from process_menu import compile_menu, merge_menus
+
+DEFAULT_REGIONS_GLOB = 'regions/*.json'
+DEFAULT_STATE_DIR = '.merge_cache'
+STATE_FILENAME = 'regions_state.json'
+REPORT_FILENAME = 'merge_report.json'
+# 合并逻辑或输出格式变化时递增，使所有地区的缓存失效
+MERGE_VERSION = 1
+REQUIRED_KEYS = ('region', 'menu', 'order', 'output', 'category_map')
+# 差异报告中比较的菜品字段
+DIFF_FIELDS = ('price', 'calories', 'image_url', 'description')
+
+# 工作进程内已编译的源菜单：{(源菜单哈希, threshold, margin): compiled}
+_compiled_menus = {}
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hash_stream(f)[0]
+
+
+def load_region_config(path):
+    """读取并校验一个地区配置，缺少必要字段时抛出 ValueError。"""
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    missing = [key for key in REQUIRED_KEYS if not config.get(key)]
+    if missing:
+        raise ValueError(f"地区配置 '{path}' 缺少字段: {', '.join(missing)}")
+    config.setdefault('dish_map', {})
+    config.setdefault('threshold', DEFAULT_THRESHOLD)
+    config.setdefault('margin', DEFAULT_MARGIN)
+    config.setdefault('accept_ambiguous', False)
+    config['config_path'] = path
+    return config
+
+
+def region_fingerprint(config):
+    """地区的输入指纹：源菜单和订单的内容哈希、映射配置和合并逻辑版本。返回 (指纹, 源菜单哈希)。"""
+    menu_digest = file_digest(config['menu'])
+    mapping = {key: config[key] for key in ('category_map', 'dish_map', 'threshold', 'margin', 'accept_ambiguous')}
+    digest = hashlib.sha256()
+    digest.update(f"v{MERGE_VERSION}\0{menu_digest}\0{file_digest(config['order'])}\0".encode())
+    digest.update(json.dumps(mapping, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest(), menu_digest
+
+
+def _items_by_title(menu):
+    return {category: {item.get('title'): item for item in content.get('items', [])}
+            for category, content in menu.items()}
+
+
+def diff_menus(old_menu, new_menu):
+    """比较同一地区前后两次的输出：按分类列出新增、删除的菜品和字段有变化的菜品。"""
+    old_items, new_items = _items_by_title(old_menu), _items_by_title(new_menu)
+    diff = {}
+    for category in sorted(set(old_items) | set(new_items)):
+        before, after = old_items.get(category, {}), new_items.get(category, {})
+        changed = []
+        for title in sorted(set(before) & set(after), key=str):
+            fields = {field: [before[title].get(field), after[title].get(field)] for field in DIFF_FIELDS
+                      if before[title].get(field) != after[title].get(field)}
+            if fields:
+                changed.append({'title': title, 'fields': fields})
+        added = sorted(set(after) - set(before), key=str)
+        removed = sorted(set(before) - set(after), key=str)
+        if added or removed or changed:
+            diff[category] = {'added': added, 'removed': removed, 'changed': changed}
+    return diff
+
+
+def merge_region(config, fingerprint, menu_digest, expected_digest=None):
+    """
+    在工作进程中合并一个地区，只在内容变化时写入输出。返回该地区的结果摘要。
+    expected_digest 不为 None 时，已存在的输出必须仍是该内容（上次合并写入的内容）才会被覆盖，
+    否则不写入并返回 status 为 'error' 的结果。
+    """
+    start = time.perf_counter()
+    key = (menu_digest, config['threshold'], config['margin'])
+    compiled = _compiled_menus.get(key)
+    if compiled is None:
+        with open(config['menu'], 'r', encoding='utf-8') as f:
+            compiled = _compiled_menus[key] = compile_menu(json.load(f), config['threshold'], config['margin'])
+    with open(config['order'], 'r', encoding='utf-8') as f:
+        order_data = json.load(f)
+
+    new_menu, not_found_log, match_log = merge_menus(compiled, order_data, config['category_map'],
+                                                     config['dish_map'], config['accept_ambiguous'])
+    text = json.dumps(new_menu, indent=2, ensure_ascii=False)
+
+    old_menu = {}
+    if os.path.exists(config['output']):
+        try:
+            with open(config['output'], 'r', encoding='utf-8') as f:
+                old_menu = json.load(f)
+        except (OSError, ValueError):
+            old_menu = {}
+    diff = diff_menus(old_menu, new_menu)
+    written = not os.path.exists(config['output']) or old_menu != new_menu
+    if written and expected_digest is not None and os.path.exists(config['output']) \
+            and file_digest(config['output']) != expected_digest:
+        return {'region': config['region'], 'status': 'error', 'output': config['output'], 'diff': diff,
+                'reason': f"{config['output']} 在上次合并后已被修改（例如图片已本地化），未覆盖；"
+                          f"确认后使用 --overwrite 重新合并，并重新运行 process_images"}
+    if written:
+        output_dir = os.path.dirname(config['output'])
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        write_json_atomic(config['output'], text)
+
+    matches = {(entry['category'], entry['query']): entry for entry in match_log}.values()
+    return {
+        'region': config['region'],
+        'status': 'merged',
+        'output': config['output'],
+        'written': written,
+        'items': sum(len(content['items']) for content in new_menu.values()),
+        'unmatched': sorted(set(not_found_log)),
+        'fuzzy': sum(1 for entry in matches if entry['method'] == 'fuzzy'),
+        'ambiguous': [{'category': entry['category'], 'query': entry['query'], 'candidates': entry['candidates'],
+                       'accepted': entry['accepted']}
+                      for entry in matches if entry['ambiguous']],
+        'diff': diff,
+        'fingerprint': fingerprint,
+        'output_digest': hashlib.sha256(text.encode('utf-8')).hexdigest(),
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def load_state(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def is_up_to_date(config, fingerprint, previous):
+    """
+    指纹与上次相同且输出文件仍存在。只比较输入：下游（如 process_images）就地改写过的输出不会因此被重新合并。
+    """
+    return bool(previous) and previous.get('fingerprint') == fingerprint and os.path.exists(config['output'])
+
+
+def diff_counts(diff):
+    return tuple(sum(len(entry[kind]) for entry in diff.values()) for kind in ('added', 'removed', 'changed'))
+
+
+def run_regions(config_paths, jobs=None, state_dir=DEFAULT_STATE_DIR, report_path=None, force=False,
+                overwrite=False):
+    """
+    合并所有地区，返回汇总报告字典。report_path 默认为 state_dir 下的 merge_report.json。
+    overwrite 为假时，不覆盖上次合并后被修改过的输出（没有合并记录的已有输出也视为被修改过）。
+    """
+    state_path = os.path.join(state_dir, STATE_FILENAME)
+    state = load_state(state_path)
+    results = []
+    pending = []
+    seen = {}
+    for path in config_paths:
+        try:
+            config = load_region_config(path)
+            if config['region'] in seen:
+                raise ValueError(f"地区名 '{config['region']}' 与 '{seen[config['region']]}' 重复")
+            seen[config['region']] = path
+            fingerprint, menu_digest = region_fingerprint(config)
+        except (OSError, ValueError) as e:
+            print(f"  [错误] ✗ {path}: {e}")
+            results.append({'region': os.path.splitext(os.path.basename(path))[0], 'status': 'error',
+                            'reason': str(e)})
+            continue
+        previous = state.get(config['region'])
+        if not force and is_up_to_date(config, fingerprint, previous):
+            print(f"  [跳过] {config['region']}: 输入和映射均未变化")
+            results.append({'region': config['region'], 'status': 'skipped', 'output': config['output']})
+            continue
+        expected_digest = None if overwrite else (previous or {}).get('output_digest', '')
+        pending.append((config, fingerprint, menu_digest, expected_digest))
+
+    if pending:
+        # 引用同一份源菜单的地区相邻提交，同一工作进程更可能复用已编译的查找结构
+        pending.sort(key=lambda entry: entry[2])
+        jobs = max(1, min(jobs or os.cpu_count() or 1, len(pending)))
+        print(f"\n{len(pending)} 个地区需要合并，使用 {jobs} 个进程...")
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(merge_region, *entry): entry[0] for entry in pending}
+            for future in as_completed(futures):
+                config = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"  [错误] ✗ {config['region']}: {e}")
+                    results.append({'region': config['region'], 'status': 'error', 'reason': str(e)})
+                    continue
+                if result['status'] == 'error':
+                    print(f"  [错误] ✗ {config['region']}: {result['reason']}")
+                    results.append(result)
+                    continue
+                added, removed, changed = diff_counts(result['diff'])
+                print(f"  [合并] ✓ {result['region']}: {result['items']} 项，未匹配 {len(result['unmatched'])}，"
+                      f"模糊匹配 {result['fuzzy']}，有歧义 {len(result['ambiguous'])}，"
+                      f"变化 +{added} -{removed} ~{changed}"
+                      f"{'' if result['written'] else '（输出内容未变化）'} ({result['seconds']:.2f}s)")
+                state[result['region']] = {'fingerprint': result['fingerprint'],
+                                           'output_digest': result['output_digest'],
+                                           'merged_at': datetime.now().isoformat()}
+                results.append(result)
+
+        os.makedirs(state_dir, exist_ok=True)
+        write_json_atomic(state_path, json.dumps(state, indent=2, ensure_ascii=False))
+
+    results.sort(key=lambda result: result['region'])
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    report = {'generated_at': datetime.now().isoformat(), 'counts': counts, 'regions': results}
+    report_path = report_path or os.path.join(state_dir, REPORT_FILENAME)
+    os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+    write_json_atomic(report_path, json.dumps(report, indent=2, ensure_ascii=False))
+
+    print("\n--- 合并结果 ---")
+    print(f"合并: {counts.get('merged', 0)} 个地区，跳过: {counts.get('skipped', 0)} 个，失败: {counts.get('error', 0)} 个")
+    print(f"差异报告已写入 {report_path}")
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="按地区配置并行合并菜单和订单数据，跳过输入和映射均未变化的地区。",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('configs', nargs='*', default=[DEFAULT_REGIONS_GLOB],
+                        help='地区配置文件路径或通配符。')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='并行合并的进程数。')
+    parser.add_argument('--state-dir', default=DEFAULT_STATE_DIR, help='保存各地区指纹和差异报告的目录。')
+    parser.add_argument('--report', default=None, help=f'差异报告的路径（默认为 --state-dir 下的 {REPORT_FILENAME}）。')
+    parser.add_argument('--force', action='store_true', help='忽略指纹，重新合并所有地区。')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='覆盖上次合并后被修改过的输出（例如 process_images 已本地化图片的菜单）。')
+    args = parser.parse_args()
+
+    config_paths = sorted({path for pattern in args.configs for path in (glob.glob(pattern) or [pattern])})
+    if not config_paths:
+        parser.error('没有找到任何地区配置文件。')
+    report = run_regions(config_paths, jobs=args.jobs, state_dir=args.state_dir, report_path=args.report,
+                         force=args.force, overwrite=args.overwrite)
+    if report['counts'].get('error'):
+        raise SystemExit(1)
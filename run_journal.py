@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+DEFAULT_JOURNAL_FILENAME = 'journal.jsonl'
+
+
+class RunJournal:
+    """
+    只追加写入的完成日志 (JSONL)，每处理完一张图片就写入一行：源URL -> 新URL / 输出文件 / 宽高 / 尺寸变体。
+
+    运行中断后，下一次运行读取该日志即可恢复已完成的结果，不再重新下载或编码；
+    JSON 成功写回后调用 discard() 删除日志。最后一行因崩溃而不完整时会被忽略。所有方法都是线程安全的。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        # 日志目录由本次运行创建时（如 --no-cache 下的 .image_cache），删除日志后若目录为空也一并删除
+        self._created_dir = directory if directory and not os.path.isdir(directory) else None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        partial = self._load()
+        self._file = open(path, 'a', encoding='utf-8')
+        if partial:
+            # 上次运行在写入最后一行时中断：先换行，避免新记录接在不完整的行后面一起被忽略
+            self._file.write('\n')
+
+    def _load(self):
+        """读取已有记录；返回最后一行是否缺少换行（上次运行写入时中断）。"""
+        line = ''
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if isinstance(entry, dict) and entry.get('url'):
+                        self.entries[entry['url']] = entry
+        except FileNotFoundError:
+            pass
+        return bool(line) and not line.endswith('\n')
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, url, output_dir):
+        """返回 url 在 output_dir 下已完成的记录；输出文件已不存在时返回 None。"""
+        entry = self.entries.get(url)
+        if entry is None or entry.get('output_dir') != os.path.abspath(output_dir):
+            return None
+        if not os.path.exists(os.path.join(entry['output_dir'], entry['output_filename'])):
+            return None
+        return entry
+
+    def record(self, url, *, new_url, output_dir, output_filename, width, height, variants=None):
+        """追加一条完成记录，并立即刷新到磁盘。variants 为尺寸变体列表（未配置变体时为 None）。"""
+        entry = {
+            'url': url,
+            'new_url': new_url,
+            'output_dir': os.path.abspath(output_dir),
+            'output_filename': output_filename,
+            'width': width,
+            'height': height,
+            'variants': variants,
+            'completed_at': datetime.now().isoformat(),
+        }
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self._lock:
+            self.entries[url] = entry
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def discard(self):
+        """结果已全部写回 JSON：关闭并删除日志。"""
+        self.close()
+        with self._lock:
+            self.entries.clear()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            if self._created_dir:
+                try:
+                    os.rmdir(self._created_dir)
+                except OSError:
+                    pass
@@ -0,0 +1,166 @@
+"""
+运行指标与日志。
+
+RunMetrics 按阶段收集每个项目的耗时、输入/输出字节数和重试次数，运行结束时汇总为 p50/p95/p99，
+并生成可写入 JSON 的运行报告。setup_logging 把日志改为经由队列输出：工作线程只把记录放入队列，
+由后台线程写到标准输出，详细日志不会让工作线程排队等待。
+"""
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+DEFAULT_REPORT_FILENAME = 'run_report.json'
+LOG_FORMAT = '%(message)s'
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+# 报告中各阶段的顺序；throttle 为限速和重试退避的等待时间，memory_wait 为等待解码内存预算的时间；ttfb/dns/connect 是 download 的组成部分，不计入单个项目的总耗时
+STAGES = ('probe', 'throttle', 'download', 'ttfb', 'dns', 'connect', 'memory_wait', 'decode', 'dedupe', 'encode', 'stamp', 'write', 'variants')
+_DOWNLOAD_PARTS = ('ttfb', 'dns', 'connect')
+
+
+def setup_logging(level='INFO', queued=True):
+    """
+    配置根日志，只输出消息本身（与原先的 print 输出一致）。
+    queued 为 True 时返回已启动的 QueueListener，运行结束时需要调用 stop() 输出剩余的记录；否则直接写标准输出并返回 None。
+    """
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root = logging.getLogger()
+    root.handlers[:] = []
+    root.setLevel(level)
+    if not queued:
+        root.addHandler(handler)
+        return None
+    log_queue = queue.SimpleQueue()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    return listener
+
+
+@contextmanager
+def timed(timings, stage):
+    """把代码块的耗时（秒）累加到 timings[stage]。"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def percentile(sorted_values, fraction):
+    """已排序序列的分位数（线性插值），序列为空时返回 None。"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def describe(values):
+    """返回一组数值的 count/total/mean/p50/p95/p99/max。"""
+    ordered = sorted(values)
+    total = sum(ordered)
+    return {
+        'count': len(ordered),
+        'total': total,
+        'mean': total / len(ordered) if ordered else None,
+        'p50': percentile(ordered, 0.50),
+        'p95': percentile(ordered, 0.95),
+        'p99': percentile(ordered, 0.99),
+        'max': ordered[-1] if ordered else None,
+    }
+
+
+class RunMetrics:
+    """
+    一次运行的指标。每个项目的结果到达时调用 add_item()；结果字典中的 timings（各阶段耗时）、
+    bytes_in / bytes_out（源图片和输出的字节数）、decodes / encodes 和 retries 会被记录下来。
+    所有方法都是线程安全的。
+    """
+
+    def __init__(self):
+        self.started_at = datetime.now().isoformat()
+        self.items = []
+        self.counters = {}
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def increment(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_item(self, url, title, result=None, exc=None):
+        if exc is not None:
+            status = 'exception'
+        elif result is None:
+            status = 'skipped'
+        else:
+            status = result.get('status', 'unknown')
+        result = result or {}
+        timings = dict(result.get('timings') or {})
+        entry = {
+            'url': url,
+            'title': title,
+            'status': status,
+            'timings': timings,
+            'total_seconds': sum(v for k, v in timings.items() if k not in _DOWNLOAD_PARTS),
+            'bytes_in': result.get('bytes_in'),
+            'bytes_out': result.get('bytes_out'),
+            'decodes': result.get('decodes', 0),
+            'encodes': result.get('encodes', 0),
+            'retries': result.get('retries', 0),
+            'deduped': 'deduped' in result,
+        }
+        if status != 'success':
+            entry['reason'] = str(exc) if exc is not None else result.get('reason')
+        with self._lock:
+            self.items.append(entry)
+            self.counters[status] = self.counters.get(status, 0) + 1
+
+    def summary(self):
+        """按阶段汇总耗时分位数，并统计字节数、压缩比和重试次数。"""
+        with self._lock:
+            items = list(self.items)
+        stages = {}
+        names = [s for s in STAGES if any(s in item['timings'] for item in items)]
+        names += sorted({k for item in items for k in item['timings']} - set(STAGES))
+        for name in names:
+            stages[name] = describe([item['timings'][name] for item in items if name in item['timings']])
+        measured = [item for item in items if item['timings']]
+        bytes_in = sum(item['bytes_in'] for item in items if item['bytes_in'] and item['bytes_out'])
+        bytes_out = sum(item['bytes_out'] for item in items if item['bytes_in'] and item['bytes_out'])
+        return {
+            'stages': stages,
+            'item_total': describe([item['total_seconds'] for item in measured]),
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'compression_ratio': bytes_in / bytes_out if bytes_out else None,
+            'decodes': sum(item['decodes'] for item in items),
+            'encodes': sum(item['encodes'] for item in items),
+            'retries': sum(item['retries'] for item in items),
+        }
+
+    def report(self, include_items=False, **extra):
+        """
+        运行报告字典：运行时间、计数和汇总，include_items 为真时附带每个项目的明细。extra 中的键值原样加入。
+        """
+        with self._lock:
+            counters = dict(self.counters)
+            items = list(self.items)
+        report = {
+            'started_at': self.started_at,
+            'finished_at': datetime.now().isoformat(),
+            'wall_seconds': time.perf_counter() - self._start,
+            'counters': counters,
+            'summary': self.summary(),
+            **extra,
+        }
+        if include_items:
+            report['items'] = items
+        return report
@@ -0,0 +1,358 @@
+"""
+增量构建流水线：把 process_index_menu、process_regions（各地区的 process_menu 合并）、process_images
+和 compile_data 声明为一个有向无环图，每个阶段列出输入、输出和实现它的代码文件，依赖关系由"谁产出了我的输入"自动推导。
+
+- 每个阶段的指纹由命令行、输入文件和代码文件的内容哈希组成。指纹与上次成功运行时相同、
+  且输出文件仍是流水线上次写入的内容时跳过该阶段；上游重新运行但产出内容不变时，下游同样跳过。
+- process_images 会就地改写它处理的JSON，这类阶段的指纹在运行结束后按改写后的内容重新计算，
+  下次运行不会因为自己的改写而重复执行。
+- 互不依赖的分支（首页菜单 / 各地区菜单 / 门店位置）并行执行，每个阶段的输出写入 .pipeline/logs/<阶段>.log，
+  结束时输出每个阶段的耗时。
+
+用法: python run_pipeline.py [--jobs 2] [--force] [--dry-run] [-- process_images 的额外参数，如 --proxy none]
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from compile_data import DEFAULT_OUTPUT_DIR, DEFAULT_PAGES_GLOB, MANIFEST_FILENAME as COMPILED_MANIFEST
+from pipeline_io import write_json_atomic
+from process_regions import DEFAULT_REGIONS_GLOB, file_digest, load_region_config
+
+PIPELINE_DIR = '.pipeline'
+STATE_FILENAME = 'state.json'
+REPORT_FILENAME = 'last_run.json'
+LOGS_DIRNAME = 'logs'
+INDEX_MENU_INPUT = os.path.join('raw', 'index-menu.json')
+INDEX_MENU_OUTPUT = os.path.join('raw', 'index-full-menu.json')
+POSITIONS_INPUT = os.path.join('raw', 'maps_position.json')
+POSITIONS_INDEX = os.path.join('raw', 'positions-index.json')
+POSITIONS_ARTIFACT = os.path.join('raw', 'positions-geo.json')
+KEYWORDS_INPUT = os.path.join('raw', 'olive-garden-menu_keywords_2025-08-29.csv')
+KEYWORDS_INDEX = os.path.join('raw', 'keywords-index.json')
+# process_images 及其依赖的模块，任何一个变化都会使图片阶段重新运行
+IMAGE_CODE = ('process_images.py', 'image_cache.py', 'image_dedupe.py', 'image_encoder.py', 'image_fetcher.py',
+              'image_sources.py', 'fetch_scheduler.py', 'run_journal.py', 'run_metrics.py', 'webp_container.py',
+              'pipeline_io.py')
+# 其他阶段共用的 pipeline_io（write_json_atomic、get_image_dimensions）及其依赖
+HELPER_CODE = ('pipeline_io.py', 'webp_container.py')
+# 失败时在终端输出的日志末尾行数
+LOG_TAIL_LINES = 20
+
+
+def region_files(pattern=DEFAULT_REGIONS_GLOB):
+    """返回 (地区配置文件, 这些配置引用的输入文件, 这些配置的输出文件)。"""
+    configs = sorted(glob.glob(pattern))
+    inputs, outputs = [], []
+    for path in configs:
+        config = load_region_config(path)
+        inputs.extend(p for p in (config['menu'], config['order']) if p not in inputs)
+        outputs.append(config['output'])
+    return configs, inputs, outputs
+
+
+def image_stage(name, json_paths, image_args=()):
+    """
+    对 json_paths 运行 process_images 的阶段。每个图片阶段使用独立的完成日志和运行报告，可以并行运行。
+    运行报告中有失败的项目时不记录该阶段的指纹，下次运行时重试。
+    """
+    report = os.path.join(PIPELINE_DIR, f'{name}_report.json')
+    return {
+        'name': name,
+        'inputs': list(json_paths),
+        'outputs': list(json_paths),
+        'code': list(IMAGE_CODE),
+        'command': [sys.executable, 'process_images.py', *json_paths,
+                    '--journal', os.path.join(PIPELINE_DIR, f'{name}.journal'),
+                    '--report', report, *image_args],
+        'report': report,
+    }
+
+
+def default_stages(image_args=(), regions_pattern=DEFAULT_REGIONS_GLOB):
+    """
+    本仓库的刷新流程：首页菜单 -> 图片，各地区菜单 -> 图片，两个分支互不依赖，最后一起编译为分片；
+    门店位置索引与菜单无关，单独作为一个分支；关键词索引只依赖首页菜单的菜名。
+    """
+    stages = [{
+        'name': 'index_menu',
+        'inputs': [INDEX_MENU_INPUT],
+        'outputs': [INDEX_MENU_OUTPUT],
+        'code': ['process_index_menu.py'],
+        'command': [sys.executable, 'process_index_menu.py', '--stream',
+                    '--input', INDEX_MENU_INPUT, '--output', INDEX_MENU_OUTPUT],
+    }, image_stage('index_images', [INDEX_MENU_OUTPUT], image_args), {
+        'name': 'positions',
+        'inputs': [POSITIONS_INPUT],
+        'outputs': [POSITIONS_INDEX, POSITIONS_ARTIFACT],
+        'code': ['process_positions.py', 'process_index_menu.py', *HELPER_CODE],
+        'command': [sys.executable, 'process_positions.py', '--input', POSITIONS_INPUT,
+                    '--output', POSITIONS_INDEX, '--artifact', POSITIONS_ARTIFACT],
+    }, {
+        'name': 'keywords',
+        'inputs': [KEYWORDS_INPUT, INDEX_MENU_OUTPUT],
+        'outputs': [KEYWORDS_INDEX],
+        'code': ['process_keywords.py', 'process_menu.py', 'menu_matcher.py', *HELPER_CODE],
+        'command': [sys.executable, 'process_keywords.py', '--keywords', KEYWORDS_INPUT,
+                    '--menu', INDEX_MENU_OUTPUT, '--output', KEYWORDS_INDEX],
+    }]
+
+    configs, region_inputs, region_outputs = region_files(regions_pattern)
+    if configs:
+        stages.append({
+            'name': 'regions',
+            'inputs': configs + region_inputs,
+            'outputs': region_outputs,
+            'code': ['process_regions.py', 'process_menu.py', 'menu_matcher.py', 'image_cache.py', *HELPER_CODE],
+            # 是否需要重新合并已由流水线判断，这里不再使用 process_regions 自己的跳过逻辑；
+            # 输出中已本地化的图片会被还原，随后的 region_images 阶段重新处理
+            'command': [sys.executable, 'process_regions.py', *configs, '--force', '--overwrite'],
+        })
+        stages.append(image_stage('region_images', region_outputs, image_args))
+
+    # 图片处理完成后把页面和菜单编译为 Worker 使用的最小化分片
+    menu_paths = [INDEX_MENU_OUTPUT, *region_outputs]
+    stages.append({
+        'name': 'compile',
+        'inputs': sorted(glob.glob(DEFAULT_PAGES_GLOB)) + menu_paths,
+        'outputs': [os.path.join(DEFAULT_OUTPUT_DIR, COMPILED_MANIFEST)],
+        'code': ['compile_data.py', 'menu_matcher.py', *HELPER_CODE],
+        'command': [sys.executable, 'compile_data.py',
+                    *(arg for path in menu_paths for arg in ('--menu', f"{path.replace(os.sep, '/')}={path}"))],
+    })
+    return stages
+
+
+def resolve_dependencies(stages):
+    """
+    为每个阶段填入 deps（产出其输入文件的其他阶段），并按拓扑顺序返回阶段列表。
+    就地改写输入的阶段（输入同时是自己的输出）不依赖自己。存在环时抛出 ValueError。
+    """
+    producers = {}
+    for stage in stages:
+        for path in stage['outputs']:
+            producers.setdefault(os.path.normpath(path), []).append(stage['name'])
+    by_name = {stage['name']: stage for stage in stages}
+    if len(by_name) != len(stages):
+        raise ValueError("阶段名称重复")
+    for stage in stages:
+        deps = []
+        for path in stage['inputs']:
+            for producer in producers.get(os.path.normpath(path), ()):
+                # 同一文件被多个阶段改写时（如菜单阶段生成、图片阶段就地改写），只依赖在它之前声明的阶段
+                if producer != stage['name'] and producer not in deps and \
+                        stages.index(by_name[producer]) < stages.index(stage):
+                    deps.append(producer)
+        stage['deps'] = deps
+
+    ordered, visiting, done = [], set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"阶段之间存在循环依赖: {name}")
+        visiting.add(name)
+        for dep in by_name[name]['deps']:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+        ordered.append(by_name[name])
+
+    for stage in stages:
+        visit(stage['name'])
+    return ordered
+
+
+def stage_fingerprint(stage):
+    """命令行、输入文件和代码文件内容的哈希。输入文件不存在时抛出 FileNotFoundError。"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(stage['command'][1:], ensure_ascii=False).encode('utf-8'))
+    for path in [*stage['inputs'], *stage['code']]:
+        digest.update(f"\0{os.path.normpath(path)}\0{file_digest(path)}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def outputs_current(stage, files):
+    """所有输出文件都存在，且内容与流水线上次写入时相同。"""
+    for path in stage['outputs']:
+        recorded = files.get(os.path.normpath(path))
+        if recorded is None or not os.path.exists(path) or file_digest(path) != recorded:
+            return False
+    return True
+
+
+def run_command(stage, log_path):
+    """运行阶段的命令，标准输出和错误写入日志文件。返回 (退出码, 耗时秒数)。"""
+    start = time.perf_counter()
+    with open(log_path, 'w', encoding='utf-8') as log:
+        log.write(f"$ {' '.join(stage['command'])}\n\n")
+        log.flush()
+        returncode = subprocess.run(stage['command'], stdout=log, stderr=subprocess.STDOUT).returncode
+    return returncode, time.perf_counter() - start
+
+
+def report_failures(stage):
+    """
+    阶段运行报告中处理失败的项目数（process_images 有失败项目时退出码仍为 0）。
+    阶段没有运行报告时返回 0；报告缺失或无法解析时返回 None。
+    """
+    if not stage.get('report'):
+        return 0
+    try:
+        with open(stage['report'], 'r', encoding='utf-8') as f:
+            return int(json.load(f)['results']['failed'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def log_tail(log_path, lines=LOG_TAIL_LINES):
+    with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+        return ''.join(f.readlines()[-lines:])
+
+
+def run_pipeline(stages, jobs=2, force=False, dry_run=False, pipeline_dir=PIPELINE_DIR):
+    """
+    按依赖关系运行各阶段，互不依赖的阶段最多 jobs 个并行。
+    返回每个阶段的结果列表：name、status（ran / incomplete / skipped / failed / blocked / would_run）、seconds、reason。
+    incomplete 表示命令成功退出但运行报告中有失败的项目：下游照常运行，但不记录该阶段的指纹，下次运行时重试。
+    """
+    stages = resolve_dependencies(stages)
+    logs_dir = os.path.join(pipeline_dir, LOGS_DIRNAME)
+    os.makedirs(logs_dir, exist_ok=True)
+    state_path = os.path.join(pipeline_dir, STATE_FILENAME)
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    stage_state = state.setdefault('stages', {})
+    files = state.setdefault('files', {})
+
+    results = {}
+    pending = list(stages)
+    running = {}
+    pipeline_start = time.perf_counter()
+
+    def finish(stage, status, seconds=0.0, reason=None):
+        results[stage['name']] = {'name': stage['name'], 'status': status, 'seconds': round(seconds, 3),
+                                  'reason': reason}
+
+    def start_ready(executor):
+        for stage in list(pending):
+            dep_status = [results.get(dep, {}).get('status') for dep in stage['deps']]
+            if any(status is None for status in dep_status):
+                continue
+            pending.remove(stage)
+            if any(status in ('failed', 'blocked') for status in dep_status):
+                finish(stage, 'blocked', reason='上游阶段失败')
+                print(f"  [阻塞] {stage['name']}: 上游阶段失败，未运行")
+                continue
+            if 'would_run' in dep_status:
+                # 演练时假定上游会产出新内容，下游也都会运行
+                finish(stage, 'would_run')
+                print(f"  [将运行] {stage['name']}: {' '.join(stage['command'][1:])}")
+                continue
+            try:
+                fingerprint = stage_fingerprint(stage)
+            except FileNotFoundError as e:
+                finish(stage, 'failed', reason=f"输入文件不存在: {e.filename}")
+                print(f"  [失败] ✗ {stage['name']}: 输入文件不存在: {e.filename}")
+                continue
+            previous = stage_state.get(stage['name'], {})
+            if not force and previous.get('fingerprint') == fingerprint and outputs_current(stage, files):
+                finish(stage, 'skipped')
+                print(f"  [跳过] {stage['name']}: 输入未变化")
+                continue
+            if dry_run:
+                finish(stage, 'would_run')
+                print(f"  [将运行] {stage['name']}: {' '.join(stage['command'][1:])}")
+                continue
+            if stage.get('report') and os.path.exists(stage['report']):
+                # 删除上次的运行报告，避免本次没有写出报告时误读旧结果
+                os.remove(stage['report'])
+            print(f"  [运行中] {stage['name']} ...")
+            log_path = os.path.join(logs_dir, f"{stage['name']}.log")
+            running[executor.submit(run_command, stage, log_path)] = (stage, log_path)
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        start_ready(executor)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, log_path = running.pop(future)
+                try:
+                    returncode, seconds = future.result()
+                except OSError as e:
+                    returncode, seconds = None, 0.0
+                    reason = str(e)
+                else:
+                    reason = f"退出码 {returncode}，详见 {log_path}"
+                if returncode != 0:
+                    finish(stage, 'failed', seconds, reason)
+                    print(f"  [失败] ✗ {stage['name']} ({seconds:.1f}s): {reason}")
+                    if os.path.exists(log_path):
+                        print(log_tail(log_path))
+                    continue
+                # 就地改写输入的阶段按运行后的内容记录指纹
+                for path in stage['outputs']:
+                    if os.path.exists(path):
+                        files[os.path.normpath(path)] = file_digest(path)
+                failures = report_failures(stage)
+                if failures == 0:
+                    stage_state[stage['name']] = {'fingerprint': stage_fingerprint(stage),
+                                                  'finished_at': datetime.now().isoformat(),
+                                                  'seconds': round(seconds, 3)}
+                    finish(stage, 'ran', seconds)
+                    print(f"  [完成] ✓ {stage['name']} ({seconds:.1f}s)")
+                else:
+                    stage_state.pop(stage['name'], None)
+                    reason = (f"{failures} 项处理失败" if failures else f"没有读到运行报告 {stage['report']}") + \
+                        f"，下次运行时重试，详见 {log_path}"
+                    finish(stage, 'incomplete', seconds, reason)
+                    print(f"  [部分失败] ⚠ {stage['name']} ({seconds:.1f}s): {reason}")
+                # 每个阶段完成后立即保存状态，中断后已完成的阶段不会重复运行
+                write_json_atomic(state_path, json.dumps(state, indent=2, ensure_ascii=False))
+            start_ready(executor)
+
+    ordered = [results[stage['name']] for stage in stages]
+    wall = time.perf_counter() - pipeline_start
+    print("\n--- 阶段耗时 ---")
+    for result in ordered:
+        deps = ', '.join(next(s for s in stages if s['name'] == result['name'])['deps']) or '-'
+        print(f"{result['name']:<16}{result['status']:<11}{result['seconds']:>8.1f}s   依赖: {deps}")
+    print(f"总耗时 {wall:.1f}s（各阶段合计 {sum(r['seconds'] for r in ordered):.1f}s）")
+
+    if not dry_run:
+        report = {'finished_at': datetime.now().isoformat(), 'wall_seconds': round(wall, 3), 'stages': ordered}
+        write_json_atomic(os.path.join(pipeline_dir, REPORT_FILENAME),
+                          json.dumps(report, indent=2, ensure_ascii=False))
+    return ordered
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="增量运行菜单和图片处理流水线：只重新运行输入发生变化的阶段，互不依赖的分支并行执行。",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--jobs', type=int, default=2, help='同时运行的最大阶段数。')
+    parser.add_argument('--force', action='store_true', help='忽略指纹，重新运行所有阶段。')
+    parser.add_argument('--dry-run', action='store_true', help='只列出需要运行的阶段，不实际运行。')
+    parser.add_argument('--regions', default=DEFAULT_REGIONS_GLOB, help='地区配置文件的通配符。')
+    parser.add_argument('--pipeline-dir', default=PIPELINE_DIR, help='流水线状态、日志和运行报告的目录。')
+    args, image_args = parser.parse_known_args()
+    # "--" 之后的参数原样传给 process_images
+    if image_args and image_args[0] == '--':
+        image_args = image_args[1:]
+
+    results = run_pipeline(default_stages(image_args, args.regions), jobs=args.jobs, force=args.force,
+                           dry_run=args.dry_run, pipeline_dir=args.pipeline_dir)
+    if any(result['status'] in ('failed', 'blocked', 'incomplete') for result in results):
+        raise SystemExit(1)
@@ -1,27 +1,27 @@
 import {Hono, MiddlewareHandler} from 'hono'
 import {serveStatic} from 'hono/cloudflare-workers'
-import indexData from '../raw/pages/index.json';
+import indexData from '../build/data/pages/index.json';
 import siteConfig from "../raw/site.json";
-import nearMeData from "../raw/pages/near_me.json";
-import contactUsData from "../raw/pages/contact_us.json";
-import privacyPolicyData from "../raw/pages/privacy_policy.json";
-import termsOfServiceData from "../raw/pages/terms_of_service.json";
-import drinkMenuData from "../raw/pages/drink-menu.json";
-import lunchMenuData from "../raw/pages/lunch-menu.json";
-import dinnerMenuData from "../raw/pages/dinner-menu.json";
-import dessertMenuData from "../raw/pages/dessert-menu.json";
-import cateringMenuData from "../raw/pages/catering-menu.json";
-import hawaiiData from "../raw/pages/hawaii.json";
-import hawaiiFullMenuData from "../raw/hawai-full-menu.json";
-import kidsMenuData from "../raw/pages/kids-menu.json";
-import pastaMenuData from "../raw/pages/pasta-menu.json";
-import soupMenuData from "../raw/pages/soup-menu.json";
-import nutritionAllergenMenuData from "../raw/pages/nutrition-allergen-menu.json";
-import specialsData from "../raw/pages/specials.json";
-import happyHoursData from "../raw/pages/happy-hours.json";
-import couponsData from "../raw/pages/coupons.json";
-import holidayHoursData from "../raw/pages/holiday-hours.json";
-import indexFullMenuData from "../raw/pages/index-full-menu.json";
+import nearMeData from "../build/data/pages/near_me.json";
+import contactUsData from "../build/data/pages/contact_us.json";
+import privacyPolicyData from "../build/data/pages/privacy_policy.json";
+import termsOfServiceData from "../build/data/pages/terms_of_service.json";
+import drinkMenuData from "../build/data/pages/drink-menu.json";
+import lunchMenuData from "../build/data/pages/lunch-menu.json";
+import dinnerMenuData from "../build/data/pages/dinner-menu.json";
+import dessertMenuData from "../build/data/pages/dessert-menu.json";
+import cateringMenuData from "../build/data/pages/catering-menu.json";
+import hawaiiData from "../build/data/pages/hawaii.json";
+import hawaiiFullMenuData from "../build/data/menus/hawai-full-menu.json";
+import kidsMenuData from "../build/data/pages/kids-menu.json";
+import pastaMenuData from "../build/data/pages/pasta-menu.json";
+import soupMenuData from "../build/data/pages/soup-menu.json";
+import nutritionAllergenMenuData from "../build/data/pages/nutrition-allergen-menu.json";
+import specialsData from "../build/data/pages/specials.json";
+import happyHoursData from "../build/data/pages/happy-hours.json";
+import couponsData from "../build/data/pages/coupons.json";
+import holidayHoursData from "../build/data/pages/holiday-hours.json";
+import indexFullMenuData from "../build/data/menus/index-full-menu.json";
 
 const pageDataMap: { [key: string]: any } = {
   '/': indexData,
@@ -117,37 +117,19 @@ function joinUrlPaths(base: string, ...paths: string[]): string {
 }
 
 
-const parsePriceForSchema = (priceString: string | number | undefined): string | undefined => {
-  if (typeof priceString === 'number') return String(priceString);
-  if (typeof priceString !== 'string') return undefined;
-  const match = priceString.match(/\$?(\d+\.?\d*)/);
-  return match ? match[1] : undefined;
-};
-
-const parseCaloriesForSchema = (calorieString: string | undefined): string | undefined => {
-  if (!calorieString) return undefined;
-  const match = calorieString.match(/(\d{1,3}(,\d{3})*|\d+)/);
-  return match ? `${match[0].replace(/,/g, '')} Cal` : undefined;
-};
-
-const parsePrice = (priceString: string | number | undefined): string | undefined => {
-  if (!priceString) return undefined;
-  if (typeof priceString === 'number') return "$" + String(priceString);
-
-  // 判断是否为纯数字 如果纯数字需要加上$符号
-  if (/^\d+$/.test(<string>priceString)) {
-    return `$${priceString}`;
-  }
-  return priceString;
+/**
+ * Menu items come from build/data (see compile_data.py): price/calorie text, srcset and schema values are
+ * precomputed in `item.ssr`. Keys holding their default value are omitted, so read them through this helper.
+ */
+const SSR_DEFAULTS: { [key: string]: string | undefined } = {
+  price: '', calories: '', info: 'N/A', srcset: '', schemaPrice: undefined, schemaCalories: undefined
 };
 
-const parseCalories = (calorieString: string | number | undefined): string | undefined => {
-  if (!calorieString) return undefined;
-  if (typeof calorieString === 'number') return String(calorieString) + " cal";
-  if (calorieString.toString().toLowerCase().includes("cal")) {
-    return calorieString.toLowerCase();
-  }
-  return String(calorieString) + " cal";
+function ssr(item: any, key: string): string | undefined {
+  const value = item.ssr?.[key];
+  if (value !== undefined && value !== null) return value;
+  // caloriesBadge is only written when it differs from calories
+  return key === 'caloriesBadge' ? ssr(item, 'calories') : SSR_DEFAULTS[key];
 }
 
 // --- HTML Generation Functions ---
@@ -280,17 +262,17 @@ function generateHead(siteConfig: any, data: any, pagePath: string): string {
 
       const menuItems = category.items.map((item: any) => ({
         "@type": "MenuItem",
-        "name": item.title || item.name,
-        "description": item.review || item.description || `A delicious ${item.title || item.name} from the Olive Garden menu.`,
+        "name": item.ssr.name,
+        "description": item.review || item.description || `A delicious ${item.ssr.name} from the Olive Garden menu.`,
         "image": item.image_url ? joinUrlPaths(baseURL, item.image_url) : undefined,
         "offers": {
           "@type": "Offer",
-          "price": parsePriceForSchema(item.displayPrice || item.price),
+          "price": ssr(item, 'schemaPrice'),
           "priceCurrency": "USD"
         },
         "nutrition": {
           "@type": "NutritionInformation",
-          "calories": parseCaloriesForSchema(item.nutritionalFDAMessage || item.calories)
+          "calories": ssr(item, 'schemaCalories')
         }
       })).filter((item: any) => item.name && item.offers.price);
 
@@ -709,8 +691,8 @@ const renderDataTable = (data: any, suffix = "of Olive Garden Menu", coreKeyword
       </details>
     `;
 
-    // --- Generate Nutrition Table ---
-    const allItems = Object.values(categoriesToRender).flatMap((category: any) => category.items || []);
+    // --- Generate Nutrition Table (rows precomputed by compile_data.py) ---
+    const nutritionRows: string[][] = data.nutritionRows || [];
     nutritionTable = `
       <section id="${toKebabCase(nutritionTableTitle)}">
         <h3 style="margin-top: 40px;">${nutritionTableTitle}</h3>
@@ -726,12 +708,12 @@ const renderDataTable = (data: any, suffix = "of Olive Garden Menu", coreKeyword
               </tr>
             </thead>
             <tbody>
-              ${allItems.map((item: any) => `
+              ${nutritionRows.map(([name, price, calories, info]) => `
                 <tr>
-                  <td>${item.title || item.name || ''}</td>
-                  <td>${item.displayPrice || parsePrice(item.price) || ''}</td>
-                  <td>${(item.nutritionalFDAMessage || '').split('|')[0]?.trim() || parseCalories(item.calories) || ''}</td>
-                  <td>${(item.nutritionalFDAMessage || '').split('|').slice(1).join(', ') || 'N/A'}</td>
+                  <td>${name}</td>
+                  <td>${price}</td>
+                  <td>${calories}</td>
+                  <td>${info}</td>
                 </tr>
               `).join('')}
             </tbody>
@@ -758,14 +740,14 @@ const renderDataTable = (data: any, suffix = "of Olive Garden Menu", coreKeyword
           ${(categoryData.items || []).map((item: any) => `
             <div class="menu-card">
               ${recommendedItemName && item.name === recommendedItemName ? '<div class="recommend-badge">Recommended</div>' : ''}
-              ${item.image_url ? `<img src="${item.image_url}" alt="${item.imgAltText || item.name} - ${coreKeyword}" loading="lazy">` : '<div class="no-image-placeholder"><span>No Image Available</span></div>'}
+              ${item.image_url ? `<img src="${item.image_url}"${ssr(item, 'srcset')} alt="${item.imgAltText || item.name} - ${coreKeyword}" loading="lazy">` : '<div class="no-image-placeholder"><span>No Image Available</span></div>'}
               <div class="menu-card-content">
-                <h4>${item.title || item.name || ''}</h4>
+                <h4>${item.ssr.name}</h4>
                 ${item.description ? `<p class="menu-item-description">${item.description}</p>` : ''}
                 ${item.review ? `<p class="review-text">${item.review}</p>` : ''}
                 <div class="price-calories-container">
-                  <span class="price">${item.displayPrice || parsePrice(item.price) || ''}</span>
-                  <span class="calories-badge">${item.nutritionalFDAMessage ? (item.nutritionalFDAMessage || '').split('|').map((part: string) => part.trim()).join('<br>') : parseCalories(item.calories) || ''}</span>
+                  <span class="price">${ssr(item, 'price')}</span>
+                  <span class="calories-badge">${ssr(item, 'caloriesBadge')}</span>
                 </div>
                 ${item.indicators && item.indicators.bottomIndicators && item.indicators.bottomIndicators.length > 0 ?
       `<div class="indicator-badge">${item.indicators.bottomIndicators[0].tooltipText}</div>` : ''
@@ -0,0 +1,81 @@
+"""去重别名：两个URL共用一个输出，其中一个的源图片变化后 --revalidate 不得覆盖共享的输出。"""
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class AliasRevalidateTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        directory = self._tmp.name
+        self.mirror = os.path.join(directory, 'mirror')
+        self.output_dir = os.path.join(directory, 'out')
+        self.cache_dir = os.path.join(directory, 'cache')
+        self.menu = os.path.join(directory, 'menu.json')
+        os.makedirs(self.mirror)
+        gradient = Image.linear_gradient('L').resize((400, 300)).convert('RGB')
+        for name in ('a.jpg', 'b.jpg'):
+            gradient.save(os.path.join(self.mirror, name))
+        with open(self.menu, 'w', encoding='utf-8') as f:
+            json.dump({'data': {'items': [
+                {'title': 'A', 'imageUrl': 'https://img.example/a.jpg'},
+                {'title': 'B', 'imageUrl': 'https://img.example/b.jpg'},
+            ]}}, f)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def run_images(self, *extra):
+        subprocess.run(
+            [sys.executable, os.path.join(ROOT, 'process_images.py'), self.menu, '--mirror', self.mirror,
+             '--offline', '--dedupe', '--workers', '1', '--output-dir', self.output_dir,
+             '--cache-dir', self.cache_dir, '--no-report', *extra],
+            cwd=ROOT, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        with open(self.menu, encoding='utf-8') as f:
+            return [item['image_url'] for item in json.load(f)['data']['items']]
+
+    def aliases(self):
+        with sqlite3.connect(os.path.join(self.cache_dir, 'dedupe.sqlite3')) as conn:
+            return {url: os.path.basename(path) for url, path in conn.execute('SELECT url, output_path FROM aliases')}
+
+    def test_changed_source_gets_its_own_output(self):
+        urls = self.run_images()
+        self.assertEqual(len(set(urls)), 1)
+        shared_path = os.path.join(self.output_dir, os.path.basename(urls[0]))
+        shared_digest = file_digest(shared_path)
+        self.assertEqual(self.aliases(), {'https://img.example/b.jpg': 'a.webp'})
+
+        Image.radial_gradient('L').resize((400, 300)).convert('RGB').save(os.path.join(self.mirror, 'b.jpg'))
+        urls = self.run_images('--revalidate')
+
+        self.assertEqual([os.path.basename(url) for url in urls], ['a.webp', 'b.webp'])
+        # 共享的输出没有被 B 的新内容覆盖，A 也没有丢失它
+        self.assertEqual(file_digest(shared_path), shared_digest)
+        self.assertEqual(self.aliases(), {})
+        with Image.open(os.path.join(self.output_dir, 'b.webp')) as img:
+            self.assertEqual(img.size, (400, 300))
+
+        # 再次校验时两者都未变化，各自复用自己的输出
+        b_digest = file_digest(os.path.join(self.output_dir, 'b.webp'))
+        self.assertEqual([os.path.basename(url) for url in self.run_images('--revalidate')], ['a.webp', 'b.webp'])
+        self.assertEqual(file_digest(shared_path), shared_digest)
+        self.assertEqual(file_digest(os.path.join(self.output_dir, 'b.webp')), b_digest)
+
+
+if __name__ == '__main__':
+    unittest.main()
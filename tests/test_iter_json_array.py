@@ -0,0 +1,76 @@
+"""process_index_menu.iter_json_array：元素跨越读取边界时的流式解析。"""
+import io
+import json
+import unittest
+
+from process_index_menu import iter_json_array
+
+SAMPLE = [
+    {'url': 'https://www.olivegarden.com/menu/', 'title': 'Menu [2025], "quoted", a\\b', 'tags': ['a', 'b']},
+    12345678901234567890,
+    -0.5e-3,
+    'Crème brûlée ✓ 🍝',
+    [[], {}, [1, [2, [3]]], {'nested': {'deep': None}}],
+    True,
+    False,
+    None,
+    {'big': 'x' * 5000, 'list': list(range(200))},
+    '',
+]
+
+
+class CountingReader(io.StringIO):
+    def __init__(self, text):
+        super().__init__(text)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+
+def parse(text, chunk_size):
+    return list(iter_json_array(io.StringIO(text), chunk_size=chunk_size))
+
+
+class IterJsonArrayTest(unittest.TestCase):
+    def test_every_chunk_boundary(self):
+        for text in (json.dumps(SAMPLE), json.dumps(SAMPLE, indent=2, ensure_ascii=False)):
+            for chunk_size in list(range(1, 24)) + [64, 4096, 1 << 20]:
+                with self.subTest(chunk_size=chunk_size, indent='\n' in text):
+                    self.assertEqual(parse(text, chunk_size), SAMPLE)
+
+    def test_number_split_at_chunk_end(self):
+        # "123" 读到 "12" 时已能解析出一个数字，必须继续读入才能确认
+        for chunk_size in range(1, 8):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(parse('[12,345 , 6789]', chunk_size), [12, 345, 6789])
+
+    def test_empty_and_whitespace(self):
+        self.assertEqual(parse('[]', 1), [])
+        self.assertEqual(parse(' \n[ \t\n ]\n', 2), [])
+        self.assertEqual(parse('\n  [ 1 ]  ', 3), [1])
+
+    def test_large_element_is_read_geometrically(self):
+        element = {'payload': 'y' * 200_000}
+        reader = CountingReader(json.dumps([element, 1]))
+        self.assertEqual(list(iter_json_array(reader, chunk_size=16)), [element, 1])
+        # 每次重试读入量翻倍：约 log2(200000 / 16) 次读取，而不是逐块重试上万次
+        self.assertLess(reader.reads, 40)
+
+    def test_elements_are_yielded_lazily(self):
+        reader = CountingReader('[1, 2, ' + ', '.join(['3'] * 10_000) + ']')
+        elements = iter_json_array(reader, chunk_size=8)
+        self.assertEqual([next(elements), next(elements)], [1, 2])
+        self.assertLess(reader.reads, 5)
+
+    def test_malformed_input(self):
+        for text in ('{"a": 1}', '', '[1 2]', '[1, 2', '[1, {"a": ]', '["unterminated]'):
+            for chunk_size in (1, 4, 1024):
+                with self.subTest(text=text, chunk_size=chunk_size):
+                    with self.assertRaises(json.JSONDecodeError):
+                        parse(text, chunk_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
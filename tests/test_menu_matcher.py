@@ -0,0 +1,111 @@
+"""menu_matcher.MenuIndex 的阈值与歧义判定，以及 process_menu 对有歧义匹配的处理。"""
+import unittest
+
+from menu_matcher import MenuIndex, canonical_name
+from process_menu import compile_menu, merge_menus
+
+TITLES = [
+    'Dipping Sauces Includes Breadsticks (V) 4oz',
+    'Dipping Sauces Includes Breadsticks (V) 8oz',
+    'Breadsticks (V)',
+    'Chicken and Shrimp Carbonara',
+    'Chicken Alfredo',
+    'Spinach-Artichoke Dip',
+    'Fettuccine Alfredo',
+]
+
+
+class CanonicalNameTest(unittest.TestCase):
+    def test_normalisation(self):
+        self.assertEqual(canonical_name('Spinach-Artichoke Dip'), 'spinach artichoke dip')
+        self.assertEqual(canonical_name('Chicken & Shrimp Carbonara'), 'chicken and shrimp carbonara')
+        self.assertEqual(canonical_name('Chicken Alfredo (Serves 4-6'), 'chicken alfredo')
+        self.assertEqual(canonical_name('Crème Brûlée'), 'creme brulee')
+        self.assertEqual(canonical_name(None), '')
+
+
+class MenuIndexTest(unittest.TestCase):
+    def test_exact_match_ignores_punctuation(self):
+        match = MenuIndex(TITLES).lookup('spinach artichoke dip')
+        self.assertEqual((match['title'], match['method'], match['score']), ('Spinach-Artichoke Dip', 'exact', 1.0))
+        self.assertFalse(match['ambiguous'])
+
+    def test_fuzzy_match_above_threshold(self):
+        match = MenuIndex(TITLES).lookup('Chicken Alfredos')
+        self.assertEqual((match['title'], match['method']), ('Chicken Alfredo', 'fuzzy'))
+        self.assertGreaterEqual(match['score'], 0.75)
+        self.assertFalse(match['ambiguous'])
+
+    def test_below_threshold_is_rejected_but_reported(self):
+        match = MenuIndex(TITLES).lookup('Shrimp Carbonara')
+        self.assertIsNone(match['title'])
+        self.assertIsNone(match['method'])
+        self.assertEqual(match['candidates'][0][0], 'Chicken and Shrimp Carbonara')
+        self.assertAlmostEqual(match['score'], 0.696, places=3)
+        # 降低阈值后同一个候选被接受
+        self.assertEqual(MenuIndex(TITLES, threshold=0.6).lookup('Shrimp Carbonara')['title'],
+                         'Chicken and Shrimp Carbonara')
+
+    def test_threshold_one_only_accepts_exact(self):
+        index = MenuIndex(TITLES, threshold=1.0)
+        self.assertIsNone(index.lookup('Chicken Alfredos')['title'])
+        self.assertEqual(index.lookup('CHICKEN ALFREDO')['method'], 'exact')
+
+    def test_tie_within_margin_is_ambiguous(self):
+        match = MenuIndex(TITLES).lookup('Dipping Sauces Includes Breadsticks')
+        self.assertTrue(match['ambiguous'])
+        self.assertEqual([title for title, _ in match['candidates'][:2]], TITLES[:2])
+        self.assertEqual(match['candidates'][0][1], match['candidates'][1][1])
+
+    def test_margin_controls_ambiguity(self):
+        titles = ['Chicken Alfredo', 'Chicken Alfreda']
+        self.assertTrue(MenuIndex(titles).lookup('Chicken Alfredx')['ambiguous'])
+        self.assertFalse(MenuIndex(titles, margin=0.0).lookup('Chicken Alfredx')['ambiguous'])
+
+    def test_runner_up_below_threshold_is_not_ambiguous(self):
+        # 次高分低于阈值时即使与最高分接近也不算歧义
+        match = MenuIndex(['Chicken Alfredo', 'Chicken Alfreda'], threshold=0.8, margin=0.5).lookup('Chicken Alfredos')
+        self.assertEqual(match['title'], 'Chicken Alfredo')
+        self.assertLess(match['candidates'][1][1], 0.8)
+        self.assertFalse(match['ambiguous'])
+
+    def test_duplicate_canonical_names_are_ambiguous(self):
+        match = MenuIndex(['Breadsticks (V)', 'Breadsticks (GF)']).lookup('Breadsticks')
+        self.assertEqual(match['method'], 'exact')
+        self.assertTrue(match['ambiguous'])
+
+    def test_empty_query(self):
+        match = MenuIndex(TITLES).lookup('(V)')
+        self.assertIsNone(match['title'])
+        self.assertEqual(match['candidates'], [])
+
+
+class MergeAmbiguousTest(unittest.TestCase):
+    MENU = {'SOUPS': {'items': [
+        {'title': 'Dipping Sauces Includes Breadsticks (V) 4oz', 'calories': '90 cal.'},
+        {'title': 'Dipping Sauces Includes Breadsticks (V) 8oz', 'calories': '180 cal.'},
+        {'title': 'Chicken Alfredo', 'calories': '1010 cal.'},
+    ]}}
+    ORDER = [{'name': 'Soups', 'menuItems': [{'name': 'Dipping Sauces Includes Breadsticks'},
+                                             {'name': 'Chicken Alfredos'}]}]
+
+    def merge(self, **options):
+        menu, not_found, match_log = merge_menus(compile_menu(self.MENU), self.ORDER, {'Soups': 'SOUPS'}, {},
+                                                 **options)
+        return {item['title']: item['calories'] for item in menu['Soups']['items']}, not_found, match_log
+
+    def test_ambiguous_match_is_not_accepted_by_default(self):
+        calories, not_found, match_log = self.merge()
+        self.assertEqual(calories, {'Dipping Sauces Includes Breadsticks': 'N/A', 'Chicken Alfredos': '1010 cal.'})
+        self.assertEqual(len(not_found), 1)
+        self.assertIn('歧义', not_found[0])
+        self.assertEqual([entry['accepted'] for entry in match_log], [False, True])
+
+    def test_accept_ambiguous_takes_the_best_candidate(self):
+        calories, not_found, _ = self.merge(accept_ambiguous=True)
+        self.assertEqual(calories['Dipping Sauces Includes Breadsticks'], '90 cal.')
+        self.assertEqual(not_found, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
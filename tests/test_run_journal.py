@@ -0,0 +1,80 @@
+"""run_journal：中断后重放完成日志。"""
+import json
+import os
+import tempfile
+import unittest
+
+from run_journal import RunJournal
+
+
+class RunJournalTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.directory = self._tmp.name
+        self.output_dir = os.path.join(self.directory, 'out')
+        os.makedirs(self.output_dir)
+        self.path = os.path.join(self.directory, 'journal', 'journal.jsonl')
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def record(self, journal, url, filename):
+        open(os.path.join(self.output_dir, filename), 'wb').close()
+        journal.record(url, new_url=f'/images/{filename}', output_dir=self.output_dir,
+                       output_filename=filename, width=10, height=20)
+
+    def test_replay_ignores_partial_last_line(self):
+        journal = RunJournal(self.path)
+        self.record(journal, 'https://a/1.png', '1.webp')
+        self.record(journal, 'https://a/2.png', '2.webp')
+        journal.close()
+        # 模拟写入最后一行时崩溃
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('{"url": "https://a/3.png", "new_url": "/ima')
+
+        resumed = RunJournal(self.path)
+        self.assertEqual(len(resumed), 2)
+        self.assertEqual(resumed.lookup('https://a/2.png', self.output_dir)['new_url'], '/images/2.webp')
+        self.assertIsNone(resumed.lookup('https://a/3.png', self.output_dir))
+
+        # 继续追加的记录不会和不完整的行粘在一起
+        self.record(resumed, 'https://a/3.png', '3.webp')
+        resumed.close()
+        replayed = RunJournal(self.path)
+        self.assertEqual(len(replayed), 3)
+        self.assertEqual(replayed.lookup('https://a/3.png', self.output_dir)['output_filename'], '3.webp')
+        replayed.close()
+
+    def test_later_entry_wins_and_missing_output_is_skipped(self):
+        journal = RunJournal(self.path)
+        self.record(journal, 'https://a/1.png', 'old.webp')
+        self.record(journal, 'https://a/1.png', 'new.webp')
+        self.record(journal, 'https://a/2.png', 'gone.webp')
+        journal.close()
+        os.remove(os.path.join(self.output_dir, 'gone.webp'))
+
+        resumed = RunJournal(self.path)
+        self.assertEqual(resumed.lookup('https://a/1.png', self.output_dir)['output_filename'], 'new.webp')
+        self.assertIsNone(resumed.lookup('https://a/2.png', self.output_dir))
+        self.assertIsNone(resumed.lookup('https://a/1.png', self.directory))
+        resumed.close()
+
+    def test_non_object_lines_are_ignored(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('[1, 2]\n' + json.dumps({'new_url': 'no url'}) + '\n\n')
+        journal = RunJournal(self.path)
+        self.assertEqual(len(journal), 0)
+        journal.close()
+
+    def test_discard_removes_journal_and_created_directory(self):
+        journal = RunJournal(self.path)
+        self.record(journal, 'https://a/1.png', '1.webp')
+        journal.discard()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(os.path.dirname(self.path)))
+        self.assertEqual(len(journal), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""webp_container：写入 EXIF / XMP 时的 VP8X 转换与往返。"""
+import io
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+
+import webp_container
+from webp_container import (
+    ALPHA_FLAG, EXIF_FLAG, XMP_FLAG, build_comment_exif, build_comment_xmp, build_webp, content_digest,
+    parse_chunks, probe_dimensions, set_metadata,
+)
+
+
+def encode_webp(mode, size, **options):
+    img = Image.new(mode, size, (200, 40, 40, 128) if mode == 'RGBA' else (200, 40, 40))
+    buffer = io.BytesIO()
+    img.save(buffer, 'WEBP', **options)
+    return buffer.getvalue()
+
+
+def decode_pixels(data):
+    with Image.open(io.BytesIO(data)) as img:
+        return img.mode, img.size, img.tobytes()
+
+
+class SetMetadataTest(unittest.TestCase):
+    def test_simple_lossy_is_promoted_to_vp8x(self):
+        data = encode_webp('RGB', (37, 21), quality=80)
+        self.assertEqual(parse_chunks(data)[0][0], b'VP8 ')
+
+        stamped = set_metadata(data, exif=build_comment_exif('source-hash: abc'))
+        chunks = parse_chunks(stamped)
+        self.assertEqual([fourcc for fourcc, _ in chunks], [b'VP8X', b'VP8 ', b'EXIF'])
+        flags = chunks[0][1][0]
+        self.assertTrue(flags & EXIF_FLAG)
+        self.assertFalse(flags & (XMP_FLAG | ALPHA_FLAG))
+        # VP8X 画布尺寸与位流一致，像素原样保留
+        self.assertEqual(webp_container.bitstream_info(*chunks[0])[:2], (37, 21))
+        self.assertEqual(decode_pixels(stamped), decode_pixels(data))
+        self.assertEqual(content_digest(stamped), content_digest(data))
+
+    def test_lossless_alpha_keeps_alpha_flag(self):
+        data = encode_webp('RGBA', (16, 9), lossless=True)
+        self.assertEqual(parse_chunks(data)[0][0], b'VP8L')
+
+        stamped = set_metadata(data, xmp=build_comment_xmp('a & b'))
+        chunks = parse_chunks(stamped)
+        self.assertEqual(chunks[0][0], b'VP8X')
+        self.assertTrue(chunks[0][1][0] & ALPHA_FLAG)
+        self.assertTrue(chunks[0][1][0] & XMP_FLAG)
+        self.assertEqual(decode_pixels(stamped), decode_pixels(data))
+
+    def test_round_trip_replaces_without_duplicating(self):
+        data = encode_webp('RGB', (8, 8), quality=50)
+        first = set_metadata(data, exif=build_comment_exif('first'), xmp=build_comment_xmp('kept'))
+        second = set_metadata(first, exif=build_comment_exif('second'))
+        chunks = parse_chunks(second)
+
+        self.assertEqual([fourcc for fourcc, _ in chunks], [b'VP8X', b'VP8 ', b'EXIF', b'XMP '])
+        self.assertIn(b'second', dict(chunks)[b'EXIF'])
+        self.assertNotIn(b'first', dict(chunks)[b'EXIF'])
+        self.assertEqual(dict(chunks)[b'XMP '], build_comment_xmp('kept'))
+        # 已经是 VP8X 的文件再次写入时结果稳定
+        self.assertEqual(set_metadata(second, exif=build_comment_exif('second')), second)
+        with Image.open(io.BytesIO(second)) as img:
+            self.assertIn(b'second', img.info['exif'])
+
+    def test_exif_prefix_is_stripped(self):
+        data = encode_webp('RGB', (4, 4))
+        exif = build_comment_exif('prefixed')
+        self.assertEqual(set_metadata(data, exif=b'Exif\x00\x00' + exif), set_metadata(data, exif=exif))
+
+    def test_odd_sized_chunks_are_padded(self):
+        chunks = [(b'VP8X', bytes(10)), (b'ABCD', b'odd'), (b'EXIF', b'12345')]
+        data = build_webp(chunks)
+        self.assertEqual(len(data) % 2, 0)
+        self.assertEqual(parse_chunks(data), chunks)
+
+    def test_probe_dimensions_after_promotion(self):
+        stamped = set_metadata(encode_webp('RGB', (300, 17)), exif=build_comment_exif('x'))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'image.webp')
+            with open(path, 'wb') as f:
+                f.write(stamped)
+            self.assertEqual(probe_dimensions(path), (300, 17))
+
+    def test_rejects_non_webp(self):
+        with self.assertRaises(webp_container.WebPFormatError):
+            set_metadata(b'\x89PNG\r\n\x1a\n' + bytes(16), exif=b'x')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,183 @@
+"""
+WebP (RIFF) 容器的读写工具，只依赖标准库。
+
+用于在已编码的 WebP 字节中直接插入或替换 EXIF / XMP 块：不解码、不重新编码，
+同时修正 VP8X 标志位和 RIFF 大小字段。
+"""
+import hashlib
+import struct
+
+# VP8X 标志位
+ICC_FLAG = 0x20
+ALPHA_FLAG = 0x10
+EXIF_FLAG = 0x08
+XMP_FLAG = 0x04
+ANIMATION_FLAG = 0x02
+
+# 扩展格式中图像数据之前/之后允许出现的块
+_LEADING_CHUNKS = (b'VP8X', b'ICCP', b'ANIM')
+_METADATA_CHUNKS = (b'EXIF', b'XMP ')
+# 读取尺寸所需的文件头长度：RIFF 头 12 字节 + 块头 8 字节 + VP8 帧头 10 字节
+PROBE_BYTES = 30
+
+
+class WebPFormatError(ValueError):
+    """数据不是有效的 WebP 文件。"""
+
+
+def parse_chunks(data):
+    """把 WebP 文件拆分为 [(fourcc, payload), ...]。"""
+    if len(data) < 12 or data[:4] != b'RIFF' or data[8:12] != b'WEBP':
+        raise WebPFormatError('缺少 RIFF/WEBP 文件头')
+    chunks = []
+    offset = 12
+    end = min(len(data), 8 + struct.unpack('<I', data[4:8])[0])
+    while offset + 8 <= end:
+        fourcc = data[offset:offset + 4]
+        size = struct.unpack('<I', data[offset + 4:offset + 8])[0]
+        payload = data[offset + 8:offset + 8 + size]
+        if len(payload) != size:
+            raise WebPFormatError(f'块 {fourcc!r} 被截断')
+        chunks.append((fourcc, payload))
+        # 块大小为奇数时有一个字节的填充
+        offset += 8 + size + (size & 1)
+    if not chunks:
+        raise WebPFormatError('WebP 文件中没有任何块')
+    return chunks
+
+
+def build_webp(chunks):
+    """把 [(fourcc, payload), ...] 重新拼装为 WebP 字节，并计算 RIFF 大小。"""
+    body = bytearray(b'WEBP')
+    for fourcc, payload in chunks:
+        body += fourcc + struct.pack('<I', len(payload)) + payload
+        if len(payload) & 1:
+            body += b'\x00'
+    return b'RIFF' + struct.pack('<I', len(body)) + bytes(body)
+
+
+def bitstream_info(fourcc, payload):
+    """
+    从 VP8 / VP8L / VP8X 块中读取 (宽, 高, 是否有alpha)，无法识别时返回 None。
+    只读取几个字节的头部，不解码图像。
+    """
+    if fourcc == b'VP8X' and len(payload) >= 10:
+        width = 1 + int.from_bytes(payload[4:7], 'little')
+        height = 1 + int.from_bytes(payload[7:10], 'little')
+        return width, height, bool(payload[0] & ALPHA_FLAG)
+    if fourcc == b'VP8 ' and len(payload) >= 10 and payload[3:6] == b'\x9d\x01\x2a':
+        width = struct.unpack('<H', payload[6:8])[0] & 0x3FFF
+        height = struct.unpack('<H', payload[8:10])[0] & 0x3FFF
+        return width, height, False
+    if fourcc == b'VP8L' and len(payload) >= 5 and payload[0] == 0x2F:
+        bits = struct.unpack('<I', payload[1:5])[0]
+        width = (bits & 0x3FFF) + 1
+        height = ((bits >> 14) & 0x3FFF) + 1
+        return width, height, bool((bits >> 28) & 1)
+    return None
+
+
+def probe_dimensions(path):
+    """
+    只读取文件开头的 30 个字节（RIFF 头 + 第一个块的头部），返回 WebP 的 (宽, 高)。
+    文件不是 WebP 或无法识别时返回 None。不依赖 Pillow。
+    """
+    with open(path, 'rb') as f:
+        head = f.read(PROBE_BYTES)
+    if len(head) < 20 or head[:4] != b'RIFF' or head[8:12] != b'WEBP':
+        return None
+    info = bitstream_info(head[12:16], head[20:])
+    return info[:2] if info else None
+
+
+def _make_vp8x(flags, width, height):
+    return bytes([flags, 0, 0, 0]) + (width - 1).to_bytes(3, 'little') + (height - 1).to_bytes(3, 'little')
+
+
+def set_metadata(data, exif=None, xmp=None):
+    """
+    返回插入（或替换）了 EXIF / XMP 块的新 WebP 字节。exif 为 TIFF 格式的原始字节（不含 'Exif\\0\\0' 前缀）。
+    简单格式 (只有 VP8/VP8L) 的文件会被转换为扩展格式 (VP8X)；像素数据原样保留。
+    """
+    if exif is None and xmp is None:
+        return data
+    if exif is not None and exif.startswith(b'Exif\x00\x00'):
+        exif = exif[6:]
+
+    chunks = parse_chunks(data)
+    replace = set()
+    if exif is not None:
+        replace.add(b'EXIF')
+    if xmp is not None:
+        replace.add(b'XMP ')
+    kept_metadata = [(fourcc, payload) for fourcc, payload in chunks
+                     if fourcc in _METADATA_CHUNKS and fourcc not in replace]
+    others = [(fourcc, payload) for fourcc, payload in chunks if fourcc not in _METADATA_CHUNKS]
+
+    if others[0][0] == b'VP8X':
+        vp8x = bytearray(others[0][1])
+        rest = others[1:]
+    else:
+        info = bitstream_info(*others[0])
+        if info is None:
+            raise WebPFormatError(f'无法识别的图像块 {others[0][0]!r}')
+        width, height, has_alpha = info
+        vp8x = bytearray(_make_vp8x(ALPHA_FLAG if has_alpha else 0, width, height))
+        rest = others
+
+    metadata = []
+    exif_payload = exif if exif is not None else dict(kept_metadata).get(b'EXIF')
+    xmp_payload = xmp if xmp is not None else dict(kept_metadata).get(b'XMP ')
+    if exif_payload is not None:
+        metadata.append((b'EXIF', exif_payload))
+        vp8x[0] |= EXIF_FLAG
+    if xmp_payload is not None:
+        metadata.append((b'XMP ', xmp_payload))
+        vp8x[0] |= XMP_FLAG
+
+    # 规范要求的顺序: VP8X, ICCP, ANIM, 图像数据, EXIF, XMP, 其他未知块
+    leading = [chunk for chunk in rest if chunk[0] in _LEADING_CHUNKS]
+    image = [chunk for chunk in rest if chunk[0] not in _LEADING_CHUNKS]
+    return build_webp([(b'VP8X', bytes(vp8x))] + leading + image + metadata)
+
+
+def build_comment_exif(comment):
+    """
+    构造只包含 UserComment 的最小 EXIF (小端 TIFF)，不依赖 piexif。
+    结构: TIFF 头 -> IFD0 (ExifIFD 指针) -> Exif IFD (UserComment) -> 注释数据。
+    """
+    value = b'ASCII\x00\x00\x00' + comment.encode('ascii', 'replace')
+    ifd0_offset = 8
+    exif_ifd_offset = ifd0_offset + 2 + 12 + 4
+    value_offset = exif_ifd_offset + 2 + 12 + 4
+    header = b'II' + struct.pack('<HI', 42, ifd0_offset)
+    # 类型 4 = LONG，类型 7 = UNDEFINED
+    ifd0 = struct.pack('<H', 1) + struct.pack('<HHII', 0x8769, 4, 1, exif_ifd_offset) + struct.pack('<I', 0)
+    exif_ifd = struct.pack('<H', 1) + struct.pack('<HHII', 0x9286, 7, len(value), value_offset) + struct.pack('<I', 0)
+    return header + ifd0 + exif_ifd + value
+
+
+def build_comment_xmp(comment):
+    """构造只包含 dc:description 的最小 XMP 数据包。"""
+    escaped = comment.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    return (
+        '<?xpacket begin="﻿" id="W5M0MpCehiHzreSzNTczkc9d"?>'
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+        '<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+        f'<dc:description>{escaped}</dc:description>'
+        '</rdf:Description></rdf:RDF></x:xmpmeta><?xpacket end="w"?>'
+    ).encode('utf-8')
+
+
+def content_digest(data):
+    """
+    只对图像相关的块（不含 EXIF/XMP）计算 SHA-256。重新写入标记不会改变该值，
+    可用于为已存在的 WebP 生成可复现的标记。
+    """
+    digest = hashlib.sha256()
+    for fourcc, payload in parse_chunks(data):
+        # VP8X 的标志位随元数据变化，画布尺寸由图像块决定，因此也不计入
+        if fourcc in _METADATA_CHUNKS or fourcc == b'VP8X':
+            continue
+        digest.update(fourcc + payload)
+    return digest.hexdigest()